@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Resource, Exam, LTIConsumer, LTI_11_Consumer, LTI_13_Consumer, LTIConsumerRegistrationToken, SebSettings
+from django.utils import timezone
+from .models import Resource, Exam, LTIConsumer, LTI_11_Consumer, LTI_13_Consumer, LTIConsumerRegistrationToken, SebSettings, PendingOutcomeReport
 # Register your models here.
 
 class LTI_11_ConsumerInline(admin.TabularInline):
@@ -17,3 +18,14 @@ admin.site.register(Resource)
 admin.site.register(Exam)
 admin.site.register(LTIConsumerRegistrationToken)
 admin.site.register(SebSettings)
+
+@admin.register(PendingOutcomeReport)
+class PendingOutcomeReportAdmin(admin.ModelAdmin):
+    list_display = ['user', 'resource', 'consumer', 'num_attempts', 'next_attempt_time', 'dead']
+    list_filter = ['dead', 'consumer']
+    raw_id_fields = ['user', 'resource']
+    actions = ['retry_now']
+
+    @admin.action(description='Send the selected reports again now')
+    def retry_now(self, request, queryset):
+        queryset.update(dead=False, num_attempts=0, next_attempt_time=timezone.now())
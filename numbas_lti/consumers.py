@@ -1,11 +1,14 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from django_auth_lti.patch_reverse import reverse
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.translation import gettext as _
+import functools
 import json
 from urllib.parse import parse_qs
 
@@ -14,62 +17,105 @@ from .groups import group_for_attempt, group_for_resource_stats, group_for_resou
 from .models import Attempt, ScormElement, Resource, ReportProcess, EditorLink
 from .report_outcome import ReportOutcomeException
 from .save_scorm_data import save_scorm_data
-
-class ModelWebsocketConsumer(WebsocketConsumer):
+from .scorm_buffer import get_scorm_data_buffer
+
+# SCORM data sent over websockets is saved on a fixed pool of threads, so that the number of database connections used doesn't grow with the number of open sockets.
+scorm_data_executor = ThreadPoolExecutor(
+    max_workers = getattr(settings, 'WEBSOCKET_DATABASE_THREADS', 8),
+    thread_name_prefix = 'scorm-data'
+)
+
+def database_write(fn):
+    """
+        Run ``fn`` on the pool of threads used to save SCORM data.
+    """
+    return database_sync_to_async(fn, thread_sensitive=False, executor=scorm_data_executor)
+
+@database_write
+def save_attempt_scorm_data(attempt, batches):
+    """
+        Save batches of SCORM data for an attempt.
+
+        The attempt object is cached for the lifetime of the connection, so first reload the fields that can change while it's open.
+        Returns the same as ``save_scorm_data``, followed by the attempt's completion status.
+    """
+    attempt.refresh_from_db(fields=['completion_status', 'end_time'])
+    done, unsaved_elements = save_scorm_data(attempt, batches)
+    return done, unsaved_elements, attempt.completion_status
+
+@functools.partial(sync_to_async, thread_sensitive=False, executor=scorm_data_executor)
+def append_to_buffer(buffer, attempt, batches):
+    buffer.append(attempt.pk, batches)
+
+class ModelWebsocketConsumer(AsyncWebsocketConsumer):
     model = None
     pk_kwarg = 'pk'
 
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    @database_sync_to_async
     def get_object(self):
         pk = self.scope['url_route']['kwargs'][self.pk_kwarg]
-        return self.model.objects.get(pk=pk)
+        return self.get_queryset().get(pk=pk)
 
 class AttemptConsumer(ModelWebsocketConsumer):
     model = Attempt
 
-    def connect(self):
-        self.accept()
-        attempt = self.attempt = self.get_object()
+    def get_queryset(self):
+        return Attempt.objects.select_related('resource', 'user')
+
+    async def connect(self):
+        await self.accept()
+        attempt = self.attempt = await self.get_object()
         self.attempt_group = group_for_attempt(attempt)
-        async_to_sync(self.channel_layer.group_add)(self.attempt_group,self.channel_name)
+        await self.channel_layer.group_add(self.attempt_group,self.channel_name)
 
-        self.resource_group = group_for_resource(self.attempt.resource)
-        async_to_sync(self.channel_layer.group_add)(self.resource_group,self.channel_name)
+        self.resource_group = group_for_resource(attempt.resource)
+        await self.channel_layer.group_add(self.resource_group,self.channel_name)
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(self.attempt_group, self.channel_name)
-        async_to_sync(self.channel_layer.group_discard)(self.resource_group, self.channel_name)
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'resource_group'):
+            return
+        await self.channel_layer.group_discard(self.attempt_group, self.channel_name)
+        await self.channel_layer.group_discard(self.resource_group, self.channel_name)
 
-    def receive(self, text_data):
+    async def receive(self, text_data):
         packet = json.loads(text_data)
         if packet.get('type') != 'scorm.elements':
             return
         batches = {packet['id']: packet['data']}
-        attempt = self.get_object()
-        done, unsaved_elements = save_scorm_data(attempt,batches)
+        buffer = get_scorm_data_buffer()
+        if buffer is not None:
+            # The data will be saved by the buffer's flusher.
+            await append_to_buffer(buffer, self.attempt, batches)
+            done, unsaved_elements, completion_status = list(batches.keys()), [], self.attempt.completion_status
+        else:
+            done, unsaved_elements, completion_status = await save_attempt_scorm_data(self.attempt, batches)
         response = {
             'received': done,
-            'completion_status': attempt.completion_status,
+            'completion_status': completion_status,
             'unsaved_elements': unsaved_elements,
         }
-        self.send(text_data=json.dumps(response))
+        await self.send(text_data=json.dumps(response))
 
     # Message handlers
 
-    def websocket_connected(self,message):
+    async def websocket_connected(self,message):
         pass
 
-    def availability_changed(self,message):
+    async def availability_changed(self,message):
         pass
 
-    def completion_status_changed(self,message):
+    async def completion_status_changed(self,message):
         pass
 
-    def scorm_new_element(self,message):
+    async def scorm_new_elements(self,message):
         pass
 
 class RunAttemptConsumer(AttemptConsumer):
-    def connect(self):
-        super().connect()
+    async def connect(self):
+        await super().connect()
 
         query = parse_qs(self.scope['query_string'].decode('utf-8'))
         uid = query.get('uid',[''])[0]
@@ -78,37 +124,43 @@ class RunAttemptConsumer(AttemptConsumer):
         if mode!='review':
             # You can only have an attempt open in one place at a time:
             # tell all other connected clients that this client has connected, so that they can disable their Numbas interface
-            async_to_sync(self.channel_layer.group_send)(self.attempt_group, {'type': 'websocket.connected', 'current_uid': uid, 'availability_dates':self.attempt.resource.availability_json(self.attempt.user)})
+            availability_dates = await self.availability_json()
+            await self.channel_layer.group_send(self.attempt_group, {'type': 'websocket.connected', 'current_uid': uid, 'availability_dates': availability_dates})
+
+    @database_sync_to_async
+    def availability_json(self):
+        resource = Resource.objects.get(pk=self.attempt.resource_id)
+        return resource.availability_json(self.attempt.user)
 
-    def websocket_connected(self,message):
-        self.send(json.dumps(message))
+    async def websocket_connected(self,message):
+        await self.send(json.dumps(message))
 
-    def availability_changed(self,message):
-        attempt = self.get_object()
+    async def availability_changed(self,message):
         data = {
             'type': 'availability.changed',
-            'availability_dates': attempt.resource.availability_json(attempt.user),
+            'availability_dates': await self.availability_json(),
         }
-        self.send(json.dumps(data))
+        await self.send(json.dumps(data))
 
-    def completion_status_changed(self,message):
-        self.send(json.dumps(message))
+    async def completion_status_changed(self,message):
+        self.attempt.completion_status = message['completion_status']
+        await self.send(json.dumps(message))
 
 
 class AttemptScormListingConsumer(AttemptConsumer):
-    def scorm_new_element(self,message):
-        self.send(json.dumps(message))
+    async def scorm_new_elements(self,message):
+        await self.send(json.dumps(message))
 
 class ResourceStatsConsumer(ModelWebsocketConsumer):
     model = Resource
 
-    def connect(self):
-        resource = self.get_object()
-        self.accept()
-        group = group_for_resource_stats(resource)
-        async_to_sync(self.channel_layer.group_add)(group, self.channel_name)
+    async def connect(self):
+        resource = await self.get_object()
+        await self.accept()
+        self.group = group_for_resource_stats(resource)
+        await self.channel_layer.group_add(self.group, self.channel_name)
 
-    def disconnect(self, close_code):
-        resource = self.get_object()
-        group = group_for_resource_stats(resource)
-        async_to_sync(self.channel_layer.group_discard)(group, self.channel_name)
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'group'):
+            return
+        await self.channel_layer.group_discard(self.group, self.channel_name)
@@ -12,53 +12,91 @@ def escape(s):
 def unescape(s):
     return re.sub(r'\\[\\n]',lambda m: '\n' if m[0][1]=='n' else '\\',s)
 
-def make_diff(a, b):
+# The default time, in seconds, to spend looking for a minimal diff.
+DEFAULT_TIMEOUT = 1.0
+
+# The default maximum combined length of two strings to look for a diff between.
+DEFAULT_MAX_LENGTH = 2000000
+
+def full_value_diff(a, b):
+    """
+        A diff which replaces the whole of ``a`` with ``b``.
+    """
+    return f'r0,{len(a):x},{escape(b)}'
+
+def make_diff(a, b, timeout=DEFAULT_TIMEOUT, max_length=DEFAULT_MAX_LENGTH):
+    """
+        Make a diff which turns the string ``a`` into the string ``b``.
+
+        No more than ``timeout`` seconds are spent looking for a minimal diff; after that, the best diff found so far is used.
+        If the strings are longer than ``max_length`` characters in total, or the diff would be longer than just replacing the whole string, a diff replacing the whole of ``a`` with ``b`` is returned.
+    """
+    if a == b:
+        return ''
+
+    full = full_value_diff(a, b)
+
+    if max_length is not None and len(a)+len(b) > max_length:
+        return full
+
     dmp = diff_match_patch()
+    dmp.Diff_Timeout = timeout or 0
 
     i = 0
     j = 0
     diffs = dmp.diff_main(a, b)
     output = []
+    size = 0
     for n, (op, s) in enumerate(diffs):
         l = len(s)
         if op == diff_match_patch.DIFF_EQUAL:
             i += l
             j += l
+            continue
         elif op == diff_match_patch.DIFF_DELETE:
             output.append(f'd{i:x},{i+l:x}')
             i += l
         elif op == diff_match_patch.DIFF_INSERT:
             es = escape(s)
             if n>0 and diffs[n-1][0] == diff_match_patch.DIFF_DELETE:
-                output.pop()
+                size -= len(output.pop()) + 1
                 output.append(f'r{i-len(diffs[n-1][1]):x},{i:x},{es}')
             else:
                 output.append(f'i{i:x},{es}')
             j += l
+        size += len(output[-1]) + 1
+        if size > len(full):
+            return full
     return '\n'.join(output)
 
 
 def apply_diff(d,a):
-    ops = d.split('\n')
-    o = 0
-    for op in ops:
+    """
+        Apply the diff ``d`` to the string ``a``.
+
+        The positions in the operations refer to the original string ``a``, and operations are in increasing order of position, so the output is built in one pass over ``a``.
+    """
+    segments = []
+    pos = 0
+    for op in d.split('\n'):
         if not op:
             continue
         if op[0]=='d':
             i1,i2 = [int(x,16) for x in op[1:].split(',')]
-            a = a[:o+i1]+a[i2+o:]
-            o -= (i2-i1)
+            segments.append(a[pos:i1])
+            pos = i2
         elif op[0]=='i':
-            bits = op[1:].split(',')
-            i = int(bits[0],16)
-            s = unescape(','.join(bits[1:]))
-            a = a[:i+o]+s+a[i+o:]
-            o += len(s)
+            i, s = op[1:].split(',',1)
+            i = int(i,16)
+            segments.append(a[pos:i])
+            segments.append(unescape(s))
+            pos = i
         elif op[0]=='r':
-            bits = op[1:].split(',')
-            i1 = int(bits[0],16)
-            i2 = int(bits[1],16)
-            s = unescape(','.join(bits[2:]))
-            a = a[:i1+o]+s+a[i2+o:]
-            o += len(s)-(i2-i1)
-    return a
+            i1, i2, s = op[1:].split(',',2)
+            i1 = int(i1,16)
+            i2 = int(i2,16)
+            segments.append(a[pos:i1])
+            segments.append(unescape(s))
+            pos = i2
+    segments.append(a[pos:])
+    return ''.join(segments)
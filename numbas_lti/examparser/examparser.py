@@ -11,6 +11,10 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+
+# This file was copied from the Numbas compiler, but has since diverged: the scanning functions use regular expressions.
+# Don't overwrite it with the compiler's copy; merge any changes by hand.
+
 import sys
 import re
 try:
@@ -27,6 +31,14 @@ except NameError:
     basestring = str
     strcons = str
 
+# whitespace, and any comments running to the end of a line
+re_space_and_comments = re.compile(r'\s*(?://[^\n]*\n?\s*)*')
+# whitespace other than line breaks
+re_inline_space = re.compile(r'[ \t\r\x0b\x0c]*')
+# an undelimited literal: everything up to a closing bracket, a line break, a comma, a colon or a comment
+re_undelimited = re.compile(r'[^\]}\n,:/]*(?:/(?!/)[^\]}\n,:/]*)*')
+re_name = re.compile(r'^[\w_]*\'*$')
+
 class ParseError(Exception):
     def __init__(self,parser,message,hint=''):
         self.expression = parser.source[parser.cursor:parser.cursor+50]
@@ -54,20 +66,12 @@ class ExamParser:
 
         return self.data
 
-    #scan past comments
+    #scan past whitespace and comments
     def lstripcomments(self):
-        os=self.source[self.cursor:]
-        s = os.lstrip()
-        s=s.lstrip()    #get rid of leading whitespace
-
-        while s[:2]=='//':
-            s=s[s.find('\n')+1:].lstrip()
-        self.cursor += len(os)-len(s)
+        self.cursor = re_space_and_comments.match(self.source,self.cursor).end()
 
     def stripspace(self):
-        os = self.source[self.cursor:]
-        s=os.lstrip(' \t\r\x0b\x0c')
-        self.cursor += len(os)-len(s)
+        self.cursor = re_inline_space.match(self.source,self.cursor).end()
 
     def getthing(self):
         self.lstripcomments()
@@ -80,13 +84,15 @@ class ExamParser:
 
             obj = OrderedDict()
             while self.cursor<len(self.source) and self.source[self.cursor]!='}':
-                i=self.cursor
-                namere = re.compile(r'^[\w_]*\'*$')
-                while i<len(self.source) and self.source[i]!=':':
-                    name = self.source[self.cursor:i+1].strip()
-                    if(not namere.match(name)):
-                        raise ParseError(self,"Invalid name '%s' for an object property" % name,"check for mismatched brackets")
-                    i+=1
+                i = self.source.find(':',self.cursor)
+                if i==-1:
+                    i = len(self.source)
+                if not re_name.match(self.source[self.cursor:i].strip()):
+                    # find the shortest invalid name, to report it
+                    for j in range(self.cursor,i):
+                        name = self.source[self.cursor:j+1].strip()
+                        if(not re_name.match(name)):
+                            raise ParseError(self,"Invalid name '%s' for an object property" % name,"check for mismatched brackets")
                 if i==len(self.source):
                     raise ParseError(self,"Expected a colon")
 
@@ -149,9 +155,9 @@ class ExamParser:
 
         elif f=='"':    #string literal - double quotes
             if self.source[self.cursor:self.cursor+3]=='"""':    #triple-quoted  string
-                i=self.cursor+3
-                while i<len(self.source)-2 and self.source[i:i+3]!='"""':
-                    i+=1
+                i=self.source.find('"""',self.cursor+3)
+                if i==-1:
+                    i=max(self.cursor+3,len(self.source)-2)
                 while i<len(self.source)-3 and self.source[i+3]=='"':    #grab extra double-quotes which are part of the string. e.g. """"hi"""" parses as the string "hi", with double-quotes included
                     i+=1
                 if i==len(self.source)-2:
@@ -159,9 +165,9 @@ class ExamParser:
                 string = self.source[self.cursor+3:i]
                 self.cursor = i+3
             else:
-                i=self.cursor+1
-                while i<len(self.source) and self.source[i]!='"':
-                    i+=1
+                i=self.source.find('"',self.cursor+1)
+                if i==-1:
+                    i=len(self.source)
                 if i==len(self.source):
                     raise ParseError(self,'Expected " to end string literal')
                 string = self.source[self.cursor+1:i]
@@ -169,9 +175,9 @@ class ExamParser:
             return string
         elif f=="'":    #string literal - single quotes
             if self.source[self.cursor:self.cursor+3]=="'''":    #triple-quoted  string
-                i=self.cursor+3
-                while i<len(self.source)-2 and self.source[i:i+3]!="'''":
-                    i+=1
+                i=self.source.find("'''",self.cursor+3)
+                if i==-1:
+                    i=max(self.cursor+3,len(self.source)-2)
                 while i<len(self.source)-3 and self.source[i+3]=="'":    #grab extra quotes which are part of the string. e.g. ''''hi'''' parses as the string "hi", with quotes included
                     i+=1
                 if i==len(self.source)-2:
@@ -179,19 +185,17 @@ class ExamParser:
                 string = self.source[self.cursor+3:i]
                 self.cursor = i+3
             else:
-                i=self.cursor+1
-                while i<len(self.source) and self.source[i]!="'":
-                    i+=1
+                i=self.source.find("'",self.cursor+1)
+                if i==-1:
+                    i=len(self.source)
                 if i==len(self.source):
                     raise ParseError(self,"Expected ' to end string literal")
                 string = self.source[self.cursor+1:i]
                 self.cursor = i+1
             return string
         else:    #undelimited literal
-            i=self.cursor
-            while i<len(self.source) and self.source[i] not in ']}\n,:' and self.source[i:i+2]!='//':
-                i+=1
-            
+            i=re_undelimited.match(self.source,self.cursor).end()
+
             v=self.source[self.cursor:i].strip()
             l=v.lower()
             if is_number(v):
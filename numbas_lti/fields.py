@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import models
+import base64
+import zlib
+
+# Stored values starting with this are compressed.
+COMPRESSED_PREFIX = '\x1bzlib:'
+
+# Stored values starting with this are stored as they are, after the prefix.
+# It's used for values which would otherwise look like they're compressed.
+RAW_PREFIX = '\x1braw:'
+
+def compress_value(value, threshold):
+    """
+        The form of a string to store in the database.
+
+        If the string is at least ``threshold`` characters long, it's compressed, as long as that makes it shorter.
+        If ``threshold`` is ``None``, the string is never compressed.
+    """
+    if value is None:
+        return None
+
+    if threshold is not None and len(value) >= threshold:
+        compressed = COMPRESSED_PREFIX + base64.b64encode(zlib.compress(value.encode('utf-8'))).decode('ascii')
+        if len(compressed) < len(value):
+            return compressed
+
+    if value.startswith(COMPRESSED_PREFIX) or value.startswith(RAW_PREFIX):
+        return RAW_PREFIX + value
+
+    return value
+
+def decompress_value(value):
+    """
+        The original form of a string stored by ``compress_value``.
+    """
+    if value is None:
+        return None
+
+    if value.startswith(COMPRESSED_PREFIX):
+        return zlib.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX):])).decode('utf-8')
+    elif value.startswith(RAW_PREFIX):
+        return value[len(RAW_PREFIX):]
+    else:
+        return value
+
+class CompressedTextField(models.TextField):
+    """
+        A text field whose long values are transparently compressed in the database.
+
+        Values at least ``SCORM_ELEMENT_COMPRESSION_THRESHOLD`` characters long are compressed when they're saved, and decompressed when they're loaded.
+        Lookups which compare the whole value, such as ``exact``, still work, but pattern lookups such as ``contains`` won't match compressed values.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_value(value)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return compress_value(value, self.compression_threshold())
+
+    def compression_threshold(self):
+        return getattr(settings, 'SCORM_ELEMENT_COMPRESSION_THRESHOLD', 1024)
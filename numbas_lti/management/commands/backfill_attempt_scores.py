@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from numbas_lti.models import Attempt
+from numbas_lti.scoring import store_total_scores
+
+class Command(BaseCommand):
+    help = 'Compute and store the raw and maximum scores of attempts which were saved before the scores were stored on the attempt.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100, help='The number of attempts to load at a time.')
+        parser.add_argument('--all', action='store_true', dest='all', help='Recompute the scores of every attempt, not just those which have no stored scores.')
+
+    def handle(self, *args, **options):
+        attempts = Attempt._base_manager.all()
+        if not options['all']:
+            attempts = attempts.filter(cached_raw_score__isnull=True)
+
+        def progress(done, total):
+            self.stdout.write(f'Scored {done}/{total} attempts')
+
+        num_changed = store_total_scores(attempts, chunk_size=options['chunk_size'], progress=progress)
+
+        self.stdout.write(f'The stored scores of {num_changed} attempts changed.')
@@ -0,0 +1,111 @@
+"""
+Compare the bulk SCORM data ingestion path with saving elements one at a time.
+
+All data created by this command is rolled back when it finishes.
+"""
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+import json
+import statistics
+import time
+import uuid
+
+from numbas_lti.models import Resource, Attempt, ScormElement
+from numbas_lti.save_scorm_data import scorm_elements_from_batches, insert_scorm_elements
+
+def make_batch(start, num_elements, suspend_data_size):
+    """
+        A batch of elements resembling the ones sent when a student starts an attempt.
+    """
+    elements = []
+    for i in range(num_elements):
+        n = i // 4
+        key = [
+            f'cmi.interactions.{n}.id',
+            f'cmi.interactions.{n}.weighting',
+            f'cmi.interactions.{n}.result',
+            f'cmi.interactions.{n}.learner_response',
+        ][i % 4]
+        elements.append({
+            'key': key,
+            'value': f'q{n}p0' if key.endswith('.id') else str(i),
+            'time_iso': (start + timedelta(microseconds=i)).isoformat(),
+            'counter': i,
+        })
+    elements.append({
+        'key': 'cmi.suspend_data',
+        'value': json.dumps({'questions': ['x' * 100] * (suspend_data_size // 100)}),
+        'time_iso': (start + timedelta(microseconds=num_elements)).isoformat(),
+        'counter': num_elements,
+    })
+    return elements
+
+def save_one_at_a_time(attempt, elements):
+    """
+        The ingestion path used before bulk insertion: one ``get_or_create`` per element.
+    """
+    for e, data in elements:
+        ScormElement.objects.get_or_create(
+            attempt = attempt,
+            key = e.key,
+            value = e.value,
+            time = e.time,
+            counter = e.counter
+        )
+
+def save_in_bulk(attempt, elements):
+    insert_scorm_elements(elements)
+
+def percentile(values, p):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p-1]
+
+class Command(BaseCommand):
+    help = 'Compare the number of queries and latency of the bulk SCORM data ingestion path with saving elements one at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batches', type=int, default=50, help='The number of batches to save with each method.')
+        parser.add_argument('--elements', type=int, default=200, help='The number of elements in each batch.')
+        parser.add_argument('--suspend-data-size', type=int, default=20000, help='The size in bytes of the suspend data element in each batch.')
+
+    def handle(self, *args, **options):
+        methods = [
+            ('one at a time', save_one_at_a_time),
+            ('bulk', save_in_bulk),
+        ]
+
+        with transaction.atomic():
+            user = User.objects.create(username='benchmark-'+uuid.uuid4().hex[:20])
+            # bulk_create is used so that the signal handlers for new resources and attempts aren't run.
+            resource, = Resource.objects.bulk_create([Resource(title='SCORM data ingestion benchmark', report_mark_time='manually')])
+
+            for name, method in methods:
+                attempt, = Attempt.objects.bulk_create([Attempt(resource=resource, user=user)])
+                attempt = Attempt.objects.get(pk=attempt.pk)
+
+                query_counts = []
+                durations = []
+                start = timezone.now()
+                for i in range(options['batches']):
+                    batch = make_batch(start + timedelta(seconds=i), options['elements'], options['suspend_data_size'])
+                    done, elements = scorm_elements_from_batches(attempt, {i: batch})
+                    with CaptureQueriesContext(connection) as queries:
+                        t1 = time.perf_counter()
+                        with transaction.atomic():
+                            method(attempt, elements)
+                        t2 = time.perf_counter()
+                    query_counts.append(len(queries.captured_queries))
+                    durations.append((t2-t1)*1000)
+
+                self.stdout.write(
+                    f'{name}: {statistics.mean(query_counts):.1f} queries per batch, '
+                    f'p50 latency {percentile(durations, 50):.1f}ms, p99 latency {percentile(durations, 99):.1f}ms'
+                )
+
+            transaction.set_rollback(True)
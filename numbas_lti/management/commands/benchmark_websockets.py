@@ -0,0 +1,113 @@
+"""
+Open many SCORM API websocket connections in this process and measure how long it takes to connect and to save SCORM data through them.
+
+The connections are made directly to the websocket consumers, without going through a network server.
+A resource, user and attempts are created for the benchmark, and deleted when it finishes.
+"""
+
+import asyncio
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+import json
+import random
+import statistics
+import time
+import uuid
+
+from numbas_lti.models import Resource, Attempt
+from numbas_lti.routing import websocket_urlpatterns
+
+def percentile(values, p):
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p-1]
+
+def make_batch(start, num_elements):
+    return [
+        {
+            'key': f'cmi.interactions.{i}.learner_response',
+            'value': str(i),
+            'time_iso': (start + timedelta(microseconds=i)).isoformat(),
+            'counter': i,
+        }
+        for i in range(num_elements)
+    ]
+
+class Command(BaseCommand):
+    help = 'Measure the time taken to open many SCORM API websocket connections, and the latency of saving SCORM data while they are open.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000, help='The number of connections to open.')
+        parser.add_argument('--messages', type=int, default=200, help='The number of batches of SCORM data to send, on randomly-chosen connections.')
+        parser.add_argument('--concurrency', type=int, default=20, help='The number of batches to send at the same time.')
+        parser.add_argument('--elements', type=int, default=20, help='The number of elements in each batch.')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username='benchmark-'+uuid.uuid4().hex[:20])
+        # bulk_create is used so that the signal handlers for new resources and attempts aren't run.
+        resource, = Resource.objects.bulk_create([Resource(title='Websocket benchmark', report_mark_time='manually')])
+        Attempt.objects.bulk_create([Attempt(resource=resource, user=user) for i in range(options['connections'])])
+        attempt_pks = list(Attempt.objects.filter(resource=resource).values_list('pk', flat=True))
+
+        try:
+            asyncio.run(self.run_benchmark(attempt_pks, options))
+        finally:
+            resource.delete()
+            user.delete()
+
+    async def run_benchmark(self, attempt_pks, options):
+        application = URLRouter(websocket_urlpatterns)
+
+        connect_times = []
+        communicators = []
+
+        async def connect(pk):
+            # Connect in review mode, so the consumer doesn't send a 'websocket.connected' message before the responses to the SCORM data.
+            communicator = WebsocketCommunicator(application, f'websocket/attempt/{pk}/scorm_api?uid={uuid.uuid4().hex}&mode=review')
+            t1 = time.perf_counter()
+            connected, subprotocol = await communicator.connect(timeout=60)
+            t2 = time.perf_counter()
+            if not connected:
+                raise Exception(f"Couldn't connect to attempt {pk}")
+            connect_times.append((t2-t1)*1000)
+            communicators.append(communicator)
+
+        t1 = time.perf_counter()
+        await asyncio.gather(*[connect(pk) for pk in attempt_pks])
+        t2 = time.perf_counter()
+        self.stdout.write(
+            f'Opened {len(communicators)} connections in {t2-t1:.1f}s: '
+            f'p50 connect time {percentile(connect_times, 50):.1f}ms, p99 connect time {percentile(connect_times, 99):.1f}ms'
+        )
+
+        round_trip_times = []
+        locks = [asyncio.Lock() for communicator in communicators]
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        start = timezone.now()
+
+        async def send(i):
+            n = random.randrange(len(communicators))
+            communicator = communicators[n]
+            async with locks[n], semaphore:
+                packet = {'type': 'scorm.elements', 'id': i, 'data': make_batch(start + timedelta(seconds=i), options['elements'])}
+                t1 = time.perf_counter()
+                await communicator.send_to(text_data=json.dumps(packet))
+                response = await communicator.receive_json_from(timeout=60)
+                t2 = time.perf_counter()
+                if response.get('received') != [i]:
+                    raise Exception(f"Unexpected response to batch {i}: {response}")
+                round_trip_times.append((t2-t1)*1000)
+
+        t1 = time.perf_counter()
+        await asyncio.gather(*[send(i) for i in range(options['messages'])])
+        t2 = time.perf_counter()
+        self.stdout.write(
+            f'Saved {len(round_trip_times)} batches in {t2-t1:.1f}s: '
+            f'p50 latency {percentile(round_trip_times, 50):.1f}ms, p99 latency {percentile(round_trip_times, 99):.1f}ms'
+        )
+
+        await asyncio.gather(*[communicator.disconnect() for communicator in communicators])
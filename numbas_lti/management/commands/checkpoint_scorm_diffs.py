@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from numbas_lti.models import Attempt, ScormElementDiff, rebuild_scormelement_diffs
+
+class Command(BaseCommand):
+    help = "Rebuild the chains of diffs of attempts' suspend data, adding full-value checkpoints according to the SCORM_DIFF_CHECKPOINT_VERSIONS and SCORM_DIFF_CHECKPOINT_BYTES settings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100, help='The number of attempts to load at a time.')
+        parser.add_argument('--key', default='cmi.suspend_data', help='The SCORM key whose values should be rebuilt.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        key = options['key']
+
+        diffs = ScormElementDiff.objects.filter(element__attempt=OuterRef('pk'), element__key=key)
+        attempts = Attempt.objects.filter(Exists(diffs))
+
+        pks = list(attempts.order_by('pk').values_list('pk', flat=True))
+        total = len(pks)
+
+        for i in range(0, total, chunk_size):
+            for attempt in Attempt.objects.filter(pk__in=pks[i:i+chunk_size]):
+                rebuild_scormelement_diffs(attempt, key)
+            self.stdout.write(f'Rebuilt {min(i+chunk_size, total)}/{total} attempts')
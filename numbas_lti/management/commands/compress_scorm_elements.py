@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+from django.db.models.functions import Length
+import time
+
+from numbas_lti.fields import COMPRESSED_PREFIX, compress_value, decompress_value
+from numbas_lti.models import ScormElement
+
+class Command(BaseCommand):
+    help = 'Compress the values of SCORM elements which were saved before compression was turned on, and report the space saved and the time taken to compress and decompress values.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000, help='The number of rows to look at at a time, by primary key.')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', help="Measure the effect of compression without saving anything.")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        threshold = ScormElement._meta.get_field('value').compression_threshold()
+
+        if threshold is None:
+            self.stdout.write('Compression is turned off: SCORM_ELEMENT_COMPRESSION_THRESHOLD is None.')
+            return
+
+        bounds = ScormElement.objects.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+        if bounds['min_pk'] is None:
+            return
+
+        stats = {
+            'rows': 0,
+            'compressed': 0,
+            'size_before': 0,
+            'size_after': 0,
+            'compress_time': 0,
+            'decompress_time': 0,
+        }
+
+        for start in range(bounds['min_pk'], bounds['max_pk']+1, chunk_size):
+            elements = (ScormElement.objects
+                .filter(pk__gte=start, pk__lt=start+chunk_size)
+                .annotate(stored_length=Length('value'))
+                .filter(stored_length__gte=threshold)
+                .exclude(value__startswith=COMPRESSED_PREFIX)
+                .only('pk','value')
+            )
+
+            to_save = []
+            for e in elements:
+                stats['rows'] += 1
+
+                t1 = time.perf_counter()
+                stored = compress_value(e.value, threshold)
+                t2 = time.perf_counter()
+                decompress_value(stored)
+                t3 = time.perf_counter()
+
+                stats['compress_time'] += t2-t1
+                stats['decompress_time'] += t3-t2
+                stats['size_before'] += e.stored_length
+                stats['size_after'] += len(stored)
+
+                if stored.startswith(COMPRESSED_PREFIX):
+                    stats['compressed'] += 1
+                    to_save.append(e)
+
+            if to_save and not dry_run:
+                with transaction.atomic():
+                    ScormElement.objects.bulk_update(to_save, ['value'])
+
+            self.stdout.write(f'Up to element {min(start+chunk_size-1, bounds["max_pk"])}: compressed {stats["compressed"]} of {stats["rows"]} long values')
+
+        if not stats['rows']:
+            self.stdout.write('There are no uncompressed values to compress.')
+            return
+
+        saved = stats['size_before'] - stats['size_after']
+        self.stdout.write(
+            f'{"Would compress" if dry_run else "Compressed"} {stats["compressed"]} of {stats["rows"]} values of at least {threshold} characters.\n'
+            f'Size of these values: {stats["size_before"]:,} characters before, {stats["size_after"]:,} after, saving {saved:,} ({saved/stats["size_before"]:.0%}).\n'
+            f'Mean time to compress a value: {stats["compress_time"]/stats["rows"]*1000:.3f}ms; to decompress: {stats["decompress_time"]/stats["rows"]*1000:.3f}ms.'
+        )
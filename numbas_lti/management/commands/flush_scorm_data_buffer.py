@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+import time
+
+from numbas_lti.scorm_buffer import get_scorm_data_buffer, FlusherAlreadyRunning
+
+class Command(BaseCommand):
+    help = 'Save the SCORM data in the write-behind buffer to the database. Runs until stopped, unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='The maximum number of buffered entries to save at once.')
+        parser.add_argument('--interval', type=float, default=0.5, help='The number of seconds to wait when the buffer is empty.')
+        parser.add_argument('--once', action='store_true', dest='once', help='Stop once the buffer is empty.')
+
+    def handle(self, *args, **options):
+        buffer = get_scorm_data_buffer()
+        if buffer is None:
+            raise CommandError("The SCORM_DATA_BUFFER setting isn't set.")
+
+        try:
+            with buffer.flusher_lock() as lock:
+                self.flush(buffer, lock, options)
+        except FlusherAlreadyRunning as e:
+            raise CommandError(str(e))
+
+    def flush(self, buffer, lock, options):
+        while True:
+            lock.refresh()
+            close_old_connections()
+
+            t1 = time.perf_counter()
+            n = buffer.flush(options['batch_size'])
+            t2 = time.perf_counter()
+
+            if n:
+                self.stdout.write(f'Saved {n} entries in {(t2-t1)*1000:.0f}ms')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
@@ -88,6 +88,7 @@ class Command(BaseCommand):
                 ]
 
                 ScormElement.objects.bulk_create(scorms)
+                attempt.rebuild_indexes()
 
         os.unlink('tmp.zip')
         print(f"The resource is at {resource.get_absolute_url()}")
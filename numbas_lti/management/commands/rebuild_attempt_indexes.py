@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from numbas_lti.models import Attempt, ATTEMPT_INDEX_VERSION
+
+class Command(BaseCommand):
+    help = 'Build the indexes of SCORM data for attempts which were started before the indexes were added.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100, help='The number of attempts to load at a time.')
+        parser.add_argument('--all', action='store_true', dest='all', help='Rebuild the indexes for every attempt, not just those which are out of date.')
+        parser.add_argument('--resource', type=int, nargs='+', dest='resource_pks', help='Only index attempts at the resources with these IDs.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        attempts = Attempt.objects.all()
+        if not options['all']:
+            attempts = attempts.filter(index_version__lt=ATTEMPT_INDEX_VERSION)
+        if options['resource_pks']:
+            attempts = attempts.filter(resource__in=options['resource_pks'])
+
+        pks = list(attempts.order_by('pk').values_list('pk', flat=True))
+        total = len(pks)
+
+        for i in range(0, total, chunk_size):
+            for attempt in Attempt.objects.filter(pk__in=pks[i:i+chunk_size]):
+                attempt.rebuild_indexes()
+            self.stdout.write(f'Indexed {min(i+chunk_size, total)}/{total} attempts')
@@ -5,7 +5,9 @@ import subprocess
 import datetime
 from django.utils.timezone import now
 
-from numbas_lti.models import Resource, Attempt, ScormElement
+from numbas_lti import tasks
+from numbas_lti.models import Resource, Attempt, ScormElement, RemarkedScormElement
+from numbas_lti.save_scorm_data import scorm_elements_saved
 from numbas_lti.test_exam import remark_attempts, ExamTestException
 
 class Command(BaseCommand):
@@ -52,6 +54,7 @@ class Command(BaseCommand):
         changed_keys = result.get('changed_keys',{})
         old_scaled_score = attempt.scaled_score
         old_raw_score = attempt.raw_score
+        new_elements = []
         for key,value in changed_keys.items():
             if key in Attempt.remark_ignore_keys:
                 continue
@@ -64,7 +67,12 @@ class Command(BaseCommand):
                     counter = 0
                 )
                 RemarkedScormElement.objects.create(element=e,user=None)
+                new_elements.append(e)
         if self.options['save']:
+            attempt.update_current_elements(new_elements)
+            scorm_elements_saved(attempt, new_elements)
+            # The stored scores are only updated by a task, so update them now to read the new score.
+            tasks.attempt_update_score_info.call_local(attempt, set())
             new_raw_score = attempt.raw_score
         else:
             new_raw_score = float(changed_keys.get('cmi.score.raw',old_raw_score))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from numbas_lti.models import Resource
+from numbas_lti.scoring import rescore_attempts
+
+class Command(BaseCommand):
+    help = 'Recompute the stored scores of every attempt at the given resources.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource_pks', nargs='+', type=int, help='The IDs of the resources to rescore.')
+        parser.add_argument('--chunk-size', type=int, default=200, help='The number of attempts to load at a time.')
+
+    def handle(self, *args, **options):
+        for pk in options['resource_pks']:
+            try:
+                resource = Resource.objects.get(pk=pk)
+            except Resource.DoesNotExist:
+                raise CommandError(f'There is no resource with ID {pk}.')
+
+            self.stdout.write(f'Rescoring attempts at {resource}')
+
+            def progress(done, total):
+                self.stdout.write(f'Rescored {done}/{total} attempts')
+
+            rescore_attempts(resource.attempts.all(), chunk_size=options['chunk_size'], progress=progress)
@@ -46,6 +46,8 @@ class Command(BaseCommand):
 
             attempt.scormelements.filter(time__gt=time).delete()
 
+            attempt.rebuild_indexes()
+
         scorm_set_score(attempt.scormelements.current('cmi.score.scaled'), fetch=True)
 
         scorm_set_completion_status(attempt.scormelements.current('cmi.completion_status'))
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+def make_scormelements_unique(apps, schema_editor):
+    """
+        Before the uniqueness constraint can be added, elements with the same attempt, key, time and counter must be disambiguated.
+        Rather than deleting any data, the extra copies are given new counter values, in order of creation.
+    """
+    ScormElement = apps.get_model('numbas_lti', 'ScormElement')
+
+    duplicates = list(ScormElement.objects.order_by().values('attempt','key','time','counter').annotate(n=Count('pk')).filter(n__gt=1))
+
+    for d in duplicates:
+        group = ScormElement.objects.filter(attempt=d['attempt'], key=d['key'], time=d['time'])
+        counter = group.aggregate(max_counter=Max('counter'))['max_counter']
+        for e in group.filter(counter=d['counter']).order_by('pk')[1:]:
+            counter += 1
+            e.counter = counter
+            e.save(update_fields=['counter'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0102_examanalysis'),
+    ]
+
+    operations = [
+        migrations.RunPython(make_scormelements_unique, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='scormelement',
+            constraint=models.UniqueConstraint(fields=('attempt', 'key', 'time', 'counter'), name='unique_scormelement_key_time_counter'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-18 10:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0103_scormelement_unique_key_time_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='index_version',
+            field=models.PositiveIntegerField(default=0, verbose_name="Version of the indexes of this attempt's SCORM data"),
+        ),
+        migrations.CreateModel(
+            name='AttemptCurrentElement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200)),
+                ('attempt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='current_elements', to='numbas_lti.attempt')),
+                ('element', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='current_of', to='numbas_lti.scormelement')),
+            ],
+            options={
+                'verbose_name': 'current SCORM element',
+                'verbose_name_plural': 'current SCORM elements',
+                'unique_together': {('attempt', 'key')},
+            },
+        ),
+    ]
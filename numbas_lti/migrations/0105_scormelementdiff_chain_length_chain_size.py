@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0104_attempt_index_version_attemptcurrentelement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scormelementdiff',
+            name='chain_length',
+            field=models.PositiveIntegerField(default=0, verbose_name='Number of diffs to apply to get the value of this element from a full value'),
+        ),
+        migrations.AddField(
+            model_name='scormelementdiff',
+            name='chain_size',
+            field=models.PositiveIntegerField(default=0, verbose_name='Total size in bytes of the diffs to apply to get the value of this element from a full value'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:05
+
+from django.db import migrations
+import numbas_lti.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0105_scormelementdiff_chain_length_chain_size'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scormelement',
+            name='value',
+            field=numbas_lti.fields.CompressedTextField(),
+        ),
+    ]
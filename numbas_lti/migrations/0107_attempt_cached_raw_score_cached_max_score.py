@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0106_scormelement_compressed_value'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attempt',
+            name='cached_raw_score',
+            field=models.FloatField(blank=True, null=True, verbose_name='Raw score, including remarks and discounts'),
+        ),
+        migrations.AddField(
+            model_name='attempt',
+            name='cached_max_score',
+            field=models.FloatField(blank=True, null=True, verbose_name='Maximum score, including discounts'),
+        ),
+    ]
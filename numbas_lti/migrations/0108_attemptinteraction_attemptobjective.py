@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0107_attempt_cached_raw_score_cached_max_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttemptInteraction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('part_path', models.CharField(max_length=200)),
+                ('attempt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='interactions', to='numbas_lti.attempt')),
+                ('id_element', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='numbas_lti.scormelement')),
+            ],
+            options={
+                'verbose_name': 'attempt interaction',
+                'verbose_name_plural': 'attempt interactions',
+                'indexes': [models.Index(fields=['attempt', 'part_path'], name='numbas_lti__attempt_b406f6_idx')],
+                'unique_together': {('attempt', 'number')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AttemptObjective',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('identifier', models.CharField(max_length=200)),
+                ('attempt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='objectives', to='numbas_lti.attempt')),
+            ],
+            options={
+                'verbose_name': 'attempt objective',
+                'verbose_name_plural': 'attempt objectives',
+                'unique_together': {('attempt', 'number')},
+            },
+        ),
+    ]
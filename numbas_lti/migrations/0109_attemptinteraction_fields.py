@@ -0,0 +1,44 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0108_attemptinteraction_attemptobjective'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attemptinteraction',
+            name='part_path',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='attemptinteraction',
+            name='id_element',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='numbas_lti.scormelement'),
+        ),
+        migrations.AddField(
+            model_name='attemptinteraction',
+            name='weighting',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attemptinteraction',
+            name='result',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attemptinteraction',
+            name='learner_response',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='attemptinteraction',
+            name='correct_responses',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0109_attemptinteraction_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportprocess',
+            name='num_users',
+            field=models.PositiveIntegerField(default=0, verbose_name='Number of students whose scores are being reported'),
+        ),
+        migrations.AddField(
+            model_name='reportprocess',
+            name='num_reported',
+            field=models.PositiveIntegerField(default=0, verbose_name='Number of students whose scores have been reported so far'),
+        ),
+        migrations.AddField(
+            model_name='reportprocess',
+            name='num_errors',
+            field=models.PositiveIntegerField(default=0, verbose_name='Number of reports which failed so far'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('numbas_lti', '0110_reportprocess_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportprocess',
+            name='num_skipped',
+            field=models.PositiveIntegerField(default=0, verbose_name="Number of scores not sent because they hadn't changed since they were last reported"),
+        ),
+    ]
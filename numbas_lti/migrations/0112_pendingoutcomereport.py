@@ -0,0 +1,38 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('numbas_lti', '0111_reportprocess_num_skipped'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingOutcomeReport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Time the first report failed')),
+                ('num_attempts', models.PositiveIntegerField(default=0, verbose_name='Number of times sending this report has failed')),
+                ('next_attempt_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Time to next try sending this report')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='The error from the last failed attempt')),
+                ('dead', models.BooleanField(default=False, verbose_name='Has this report been given up on after too many failures?')),
+                ('consumer', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pending_outcome_reports', to='numbas_lti.lticonsumer')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_outcome_reports', to='numbas_lti.resource')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_outcome_reports', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'pending outcome report',
+                'verbose_name_plural': 'pending outcome reports',
+                'ordering': ('next_attempt_time',),
+                'indexes': [models.Index(fields=['dead', 'next_attempt_time'], name='numbas_lti__dead_8dd0b2_idx')],
+                'unique_together': {('resource', 'user')},
+            },
+        ),
+    ]
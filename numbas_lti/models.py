@@ -11,7 +11,8 @@ from django.core.files.base import ContentFile
 from django.core.mail import send_mail
 from django.db import models, transaction
 from django.db.utils import OperationalError
-from django.db.models import Min, Count, Q, Subquery, OuterRef, Func, F
+from django.db.models import Min, Count, Q, Subquery, OuterRef, Func, F, Window
+from django.db.models.functions import RowNumber
 from django.template.loader import get_template
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _, gettext, ngettext
@@ -22,7 +23,6 @@ from django_auth_lti.patch_reverse import reverse
 import json
 from lxml import etree
 import os
-from pathlib import Path
 from pylti1p3.assignments_grades import AssignmentsGradesService, LineItem
 from pylti1p3.names_roles import NamesRolesProvisioningService
 from pylti1p3.contrib.django.lti1p3_tool_config import DjangoDbToolConf
@@ -41,12 +41,19 @@ from zipfile import ZipFile
 
 from . import requests_session
 from .exceptions import LineItemDoesNotExist
+from .fields import CompressedTextField
 from .groups import group_for_attempt, group_for_resource_stats, group_for_resource
-from .diff import make_diff, apply_diff
-from .util import parse_scorm_timeinterval, iso_time, time_from_iso
+from .diff import make_diff, apply_diff, DEFAULT_TIMEOUT as DEFAULT_DIFF_TIMEOUT, DEFAULT_MAX_LENGTH as DEFAULT_DIFF_MAX_LENGTH
+from .util import parse_scorm_timeinterval, iso_time, time_from_iso, parse_float
 from .examparser import numbasobject
+from .package_cache import cached_package_file
 
-requests = requests_session.get_session()
+# Incremented whenever a new table indexing attempts' SCORM data is added, so that older attempts can be re-indexed.
+ATTEMPT_INDEX_VERSION = 3
+
+# The keys of the elements which are copied into the ``AttemptInteraction`` table.
+re_interaction_key = re.compile(r'^cmi\.interactions\.(\d+)\.(id|weighting|result|learner_response|correct_responses\.(\d+)\.pattern)$')
+re_objective_id_key = re.compile(r'^cmi\.objectives\.(\d+)\.id$')
 
 class NotDeletedManager(models.Manager):
     def get_queryset(self):
@@ -226,6 +233,22 @@ class ExtractPackage(models.Model):
     def extracted_url(self):
         return '{}{}/{}/{}'.format(settings.MEDIA_URL,self.extract_folder,self.__class__.__name__,str(self.static_uuid))
 
+def load_exam_manifest(path):
+    try:
+        with open(path) as f:
+            return json.loads(f.read())
+    except Exception:
+        return {}
+
+def load_exam_source(path):
+    try:
+        with open(path) as f:
+            content = f.read()
+            obj = numbasobject.NumbasObject(source=content)
+            return obj.data
+    except (FileNotFoundError,json.JSONDecodeError, numbasobject.VersionError):
+        return {}
+
 # Create your models here.
 class Exam(ExtractPackage):
     title = models.CharField(max_length=300)
@@ -247,30 +270,22 @@ class Exam(ExtractPackage):
         return self.resource is not None and self==self.resource.exam
 
     def manifest(self):
-        root = Path(self.extracted_path)
-        manifest_path = root / 'numbas-manifest.json'
-        if not manifest_path.exists():
-            return {}
-
-        try:
-            with open(str(manifest_path)) as f:
-                manifest = json.loads(f.read())
-                return manifest
-        except Exception as e:
-            return {}
+        """
+            The contents of the package's ``numbas-manifest.json`` file.
+            The result is cached and shared, so don't modify it.
+        """
+        return cached_package_file(self, 'numbas-manifest.json', load_exam_manifest)
 
     def supports_feature(self, feature):
         features = self.manifest().get('features',{})
         return features.get(feature)
 
     def source(self):
-        try:
-            with open(str(Path(self.extracted_path) / 'source.exam')) as f:
-                content = f.read()
-                obj = numbasobject.NumbasObject(source=content)
-                return obj.data
-        except (FileNotFoundError,json.JSONDecodeError, numbasobject.VersionError):
-            return {}
+        """
+            The parsed contents of the package's ``source.exam`` file.
+            The result is cached and shared, so don't modify it.
+        """
+        return cached_package_file(self, 'source.exam', load_exam_source)
 
     def has_duration(self):
         source = self.source()
@@ -579,19 +594,11 @@ class Resource(models.Model):
         if user is None or user.is_anonymous:
             return None, 'not attempted', None
         
-        methods = {
-            'highest': '-scaled_score',
-            'last': '-start_time',
-        }
-
-        
-        attempts = self.attempts.filter(user=user)
-        if not self.include_incomplete_attempts:
-            attempts = attempts.filter(completion_status='completed')
+        attempts = self.gradeable_attempts().filter(user=user)
         if not attempts.exists():
             return None
 
-        attempt = attempts.order_by(methods[self.grading_method]).first()
+        attempt = attempts.order_by(*self.grading_order()).first()
 
         completion_status = 'completed' if attempt.completed() else attempt.completion_status
 
@@ -599,6 +606,54 @@ class Resource(models.Model):
 
         return attempt, completion_status, submitted_at
 
+    def gradeable_attempts(self):
+        """
+            The attempts at this resource which can count towards a student's grade.
+        """
+        attempts = self.attempts.all()
+        if not self.include_incomplete_attempts:
+            attempts = attempts.filter(completion_status='completed')
+        return attempts
+
+    def grading_order(self):
+        """
+            The order of a student's attempts such that the one representing their grade comes first.
+            Depends on ``grading_method``.
+        """
+        orderings = {
+            'highest': F('scaled_score').desc(),
+            'last': F('start_time').desc(),
+        }
+        return [orderings[self.grading_method], F('pk').desc()]
+
+    def grade_all_users(self, users=None, include_submitted_at=True):
+        """
+            Find the attempt representing each student's grade at this resource, like ``grade_user``, for all students at once.
+            The graded attempts are picked with one query, using a window function.
+
+            Returns a dictionary mapping user primary keys to tuples ``(attempt, completion_status, submitted_at)``.
+            Students who have no attempts which count towards their grade are left out.
+            If ``users`` is given, only those students are graded.
+            Working out ``submitted_at`` takes a few queries per student; if ``include_submitted_at`` is ``False``, it's ``None``.
+        """
+        attempts = self.gradeable_attempts()
+        if users is not None:
+            attempts = attempts.filter(user__in=users)
+
+        graded_attempts = (attempts
+            .annotate(grade_rank=Window(RowNumber(), partition_by=[F('user')], order_by=self.grading_order()))
+            .filter(grade_rank=1)
+            .select_related('user')
+        )
+
+        grades = {}
+        for attempt in graded_attempts:
+            completion_status = 'completed' if attempt.completed() else attempt.completion_status
+            submitted_at = attempt.get_end_time() if include_submitted_at else None
+            grades[attempt.user_id] = (attempt, completion_status, submitted_at)
+
+        return grades
+
     def students(self):
         return User.objects.filter(attempts__resource=self, attempts__deleted=False).distinct().order_by('last_name','first_name')
 
@@ -774,9 +829,9 @@ class Resource(models.Model):
     def receipt_salt(self):
         return 'numbas_lti:resource:'+str(self.pk)
 
-    def task_report_scores(self):
+    def task_report_scores(self, force=False):
         from . import tasks
-        tasks.resource_report_scores(self)
+        tasks.resource_report_scores(self, force=force)
 
     def require_lockdown_app_for_user(self, user=None):
         require_lockdown_app = self.require_lockdown_app
@@ -816,7 +871,11 @@ class Resource(models.Model):
             If no attempts exist, return 1.
             This is used by the LTI 1.3 line item, so hopefully it's correct!
         """
-        for a in self.attempts.all():
+        score = self.attempts.filter(cached_max_score__gt=0).values_list('cached_max_score', flat=True).first()
+        if score is not None:
+            return score
+
+        for a in self.attempts.filter(cached_max_score__isnull=True):
             score = a.max_score
             if score > 0:
                 return score
@@ -914,6 +973,10 @@ class ReportProcess(models.Model):
     time = models.DateTimeField(auto_now_add=True,verbose_name=_("Time the reporting process started"))
     response = models.TextField(blank=True,verbose_name=_("Description of any error"))
     dismissed = models.BooleanField(default=False,verbose_name=_('Has the result of this process been dismissed by the instructor?'))
+    num_users = models.PositiveIntegerField(default=0,verbose_name=_('Number of students whose scores are being reported'))
+    num_reported = models.PositiveIntegerField(default=0,verbose_name=_('Number of students whose scores have been reported so far'))
+    num_errors = models.PositiveIntegerField(default=0,verbose_name=_('Number of reports which failed so far'))
+    num_skipped = models.PositiveIntegerField(default=0,verbose_name=_("Number of scores not sent because they hadn't changed since they were last reported"))
 
     class Meta:
         verbose_name = _('report process')
@@ -1048,6 +1111,12 @@ class EmailAccessChange(models.Model):
     access_change = models.ForeignKey(AccessChange, on_delete=models.CASCADE, related_name='emails')
     email = models.EmailField()
 
+def pick_source_id(lti_11_sourcedid, lti_13_sourcedid, consumer_user_id):
+    """
+        The identifier to show for a student: their LTI 1.1 ``lis_person_sourcedid``, or else their LTI 1.3 ``lis_person_sourcedid``, or else the consumer's ID for them.
+    """
+    return lti_11_sourcedid or lti_13_sourcedid or consumer_user_id
+
 class LTIUserData(models.Model):
     """
         Associate the LTI 1.1 data for a user with a consumer.
@@ -1063,16 +1132,20 @@ class LTIUserData(models.Model):
         verbose_name = _('LTI user data')
         verbose_name_plural = _('LTI user data')
 
+    def lti_13_aliases(self):
+        """
+            The student's LTI 1.3 aliases at this consumer which have a ``lis_person_sourcedid``, newest first.
+        """
+        return LTI_13_UserAlias.objects.filter(user=self.user_id, consumer=self.consumer_id).exclude(lis_person_sourcedid__isnull=True).exclude(lis_person_sourcedid='').order_by('-pk')
+
     def get_source_id(self):
         try:
-            if self.lti_11 and self.lti_11.lis_person_sourcedid:
-                return self.lti_11.lis_person_sourcedid
-            elif self.lti_13 and self.lti_13.lis_person_sourcedid:
-                return self.lti_13.lis_person_sourcedid
-            else:
-                return self.consumer_user_id
+            lti_11_sourcedid = self.lti_11.lis_person_sourcedid
         except LTI_11_UserData.DoesNotExist:
-            return self.consumer_user_id
+            lti_11_sourcedid = None
+        lti_13_alias = self.lti_13_aliases().first()
+        lti_13_sourcedid = lti_13_alias.lis_person_sourcedid if lti_13_alias is not None else None
+        return pick_source_id(lti_11_sourcedid, lti_13_sourcedid, self.consumer_user_id)
 
     def identifier(self):
         identifier_field = self.resource.lti_contexts().first().consumer.identifier_field
@@ -1128,6 +1201,8 @@ class Attempt(models.Model):
     completion_status_element = models.ForeignKey("ScormElement", on_delete=models.SET_NULL, related_name="current_completion_status_of", null=True)
     scaled_score = models.FloatField(default=0)
     scaled_score_element = models.ForeignKey("ScormElement", on_delete=models.SET_NULL, related_name="current_scaled_score_of", null=True)
+    cached_raw_score = models.FloatField(blank=True, null=True, verbose_name=_('Raw score, including remarks and discounts'))
+    cached_max_score = models.FloatField(blank=True, null=True, verbose_name=_('Maximum score, including discounts'))
     sent_receipt = models.BooleanField(default=False,verbose_name=_('Has a completion receipt been sent?'))
     receipt_time = models.DateTimeField(blank=True,null=True,verbose_name=_('Time the completion receipt was sent'))
 
@@ -1137,6 +1212,8 @@ class Attempt(models.Model):
 
     all_data_received = models.BooleanField(default=False)
 
+    index_version = models.PositiveIntegerField(default=0, verbose_name=_('Version of the indexes of this attempt\'s SCORM data'))
+
     objects = NotDeletedManager()
 
     remark_ignore_keys = ['cmi.suspend_data','cmi.session_time']    # CMI keys not to resave when auto-remarking
@@ -1152,6 +1229,140 @@ class Attempt(models.Model):
     def user_data(self):
         return self.resource.user_data(self.user)
 
+    def ensure_indexes(self):
+        """
+            Make sure that the tables indexing this attempt's SCORM data are up to date.
+            Attempts started before an index was added are indexed the first time it's needed.
+        """
+        if self.index_version < ATTEMPT_INDEX_VERSION:
+            self.rebuild_indexes()
+
+    def rebuild_indexes(self):
+        """
+            Rebuild the tables indexing this attempt's SCORM data from the full history of elements.
+        """
+        with transaction.atomic():
+            self.current_elements.all().delete()
+
+            latest = {}
+            for e in self.scormelements.only('pk','key','time','counter').iterator():
+                if e.key not in latest:
+                    latest[e.key] = e
+
+            AttemptCurrentElement.objects.bulk_create([AttemptCurrentElement(attempt=self, key=key, element=e) for key,e in latest.items()])
+
+            self.interactions.all().delete()
+            self.objectives.all().delete()
+            indexed_pks = [e.pk for key,e in latest.items() if re_interaction_key.match(key) or re_objective_id_key.match(key)]
+            self.update_part_index(ScormElement.objects.filter(pk__in=indexed_pks))
+
+            self.index_version = ATTEMPT_INDEX_VERSION
+            self.save(update_fields=['index_version'])
+
+    def update_current_elements(self, elements):
+        """
+            Update the index of current elements after the given ScormElement objects have been saved.
+        """
+        latest = {}
+        for e in elements:
+            if e.key not in latest or e.newer_than(latest[e.key]):
+                latest[e.key] = e
+
+        if not latest:
+            return
+
+        existing = {key: (time, counter) for key, time, counter in self.current_elements.filter(key__in=latest.keys()).values_list('key','element__time','element__counter')}
+
+        changed = [
+            AttemptCurrentElement(attempt=self, key=key, element=e)
+            for key,e in latest.items()
+            if key not in existing or (e.time, e.counter) > existing[key]
+        ]
+
+        AttemptCurrentElement.objects.bulk_create(changed, update_conflicts=True, unique_fields=['attempt','key'], update_fields=['element'])
+
+        self.update_part_index([c.element for c in changed])
+
+    def update_part_index(self, elements):
+        """
+            Update the index of this attempt's interactions and objectives from the given current elements.
+            Elements with keys that aren't indexed are ignored.
+        """
+        interaction_changes = defaultdict(dict)
+        objectives = []
+        for e in elements:
+            m = re_interaction_key.match(e.key)
+            if m:
+                changes = interaction_changes[int(m.group(1))]
+                field = m.group(2)
+                if field == 'id':
+                    changes['part_path'] = e.value
+                    changes['id_element'] = e
+                elif field in ('weighting', 'result'):
+                    changes[field] = parse_float(e.value)
+                elif field == 'learner_response':
+                    changes[field] = e.value
+                else:
+                    changes.setdefault('correct_responses', {})[int(m.group(3))] = e.value
+                continue
+            m = re_objective_id_key.match(e.key)
+            if m:
+                objectives.append(AttemptObjective(attempt=self, number=int(m.group(1)), identifier=e.value))
+
+        if interaction_changes:
+            self.update_interactions(interaction_changes)
+        if objectives:
+            AttemptObjective.objects.bulk_create(objectives, update_conflicts=True, unique_fields=['attempt','number'], update_fields=['identifier'])
+
+    def update_interactions(self, interaction_changes):
+        """
+            Apply changes to the fields of this attempt's ``AttemptInteraction`` rows.
+            ``interaction_changes`` maps interaction numbers to dictionaries of new field values.
+            The value for ``correct_responses`` is a dictionary mapping the index of each changed pattern to its new value.
+        """
+        existing = {i.number: i for i in self.interactions.filter(number__in=interaction_changes.keys())}
+
+        to_create = defaultdict(list)
+        to_update = []
+        update_fields = set()
+
+        for number, changes in interaction_changes.items():
+            interaction = existing.get(number, AttemptInteraction(attempt=self, number=number))
+
+            patterns = changes.pop('correct_responses', None)
+            if patterns is not None:
+                correct_responses = list(interaction.correct_responses)
+                for n, pattern in patterns.items():
+                    correct_responses += [''] * (n + 1 - len(correct_responses))
+                    correct_responses[n] = pattern
+                changes['correct_responses'] = correct_responses
+
+            for field, value in changes.items():
+                setattr(interaction, field, value)
+
+            if number in existing:
+                to_update.append(interaction)
+                update_fields.update(changes.keys())
+            else:
+                # If another process creates the same row first, only overwrite the fields that were given values here.
+                to_create[tuple(sorted(changes.keys()))].append(interaction)
+
+        for fields, interactions in to_create.items():
+            AttemptInteraction.objects.bulk_create(interactions, update_conflicts=True, unique_fields=['attempt','number'], update_fields=list(fields))
+        if to_update:
+            AttemptInteraction.objects.bulk_update(to_update, list(update_fields))
+
+    def current_element(self, key):
+        """
+            The most recent ScormElement with the given key.
+            Raises ``ScormElement.DoesNotExist`` if there's no element with this key.
+        """
+        self.ensure_indexes()
+        try:
+            return self.current_elements.select_related('element').get(key=key).element
+        except AttemptCurrentElement.DoesNotExist:
+            raise ScormElement.DoesNotExist()
+
     def get_element_default(self,key,default=None):
         try:
             return self.scormelements.current(key).value
@@ -1188,14 +1399,23 @@ class Attempt(models.Model):
 
         scorm_cmi = {k: {'value':v,'time':self.start_time.timestamp()} for k,v in scorm_cmi.items()}
 
-        # TODO only fetch the latest values of elements from the DB, somehow
-
         latest_elements = {}
 
-        saved_elements = resolve_diffed_scormelements(self.scormelements.all().reverse())
-        if not include_remarked_elements:
-            remarked_elements = RemarkedScormElement.objects.filter(element__attempt=self).values_list('element', flat=True)
-            saved_elements = [e for e in saved_elements if e.pk not in remarked_elements]
+        if include_remarked_elements and at_time is None:
+            self.ensure_indexes()
+            saved_elements = [c.element for c in self.current_elements.select_related('element')]
+        else:
+            elements = self.scormelements.all()
+            if at_time is not None:
+                elements = elements.filter(time__lte=at_time + timedelta(seconds=0.1))
+            if not include_remarked_elements:
+                elements = elements.filter(remarked=None)
+
+            # Find the latest element for each key, and only resolve the values of those.
+            latest_pks = {}
+            for pk, key in elements.values_list('pk', 'key'):
+                latest_pks.setdefault(key, pk)
+            saved_elements = resolve_diffed_scormelements(ScormElement.objects.filter(pk__in=latest_pks.values()))
 
         for e in saved_elements:
             if at_time is None or e.time <= at_time + timedelta(seconds=0.1):
@@ -1206,8 +1426,9 @@ class Attempt(models.Model):
         return scorm_cmi
 
     def data_dump(self,include_all_scorm=False):
-        remarked_parts = self.remarked_parts.all()
-        discounted_parts = self.resource.discounted_parts.all()
+        scorer = self.get_scorer()
+        remarked_parts = scorer.remarked_parts
+        discounted_parts = scorer.discounted_parts
 
 
         data = {
@@ -1227,7 +1448,7 @@ class Attempt(models.Model):
             'end_time': self.end_time.timestamp() if self.end_time is not None else None,
             'completion_status': self.completion_status,
             'scaled_score': self.scaled_score,
-            'raw_score': self.raw_score,
+            'raw_score': scorer.raw_score(),
             'scores': [],
             'broken': self.broken,
             'remarked_parts': [{'part': p.part, 'score': p.score} for p in remarked_parts],
@@ -1241,12 +1462,7 @@ class Attempt(models.Model):
             all_elements = resolve_diffed_scormelements(self.scormelements.all().reverse())
             data['scorm']['all'] = [{'key': e.key, 'value': e.value, 'time': e.time.timestamp(), 'counter': e.counter} for e in all_elements]
 
-        re_interaction_id = re.compile(r'^cmi\.interactions\.(\d+)\.id$')
-        part_ids = {}
-        for k,v in scorm_cmi.items():
-            m = re_interaction_id.match(k)
-            if m:
-                part_ids[v['value']] = m.group(1)
+        part_ids = scorer.interaction_ids
 
         remark_dict = {r.part:r.score for r in remarked_parts}
         discount_dict = {d.part:d.behaviour for d in discounted_parts}
@@ -1308,7 +1524,7 @@ class Attempt(models.Model):
 
             return data
 
-        for qnum, parts in self.part_hierarchy().items():
+        for qnum, parts in scorer.part_hierarchy().items():
             aqs = self.question_score_info(qnum)
             obj = {
                 'question': int(qnum),
@@ -1437,7 +1653,8 @@ class Attempt(models.Model):
 
             from . import tasks
 
-            tasks.attempt_update_score_info(self,set())
+            # Update the stored scores straight away, so the completion receipt and any report made now use the final score.
+            tasks.attempt_update_score_info.call_local(self,set())
 
             channel_layer = get_channel_layer()
             group_send = async_to_sync(channel_layer.group_send)
@@ -1454,6 +1671,7 @@ class Attempt(models.Model):
                 time=timezone.now(),
                 counter=1
             )
+        self.update_current_elements([e])
 
         if reopened_by:
             RemarkedScormElement.objects.create(element=e, user=reopened_by)
@@ -1464,32 +1682,64 @@ class Attempt(models.Model):
         self.receipt_time = None
         self.save(update_fields=('completion_status', 'end_time', 'sent_receipt', 'receipt_time',))
 
+        from .save_scorm_data import scorm_elements_saved
+        scorm_elements_saved(self, [e])
+
+    def get_scorer(self):
+        """
+            An ``AttemptScorer`` for this attempt, with the current data loaded.
+            When computing several scores, get one scorer and use it for all of them.
+        """
+        from .scoring import AttemptScorer
+        return AttemptScorer(self)
+
+    def update_stored_scores(self, scorer=None):
+        """
+            Recompute the raw and maximum scores stored on this attempt, and save them if they've changed.
+            Returns a list of the names of the fields that changed.
+        """
+        if scorer is None:
+            scorer = self.get_scorer()
+
+        scores = {
+            'cached_raw_score': scorer.raw_score(),
+            'cached_max_score': scorer.max_score(),
+        }
+        changed = {field: value for field, value in scores.items() if getattr(self, field) != value}
+        if changed:
+            for field, value in changed.items():
+                setattr(self, field, value)
+            # Update the row directly: this is called when reading the scores, which shouldn't trigger the post_save signals.
+            Attempt._base_manager.filter(pk=self.pk).update(**changed)
+
+        return list(changed.keys())
+
     @property
     def raw_score(self):
-        if self.remarked_parts.exists() or self.resource.discounted_parts.exists():
-            total = 0
-            for i in range(self.resource.num_questions):
-                total += self.question_raw_score(i)
-            return total
-
-        return float(self.get_element_default('cmi.score.raw',0))
+        """
+            The raw score for this attempt, including remarks and discounts.
+            It's stored on the attempt and kept up to date when the attempt's data, remarks or discounts change.
+            Attempts saved before the score was stored have their score computed the first time it's needed.
+        """
+        if self.cached_raw_score is None:
+            self.update_stored_scores()
+        return self.cached_raw_score
 
     @property
     def max_score(self):
-        if self.resource.discounted_parts.exists():
-            total = 0
-            for i in range(self.resource.num_questions):
-                total += self.question_max_score(i)
-            return total
-
-        return float(self.get_element_default('cmi.score.max', lambda: sum(self.question_max_score(i) for i in range(self.resource.num_questions))))
+        """
+            The maximum score for this attempt, including discounts.
+        """
+        if self.cached_max_score is None:
+            self.update_stored_scores()
+        return self.cached_max_score
 
     def part_discount(self,part):
         return self.resource.discounted_parts.filter(part=part).first()
 
     def part_paths(self):
         """ Paths to all parts in this attempt. """
-        return set(e['value'] for e in self.scormelements.filter(key__regex='cmi.interactions.[0-9]+.id').values('value').distinct())
+        return self.get_scorer().part_paths()
 
     def part_hierarchy(self):
         """
@@ -1503,97 +1753,38 @@ class Attempt(models.Model):
                     }
                 }
         """
-        paths = sorted(self.part_paths(),key=lambda x:(len(x),x))
-        re_path = re.compile(r'q(\d+)p(\d+)(?:g(\d+)|s(\d+))?')
-        out = defaultdict(lambda: defaultdict(lambda: {'gaps':[],'steps':[]}))
-        for path in paths:
-            m = re_path.match(path)
-            p = out[m.group(1)][m.group(2)]
-            if m.group(3):
-                p['gaps'].append(m.group(3))
-            elif m.group(4):
-                p['steps'].append(m.group(4))
-
-        return out
+        return self.get_scorer().part_hierarchy()
 
     def part_gaps(self,part):
-        if not re.match(r'^q\d+p\d+$',part):
-            return []
-        gaps = [g for g in self.part_paths() if g.startswith(part+'g')]
-        return gaps
+        return self.get_scorer().part_gaps(part)
 
     def part_interaction_id(self,part):
-        id_element = self.scormelements.filter(key__regex='cmi.interactions.[0-9]+.id',value=part).first()
-        if id_element is None:
-            return None
-        n = re.match(r'cmi.interactions.(\d+).id',id_element.key).group(1)
-        return n
+        return self.get_scorer().part_interaction_id(part)
 
     def part_raw_score(self,part,include_remark=True):
-        discounted = self.part_discount(part)
-        if discounted:
-            return self.part_max_score(part)
-
-        remarked = self.remarked_parts.filter(part=part)
-        if include_remark and remarked.exists():
-            return remarked.last().score
-
-        if (include_remark and self.remarked_parts.filter(part__startswith=part+'g').exists()) or self.resource.discounted_parts.filter(part__startswith=part+'g').exists():
-            gaps = self.part_gaps(part)
-            return sum(self.part_raw_score(g,include_remark) for g in gaps)
-
-        id = self.part_interaction_id(part)
-        if id is None:
-            return 0
-
-        score = self.get_element_default('cmi.interactions.{}.result'.format(id),0)
-        return float(score)
+        return self.get_scorer().part_raw_score(part,include_remark)
 
     def part_max_score(self,part):
-        discounted = self.part_discount(part)
-        if discounted:
-            if discounted.behaviour == 'remove':
-                return 0
-
-        if self.resource.discounted_parts.filter(part__startswith=part+'g').exists():
-            gaps = self.part_gaps(part)
-            return sum(self.part_max_score(g) for g in gaps)
-
-        id = self.part_interaction_id(part)
-        if id is None:
-            return 0
-
-        return float(self.get_element_default('cmi.interactions.{}.weighting'.format(id),0))
+        return self.get_scorer().part_max_score(part)
 
     def question_raw_score(self,n):
-        _,raw,_,_ = self.calculate_question_score_info(n)
-        return raw
+        return self.get_scorer().question_raw_score(n)
 
     def calculate_question_score_info(self,n):
-        qid = 'q{}'.format(n)
-        if self.remarked_parts.filter(part__startswith=qid).exists() or self.resource.discounted_parts.filter(part__startswith=qid).exists():
-            question_parts = [p for p in self.part_paths() if p.startswith(qid)]
-            total_raw = 0.0
-            total_max = 0.0
-            for part in question_parts:
-                if re.match(r'^q{}p\d+$'.format(n),part):
-                    total_raw += self.part_raw_score(part)
-                    total_max += self.part_max_score(part)
-            raw_score = total_raw
-            scaled_score = total_raw/total_max if total_max>0 else 0.0
-            max_score = total_max
-        else:
-            raw_score = float(self.get_element_default('cmi.objectives.{}.score.raw'.format(n),0))
-            scaled_score = float(self.get_element_default('cmi.objectives.{}.score.scaled'.format(n),0))
-            max_score = float(self.get_element_default('cmi.objectives.{}.score.max'.format(n),0))
-
-        completion_status = self.get_element_default('cmi.objectives.{}.completion_status'.format(n),'not attempted')
-
-        return (scaled_score, raw_score, max_score, completion_status)
+        return self.get_scorer().question_score_info(n)
 
     def update_question_score_info(self,n):
-        scaled_score,raw_score,max_score,completion_status = self.calculate_question_score_info(n)
-        AttemptQuestionScore.objects.update_or_create(attempt=self,number=n,defaults={'scaled_score':scaled_score,'raw_score':raw_score,'max_score':max_score,'completion_status':completion_status})
+        self.update_question_scores([n])
+
+    def update_question_scores(self,numbers,scorer=None):
+        """
+            Recompute the cached scores for the given question numbers, using one scorer for all of them.
+        """
+        if scorer is None:
+            scorer = self.get_scorer()
+        for n in numbers:
+            scaled_score,raw_score,max_score,completion_status = scorer.question_score_info(n)
+            AttemptQuestionScore.objects.update_or_create(attempt=self,number=n,defaults={'scaled_score':scaled_score,'raw_score':raw_score,'max_score':max_score,'completion_status':completion_status})
 
     def question_score_info(self,n):
         try:
@@ -1610,17 +1801,13 @@ class Attempt(models.Model):
             return aq
 
     def question_numbers(self):
-        questions = self.scormelements.filter(key__regex='cmi.objectives.[0-9]+.id').values('key').distinct()
-        re_number = re.compile(r'cmi.objectives.([0-9]+).id')
-        numbers = sorted(set([re_number.match(q['key']).group(1) for q in questions]))
-        return numbers
+        return self.get_scorer().question_numbers()
 
     def question_scores(self):
         return sorted([self.question_score_info(n) for n in self.question_numbers()],key=lambda x:int(x.number))
 
     def question_max_score(self,n):
-        _,_,max_score,_ = self.calculate_question_score_info(n)
-        return max_score
+        return self.get_scorer().question_max_score(n)
 
     def time_spent(self):
         try:
@@ -1792,6 +1979,10 @@ class ScormElementManager(models.Manager):
         return ScormElementQuerySet(self.model, using=self.db)
 
     def current(self,key):
+        # When this is the RelatedManager for ``Attempt.scormelements``, use the attempt's index of current elements.
+        if hasattr(self, 'instance') and isinstance(self.instance, Attempt):
+            return self.instance.current_element(key)
+
         return self.get_queryset().current(key)
 
 class ScormElement(models.Model):
@@ -1799,7 +1990,7 @@ class ScormElement(models.Model):
 
     attempt = models.ForeignKey(Attempt,on_delete=models.CASCADE,related_name='scormelements')
     key = models.CharField(max_length=200)
-    value = models.TextField()
+    value = CompressedTextField()
     time = models.DateTimeField()
     counter = models.IntegerField(default=0,verbose_name=_('Element counter to disambiguate elements with the same timestamp'))
     current = models.BooleanField(default=True) # is this the latest version?
@@ -1808,6 +1999,9 @@ class ScormElement(models.Model):
         verbose_name = _('SCORM element')
         verbose_name_plural = _('SCORM elements')
         ordering = ['-time','-counter','-pk',]
+        constraints = [
+            models.UniqueConstraint(fields=['attempt','key','time','counter'], name='unique_scormelement_key_time_counter'),
+        ]
 
     def __str__(self):
         return '{}: {}'.format(self.key,self.value[:50]+(self.value[50:] and '...'))
@@ -1826,74 +2020,240 @@ class ScormElement(models.Model):
             'counter': self.counter,
         }
 
+class AttemptCurrentElement(models.Model):
+    """
+        The most recent ScormElement for each key in an attempt.
+        This is kept up to date as elements are saved, so the current value of a key can be found without looking through the attempt's whole history.
+    """
+    attempt = models.ForeignKey(Attempt, on_delete=models.CASCADE, related_name='current_elements')
+    key = models.CharField(max_length=200)
+    element = models.ForeignKey(ScormElement, on_delete=models.CASCADE, related_name='current_of')
+
+    class Meta:
+        verbose_name = _('current SCORM element')
+        verbose_name_plural = _('current SCORM elements')
+        unique_together = (('attempt','key'),)
+
+class AttemptInteraction(models.Model):
+    """
+        The current values of the ``cmi.interactions.N.*`` elements for each interaction in an attempt, including the path of the part that it belongs to.
+        This is kept up to date as elements are saved, so the parts in an attempt and their scores can be found without looking through its SCORM data.
+    """
+    attempt = models.ForeignKey(Attempt, on_delete=models.CASCADE, related_name='interactions')
+    number = models.PositiveIntegerField()
+    part_path = models.CharField(max_length=200, blank=True, default='')
+    id_element = models.ForeignKey(ScormElement, on_delete=models.CASCADE, related_name='+', null=True)
+    weighting = models.FloatField(blank=True, null=True)
+    result = models.FloatField(blank=True, null=True)
+    learner_response = models.TextField(blank=True, default='')
+    correct_responses = models.JSONField(blank=True, default=list)
+
+    class Meta:
+        verbose_name = _('attempt interaction')
+        verbose_name_plural = _('attempt interactions')
+        unique_together = (('attempt','number'),)
+        indexes = [
+            models.Index(fields=['attempt','part_path']),
+        ]
+
+class AttemptObjective(models.Model):
+    """
+        The identifier of each objective in an attempt, from the current value of its ``cmi.objectives.N.id`` element.
+        Each objective corresponds to a question.
+    """
+    attempt = models.ForeignKey(Attempt, on_delete=models.CASCADE, related_name='objectives')
+    number = models.PositiveIntegerField()
+    identifier = models.CharField(max_length=200)
+
+    class Meta:
+        verbose_name = _('attempt objective')
+        verbose_name_plural = _('attempt objectives')
+        unique_together = (('attempt','number'),)
+
 class ScormElementDiff(models.Model):
     element = models.OneToOneField('ScormElement', on_delete=models.CASCADE, related_name='diff')
     diff_of = models.OneToOneField('ScormElement', on_delete=models.PROTECT, related_name='diffs')
+    chain_length = models.PositiveIntegerField(default=0, verbose_name=_('Number of diffs to apply to get the value of this element from a full value'))
+    chain_size = models.PositiveIntegerField(default=0, verbose_name=_('Total size in bytes of the diffs to apply to get the value of this element from a full value'))
 
     class Meta:
         verbose_name = _('SCORM element diff')
         verbose_name_plural = _('SCORM element diffs')
 
+def diff_at_ingest():
+    """
+        Should suspend data be diffed as soon as it's saved, rather than by the periodic ``diff_suspend_data`` task?
+    """
+    return getattr(settings, 'SCORM_DIFF_AT_INGEST', True)
+
+def diff_checkpoint_policy():
+    """
+        The maximum number of diffs, and the maximum total size in bytes of the diffs, that can be applied to get the value of an element from a full value.
+    """
+    return (
+        getattr(settings, 'SCORM_DIFF_CHECKPOINT_VERSIONS', 50),
+        getattr(settings, 'SCORM_DIFF_CHECKPOINT_BYTES', 1000000),
+    )
+
+def chain_scormelement_diffs(elements, tail=(0,0)):
+    """
+        Given a list of elements with their full values, in order from newest to oldest, replace the value of each with a diff relative to the one before it.
+        The first element keeps its full value.
+        Once the chain of diffs leading to an element would be longer or bigger than allowed by ``diff_checkpoint_policy``, that element keeps its full value instead, as a checkpoint, and a new chain starts from it.
+
+        ``tail`` is the length and size of the longest chain of diffs that already leads to the last element.
+
+        Returns a list of unsaved ScormElementDiff objects.
+    """
+    max_versions, max_bytes = diff_checkpoint_policy()
+    timeout = getattr(settings, 'SCORM_DIFF_TIMEOUT', DEFAULT_DIFF_TIMEOUT)
+    max_length = getattr(settings, 'SCORM_DIFF_MAX_LENGTH', DEFAULT_DIFF_MAX_LENGTH)
+
+    diffs = []
+    length = 0
+    size = 0
+    last = None
+    for n, e in enumerate(elements):
+        value = e.value
+        if last is not None and not e.newer_than(last):
+            tail_length, tail_size = tail if n == len(elements)-1 else (0,0)
+            if length + 1 + tail_length <= max_versions:
+                d = make_diff(last_value, value, timeout=timeout, max_length=max_length)
+                d_size = len(d.encode('utf-8'))
+                if size + d_size + tail_size <= max_bytes:
+                    length += 1
+                    size += d_size
+                    e.value = d
+                    diffs.append(ScormElementDiff(element=e, diff_of=last, chain_length=length, chain_size=size))
+                    last = e
+                    last_value = value
+                    continue
+
+        # This element keeps its full value.
+        length = 0
+        size = 0
+        last = e
+        last_value = value
+
+    return diffs
+
 def diff_scormelements(attempt, key='cmi.suspend_data'):
     """
-        For SCORM elements for the given attempt with the given key, replace the full value with a diff, relative to the most recent value.
+        For SCORM elements for the given attempt with the given key, replace the full value with a diff, relative to the next value.
         The most recent ScormElement object has the full value saved, so it can be read off easily, but the earlier values are stored as diffs to save on space.
+        Periodic checkpoints keep their full values, so the number of diffs needed to reconstruct any value is bounded: see ``chain_scormelement_diffs``.
+
+        Only the elements saved since the last time this ran are diffed, along with the element that was the most recent then.
+        If an element arrived late, with a time before that element's, the chains are rebuilt with ``rebuild_scormelement_diffs`` so that it's diffed too.
     """
-    elements = attempt.scormelements.filter(key=key,diff=None)
-    last = None
     with transaction.atomic():
-        for e in sorted(elements, key=lambda x: hasattr(x,'diffs')):
-            value = e.value
-            if last is not None and not e.newer_than(last):
-                d = make_diff(lastvalue,e.value)
-                e.value = d
-                ScormElementDiff.objects.get_or_create(element=e,diff_of=last)
-                e.save()
-            last = e
-            lastvalue = value
-            if hasattr(e,'diffs'):
-                break
-        attempt.diffed = True
-        attempt.save()
-
-def resolve_dependency_order(deps):
-    order = list(deps.keys())
-    i = 0
-    step = 0
-    l = len(order)
-    while i<l:
-        step += 1
-        if step>l*l:
-            raise Exception("There's a loop in the dependency chain of diffed SCORM elements")
-        a = order[i]
-        if a in deps:
-            b = deps[a]
-            if b in order:
-                j = order.index(b)
-                if j<i:
-                    order.pop(j)
-                    order.append(b)
-                    i -= 1
-        i += 1
-    return list(reversed(order))
+        # Lock the attempt, so that two processes can't diff the same elements at once.
+        diffed = Attempt.objects.select_for_update().values_list('diffed', flat=True).get(pk=attempt.pk)
+
+        elements = attempt.scormelements.filter(key=key)
+
+        # The most recent element that other elements are diffed against. Everything before it has already been dealt with, unless it arrived late.
+        head = elements.filter(diffs__isnull=False).first()
+
+        if head is not None and elements.filter(diff=None, diffs__isnull=True, time__lt=head.time, pk__gt=head.pk).exists():
+            # An element arrived after the head was diffed against, with an earlier time, so it isn't part of any chain.
+            rebuild_scormelement_diffs(attempt, key)
+        else:
+            candidates = elements.filter(diff=None)
+            tail = (0,0)
+            if head is not None:
+                candidates = candidates.filter(time__gte=head.time)
+
+                # The chain of diffs leading to the head goes back to the previous full value.
+                segment = ScormElementDiff.objects.filter(element__attempt=attempt, element__key=key, element__time__lt=head.time)
+                previous_full = elements.filter(diff=None, time__lt=head.time).first()
+                if previous_full is not None:
+                    segment = segment.filter(element__time__gt=previous_full.time)
+                stats = segment.aggregate(length=models.Max('chain_length'), size=models.Max('chain_size'))
+                tail = (stats['length'] or 0, stats['size'] or 0)
+
+            candidates = list(candidates)
+            diffs = chain_scormelement_diffs(candidates, tail)
+
+            ScormElement.objects.bulk_update([d.element for d in diffs], ['value'])
+            ScormElementDiff.objects.bulk_create(diffs)
+
+            for d in diffs:
+                if d.element == head:
+                    # The head is now a diff, so the chain leading to it is longer.
+                    segment.update(chain_length=F('chain_length')+d.chain_length, chain_size=F('chain_size')+d.chain_size)
+
+        if not diffed:
+            attempt.diffed = True
+            attempt.save(update_fields=['diffed'])
+
+def rebuild_scormelement_diffs(attempt, key='cmi.suspend_data'):
+    """
+        Rebuild the chains of diffs for SCORM elements for the given attempt with the given key from scratch, following the current checkpoint policy.
+    """
+    with transaction.atomic():
+        elements = list(attempt.scormelements.filter(key=key).select_related('diff'))
+        stored = {e.pk: e.value for e in elements}
+        resolve_diffed_scormelements(elements)
+
+        ScormElementDiff.objects.filter(element__in=elements).delete()
+        diffs = chain_scormelement_diffs(elements)
+        ScormElementDiff.objects.bulk_create(diffs)
+
+        ScormElement.objects.bulk_update([e for e in elements if e.value != stored[e.pk]], ['value'])
+
+def diff_base_pk(element):
+    """
+        The primary key of the element that the given element's value is a diff against, or ``None`` if its value is stored in full.
+    """
+    try:
+        return element.diff.diff_of_id
+    except ObjectDoesNotExist:
+        return None
 
 def resolve_diffed_scormelements(elements):
+    """
+        Replace the values of any of the given elements which are stored as diffs with their full values.
+
+        Each diff is relative to a newer element, which might itself be a diff, so the elements form chains ending at an element whose full value is stored.
+        Only the chains leading from the given elements are followed: if an element in a chain wasn't given, it's loaded from the database.
+        Each element's value is resolved once, and then used for every element that depends on it.
+
+        Returns the list of given elements.
+    """
     if isinstance(elements,models.QuerySet):
         elements = elements.select_related('diff')
     elements = list(elements)
     emap = {e.pk: e for e in elements}
-    diffmap = {}
+
+    missing = set(diff_base_pk(e) for e in elements) - set(emap.keys()) - {None}
+    while missing:
+        fetched = list(ScormElement.objects.filter(pk__in=missing).select_related('diff'))
+        if len(fetched) < len(missing):
+            raise Exception("A diffed SCORM element depends on an element which doesn't exist")
+        emap.update({e.pk: e for e in fetched})
+        missing = set(diff_base_pk(e) for e in fetched) - set(emap.keys()) - {None}
+
+    resolved = set()
     for e in elements:
-        try:
-            diffmap[e.pk] = e.diff.diff_of.pk
-        except ObjectDoesNotExist:
-            pass
-    order = resolve_dependency_order(diffmap)
-    for p in order:
-        e1 = emap[p]
-        e2 = emap[e1.diff.diff_of.pk]
-        e1.value = apply_diff(e1.value, e2.value)
-        
+        chain = []
+        in_chain = set()
+        while e.pk not in resolved:
+            base_pk = diff_base_pk(e)
+            if base_pk is None:
+                break
+            if e.pk in in_chain:
+                raise Exception("There's a loop in the dependency chain of diffed SCORM elements")
+            chain.append(e)
+            in_chain.add(e.pk)
+            e = emap[base_pk]
+
+        value = e.value
+        resolved.add(e.pk)
+        for d in reversed(chain):
+            d.value = value = apply_diff(d.value, value)
+            resolved.add(d.pk)
+
     return elements
 
 class RemarkedScormElement(models.Model):
@@ -1929,7 +2289,7 @@ class EditorLink(models.Model):
 
         if self.projects.exists():
             project_pks = [str(p.remote_id) for p in self.projects.all()]
-            r = requests.get('{}/api/available-exams'.format(self.url), params={'projects':project_pks})
+            r = requests_session.get_session().get('{}/api/available-exams'.format(self.url), params={'projects':project_pks})
 
             self.cached_available_exams = r.text
         else:
@@ -2042,3 +2402,29 @@ class UserScoreReported(models.Model):
         if self.error:
             s += _(' failed: {error_msg}').format(error_msg=self.error)
         return s
+
+class PendingOutcomeReport(models.Model):
+    """
+        A student's score for a resource which couldn't be reported back to the consumer, and is waiting to be sent again.
+        There's at most one for each student and resource: the student's current grade is worked out again each time it's sent.
+    """
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='pending_outcome_reports')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pending_outcome_reports')
+    consumer = models.ForeignKey(LTIConsumer, on_delete=models.CASCADE, null=True, related_name='pending_outcome_reports')
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('Time the first report failed'))
+    num_attempts = models.PositiveIntegerField(default=0, verbose_name=_('Number of times sending this report has failed'))
+    next_attempt_time = models.DateTimeField(default=timezone.now, verbose_name=_('Time to next try sending this report'))
+    last_error = models.TextField(blank=True, default='', verbose_name=_('The error from the last failed attempt'))
+    dead = models.BooleanField(default=False, verbose_name=_('Has this report been given up on after too many failures?'))
+
+    class Meta:
+        unique_together = (('resource','user'),)
+        indexes = [
+            models.Index(fields=['dead','next_attempt_time']),
+        ]
+        ordering = ('next_attempt_time',)
+        verbose_name = _('pending outcome report')
+        verbose_name_plural = _('pending outcome reports')
+
+    def __str__(self):
+        return _('Score of {user_name} on {resource}, failed {num_attempts} times').format(user_name=self.user.get_full_name(), resource=str(self.resource), num_attempts=self.num_attempts)
@@ -0,0 +1,48 @@
+"""
+    A cache of the parsed contents of files in extracted packages, such as an exam's ``source.exam`` and ``numbas-manifest.json``.
+
+    Each file is loaded at most once per process, as long as it hasn't changed: entries are keyed by the package's ``static_uuid`` and the file's modification time.
+    The ``PACKAGE_FILE_CACHE_SIZE`` most recently used files are kept in memory.
+    If the ``PACKAGE_FILE_SHARED_CACHE`` setting names one of the caches in ``CACHES``, parsed files are also stored there, so they're shared between processes.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+import functools
+import os
+
+MISSING = object()
+
+def get_shared_cache():
+    alias = getattr(settings, 'PACKAGE_FILE_SHARED_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+@functools.lru_cache(maxsize=getattr(settings, 'PACKAGE_FILE_CACHE_SIZE', 128))
+def load_file(key, path, loader):
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_key = 'numbas_lti:package_file:' + key
+        value = shared_cache.get(shared_key, MISSING)
+        if value is MISSING:
+            value = loader(path)
+            shared_cache.set(shared_key, value, None)
+        return value
+
+    return loader(path)
+
+def cached_package_file(package, filename, loader):
+    """
+        The result of ``loader(path)`` for the file ``filename`` in the given extracted package.
+
+        The result is shared between everything that asks for the same file, so it mustn't be modified.
+    """
+    path = os.path.join(package.extracted_path, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+
+    key = f'{package.__class__.__name__}:{package.static_uuid}:{filename}:{mtime}:{loader.__module__}.{loader.__qualname__}'
+    return load_file(key, path, loader)
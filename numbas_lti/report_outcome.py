@@ -1,13 +1,22 @@
 from . import requests_session
 from .exceptions import LineItemDoesNotExist
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+import logging
+import queue
+import random
 import requests
+import threading
+import time
 from requests_oauthlib import OAuth1
 import uuid
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction
 
 from hashlib import sha1
 from base64 import b64encode
@@ -15,12 +24,15 @@ from base64 import b64encode
 from oauthlib.oauth1 import Client
 from oauthlib.common import to_unicode
 
-from pylti1p3.contrib.django.lti1p3_tool_config import DjangoDbToolConf
+from pylti1p3.assignments_grades import AssignmentsGradesService
+from pylti1p3.exception import LtiServiceException
 from pylti1p3.grade import Grade
 
 from lxml import etree
 
-from .models import ReportProcess, UserScoreReported, User
+from .models import PendingOutcomeReport, ReportProcess, UserScoreReported, User
+
+logger = logging.getLogger(__name__)
 
 class ReportOutcomeException(Exception):
     def __init__(self,user_data,error):
@@ -48,6 +60,11 @@ class ReportOutcomeConnectionError(ReportOutcomeException):
     def __init__(self,connection_error):
         self.error = connection_error
 
+class ReportOutcomeServerError(ReportOutcomeException):
+    def __init__(self,status_code,text):
+        self.error = text
+        self.message = _('The LTI consumer responded with HTTP status {status_code}:\n{text}').format(status_code=status_code, text=text)
+
 class ReportOutcomeFailure(ReportOutcomeException):
     def __init__(self,user_data,consumer_message):
         self.consumer_message = consumer_message
@@ -57,7 +74,145 @@ class ReportOutcomeFailure(ReportOutcomeException):
         }
         self.message = _('Outcome report for user {user_name} failed; the LTI consumer said: {consumer_message}').format(**ctx)
 
-def report_all_resource_scores(resource):
+class ReportOutcomeCircuitOpen(ReportOutcomeException):
+    def __init__(self, until):
+        self.error = None
+        self.until = until
+        self.message = _('Reports to this LTI consumer are paused until {until}, because too many reports failed in a row.').format(until=until)
+
+def consumer_circuit_key(consumer_pk):
+    return f'numbas_lti:report_outcome:circuit:{consumer_pk}'
+
+def consumer_failures_key(consumer_pk):
+    return f'numbas_lti:report_outcome:failures:{consumer_pk}'
+
+def check_consumer_circuit(consumer_pk):
+    """
+        Raise ``ReportOutcomeCircuitOpen`` if reports to the given consumer are paused.
+
+        Once ``REPORT_OUTCOME_CIRCUIT_THRESHOLD`` reports to a consumer have failed in a row, no more are sent to it for ``REPORT_OUTCOME_CIRCUIT_COOLDOWN`` seconds.
+        The state is kept in the default cache, so it's only shared between processes if that cache is.
+    """
+    until = cache.get(consumer_circuit_key(consumer_pk))
+    if until is not None and until > now():
+        raise ReportOutcomeCircuitOpen(until)
+
+def record_consumer_success(consumer_pk):
+    cache.delete(consumer_failures_key(consumer_pk))
+
+def record_consumer_failure(consumer_pk):
+    cooldown = getattr(settings, 'REPORT_OUTCOME_CIRCUIT_COOLDOWN', 300)
+    key = consumer_failures_key(consumer_pk)
+    cache.add(key, 0, cooldown)
+    try:
+        failures = cache.incr(key)
+    except ValueError:
+        # The count expired since it was added.
+        failures = 1
+        cache.set(key, failures, cooldown)
+
+    if failures >= getattr(settings, 'REPORT_OUTCOME_CIRCUIT_THRESHOLD', 5):
+        until = now() + timedelta(seconds=cooldown)
+        cache.set(consumer_circuit_key(consumer_pk), until, cooldown)
+        cache.delete(key)
+        logger.info(f"Pausing outcome reports to consumer {consumer_pk} until {until} after {failures} failures in a row.")
+
+def is_consumer_failure(error):
+    """
+        Does the given error suggest that the consumer isn't working, rather than that it rejected one report or that something went wrong here?
+        Only failures to connect, timeouts and server errors count.
+    """
+    return isinstance(error, (ReportOutcomeConnectionError, ReportOutcomeTimeoutError, ReportOutcomeServerError))
+
+def retry_delay(num_attempts):
+    """
+        How long to wait before sending a report again, after it has failed ``num_attempts`` times.
+        The delay doubles with each failure, up to a maximum, and is randomised so that reports which failed together aren't all sent again at the same moment.
+    """
+    base = getattr(settings, 'REPORT_OUTCOME_RETRY_BASE_DELAY', 60)
+    maximum = getattr(settings, 'REPORT_OUTCOME_RETRY_MAX_DELAY', 6*60*60)
+    delay = min(maximum, base * 2**(num_attempts-1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+def update_outbox(resource, reported_users, failures):
+    """
+        Update the outbox of pending reports after trying to report scores for a resource.
+
+        ``reported_users`` is a list of users whose scores don't need to be sent again, and ``failures`` is a list of tuples ``(user, consumer_pk, error)`` for reports which failed.
+        A failed report is sent again after a delay given by ``retry_delay``, until it has failed ``REPORT_OUTCOME_MAX_ATTEMPTS`` times, when it's marked as dead.
+        Reports which weren't sent because the consumer's circuit was open don't count as failures.
+    """
+    if reported_users:
+        PendingOutcomeReport.objects.filter(resource=resource, user__in=reported_users).delete()
+
+    if not failures:
+        return
+
+    existing = {p.user_id: p for p in PendingOutcomeReport.objects.filter(resource=resource, user__in=[user for user, consumer_pk, error in failures])}
+    max_attempts = getattr(settings, 'REPORT_OUTCOME_MAX_ATTEMPTS', 10)
+    t = now()
+
+    to_create = []
+    to_update = []
+    for user, consumer_pk, error in failures:
+        pending = existing.get(user.pk)
+        if pending is None:
+            pending = PendingOutcomeReport(resource=resource, user=user)
+            to_create.append(pending)
+        else:
+            to_update.append(pending)
+
+        pending.consumer_id = consumer_pk
+        pending.last_error = str(error)
+        if isinstance(error, ReportOutcomeCircuitOpen):
+            pending.next_attempt_time = error.until
+        else:
+            pending.num_attempts += 1
+            pending.next_attempt_time = t + retry_delay(pending.num_attempts)
+            pending.dead = pending.num_attempts >= max_attempts
+
+    # If another process has added a pending report for the same student in the meantime, that one is kept.
+    PendingOutcomeReport.objects.bulk_create(to_create, ignore_conflicts=True)
+    PendingOutcomeReport.objects.bulk_update(to_update, ['consumer', 'last_error', 'num_attempts', 'next_attempt_time', 'dead'])
+
+def retry_pending_outcome_reports():
+    """
+        Send again the pending reports whose next attempt is due, at most ``REPORT_OUTCOME_RETRY_BATCH_SIZE`` at a time.
+        Returns the number of reports that were tried.
+    """
+    batch_size = getattr(settings, 'REPORT_OUTCOME_RETRY_BATCH_SIZE', 200)
+
+    # Claim these reports, so that another run which starts before this one finishes doesn't send them too.
+    # Rows locked by another run are skipped, and the claim is made before the locks are released.
+    with transaction.atomic():
+        due = list(PendingOutcomeReport.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .filter(dead=False, next_attempt_time__lte=now())
+            .select_related('resource', 'user')
+            .order_by('next_attempt_time')
+            [:batch_size]
+        )
+        if not due:
+            return 0
+
+        PendingOutcomeReport.objects.filter(pk__in=[p.pk for p in due]).update(next_attempt_time=now() + timedelta(minutes=10))
+
+    users_by_resource = defaultdict(list)
+    resources = {}
+    for pending in due:
+        resources[pending.resource_id] = pending.resource
+        users_by_resource[pending.resource_id].append(pending.user)
+
+    for resource_pk, users in users_by_resource.items():
+        report_outcomes_concurrently(resources[resource_pk], users)
+
+    return len(due)
+
+def report_all_resource_scores(resource, force=False):
+    """
+        Report the scores of all students who have attempted the given resource.
+        Unless ``force`` is ``True``, a student's score is only sent if it has changed since it was last successfully reported.
+    """
     if ReportProcess.objects.filter(resource=resource,status='reporting').exists():
         return
 
@@ -66,14 +221,17 @@ def report_all_resource_scores(resource):
     errors = []
 
     try:
+        lti_13_run = None
         if resource.lti_13_links.exists():
-            resource.get_lti_13_lineitem(create=True)
+            lti_13_run = LTI_13_ReportRun(resource, create_lineitem=True)
+            if lti_13_run.error is not None:
+                raise lti_13_run.error
+
+        users = list(User.objects.filter(attempts__resource=resource, attempts__deleted=False).distinct())
+        process.num_users = len(users)
+        process.save(update_fields=['num_users'])
 
-        for user in User.objects.filter(attempts__resource=resource, attempts__deleted=False).distinct():
-            try:
-                request = report_outcome(resource, user, report_process=process)
-            except ReportOutcomeException as e:
-                errors.append(e)
+        errors += report_outcomes_concurrently(resource, users, process, force=force, lti_13_run=lti_13_run)
 
     except Exception as e:
         errors.append(e)
@@ -86,54 +244,307 @@ def report_all_resource_scores(resource):
     process.dismissed = False
     process.save(update_fields=['status','response','dismissed'])
 
+    logger.info(f"Reported scores for resource {resource}: {process.num_reported - process.num_skipped} sent, {process.num_skipped} unchanged. HTTP connections: {requests_session.connection_stats()}")
+
     return process
 
+class LTI_13_ReportRun:
+    """
+        The things needed to report scores for a resource over LTI 1.3 which are the same for every student:
+        the Assignments and Grades Service, its OAuth access token, and the resource's line item.
+
+        Make one of these for each run of reports, so that they're only loaded once.
+        If anything can't be loaded, the exception is kept in ``error``, and raised for each report.
+    """
+
+    # Access tokens usually last for an hour; get a new one before then.
+    ACCESS_TOKEN_MAX_AGE = timedelta(minutes=30)
+
+    def __init__(self, resource, create_lineitem=False):
+        self.resource = resource
+        self.error = None
+        self.ags = None
+        self.service_connector = None
+        self.lineitem = None
+        self.lock = threading.Lock()
+
+        try:
+            self.lti_13_context = resource.lti_13_contexts().first()
+            self.lineitem = resource.get_lti_13_lineitem(create=create_lineitem)
+        except LineItemDoesNotExist:
+            pass
+        except Exception as e:
+            self.error = e
+            return
+
+        self.load_ags()
+
+    def load_ags(self):
+        try:
+            ags_data = self.lti_13_context.ags_data
+            if not ags_data:
+                raise Exception(_("The platform didn't give an Assignments and Grades Service endpoint for this context."))
+            # The same service connector is used for every report in the run, so they share its access token.
+            self.service_connector = self.lti_13_context.get_service_connector()
+            self.ags = AssignmentsGradesService(self.service_connector, ags_data)
+            # Fetch the access token now, rather than every thread sending reports asking for one at once.
+            self.service_connector.get_access_token(ags_data['scope'])
+            self.ags_loaded_at = now()
+        except Exception as e:
+            self.error = e
+
+    def get_ags(self):
+        with self.lock:
+            if self.error is None and now() - self.ags_loaded_at > self.ACCESS_TOKEN_MAX_AGE:
+                self.load_ags()
+            if self.error is not None:
+                raise self.error
+            return self.ags
+
+consumer_semaphores = {}
+consumer_semaphores_lock = threading.Lock()
+
+def consumer_semaphore(consumer_pk):
+    """
+        A semaphore limiting the number of outcome reports that this process sends to one consumer at the same time.
+    """
+    with consumer_semaphores_lock:
+        if consumer_pk not in consumer_semaphores:
+            consumer_semaphores[consumer_pk] = threading.BoundedSemaphore(getattr(settings, 'REPORT_OUTCOME_CONSUMER_CONCURRENCY', 4))
+        return consumer_semaphores[consumer_pk]
+
+def report_outcomes_concurrently(resource, users, report_process=None, force=False, lti_13_run=None):
+    """
+        Report the outcomes of the given users on a resource, using a pool of ``REPORT_OUTCOME_THREADS`` threads.
+        At most ``REPORT_OUTCOME_CONSUMER_CONCURRENCY`` reports are sent to each consumer at once.
+
+        The ``UserScoreReported`` objects are saved in bulk, and the counts on ``report_process``, if given, are updated as reports finish.
+        Failed reports are added to the outbox, to be sent again later.
+        Scores which haven't changed since they were last reported are skipped, unless ``force`` is ``True``.
+        If the resource is linked to over LTI 1.3, the same ``LTI_13_ReportRun`` is used for every report; one is made if it isn't given.
+        Returns a list of errors.
+    """
+    if not users:
+        return []
+
+    if lti_13_run is None and resource.lti_13_links.exists():
+        lti_13_run = LTI_13_ReportRun(resource)
+
+    grades = resource.grade_all_users(users, include_submitted_at=False)
+
+    num_threads = min(getattr(settings, 'REPORT_OUTCOME_THREADS', 8), len(users))
+
+    user_queue = queue.SimpleQueue()
+    for user in users:
+        user_queue.put(user)
+    results = queue.SimpleQueue()
+
+    def worker():
+        try:
+            while True:
+                try:
+                    user = user_queue.get_nowait()
+                except queue.Empty:
+                    return
+
+                consumer_pk = None
+                try:
+                    user_data = resource.user_data(user)
+                    consumer_pk = user_data.consumer_id if user_data is not None else None
+                    with consumer_semaphore(consumer_pk):
+                        results.put((user, consumer_pk) + make_outcome_report(resource, user, user_data, report_process=report_process, force=force, lti_13_run=lti_13_run, grade=grades.get(user.pk)))
+                except Exception as e:
+                    results.put((user, consumer_pk, None, e))
+        finally:
+            # Each thread has its own database connection.
+            connection.close()
+
+    errors = []
+    unsaved_reports = []
+    reported_users = []
+    failures = []
+    num_reported = 0
+    num_skipped = 0
+    last_saved = time.monotonic()
+
+    def save_progress():
+        UserScoreReported.objects.bulk_create(unsaved_reports)
+        unsaved_reports.clear()
+        update_outbox(resource, reported_users, failures)
+        reported_users.clear()
+        failures.clear()
+        if report_process is not None:
+            ReportProcess.objects.filter(pk=report_process.pk).update(num_reported=num_reported, num_skipped=num_skipped, num_errors=len(errors))
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for i in range(num_threads):
+            executor.submit(worker)
+
+        for i in range(len(users)):
+            user, consumer_pk, score_report, error = results.get()
+            num_reported += 1
+            if score_report is not None:
+                unsaved_reports.append(score_report)
+            elif error is None:
+                num_skipped += 1
+            if error is None:
+                reported_users.append(user)
+            else:
+                failures.append((user, consumer_pk, error))
+                errors.append(error)
+
+            if len(unsaved_reports) >= 100 or time.monotonic() - last_saved > 1:
+                save_progress()
+                last_saved = time.monotonic()
+
+    save_progress()
+    if report_process is not None:
+        report_process.num_reported = num_reported
+        report_process.num_skipped = num_skipped
+        report_process.num_errors = len(errors)
+
+    return errors
+
 def report_outcome_for_attempt(attempt):
     return report_outcome(attempt.resource,attempt.user)
 
-def report_outcome(resource, user, report_process=None) -> UserScoreReported:
+def report_outcome(resource, user, report_process=None, force=False) -> UserScoreReported:
     """
         Report the outcome of a student on a particular resource.
         Returns a UserScoreReported object containing details about the report.
         Calls either ``report_outcome_lti_13`` or ``report_outcome_lti_11`` depending on how the resource is linked to.
         Those methods should fill in the UserScoreReported object.
+
+        If the student's grade hasn't changed since it was last successfully reported, or they have no graded attempt or LTI launch data, nothing is sent, and the previous report is returned.
+        Set ``force`` to ``True`` to send the grade anyway.
+
+        If the report fails, it's added to the outbox to be sent again later.
     """
     user_data = resource.user_data(user) 
 
+    score_report, error = make_outcome_report(resource, user, user_data, report_process=report_process, force=force)
+    if score_report is None:
+        logger.debug(f"No score was sent for {user} on {resource}: it hasn't changed since it was last reported, or there's nothing to report.")
+        update_outbox(resource, [user], [])
+        return last_successful_report(resource, user)
+
+    score_report.save()
+
+    if error is not None:
+        consumer_pk = user_data.consumer_id if user_data is not None else None
+        update_outbox(resource, [], [(user, consumer_pk, error)])
+        raise error
+
+    update_outbox(resource, [user], [])
+
+    return score_report
+
+def last_successful_report(resource, user):
+    """
+        The most recent report of the given student's score on the resource which didn't fail, or ``None``.
+    """
+    return UserScoreReported.objects.filter(resource=resource, user=user, error__isnull=True).order_by('-time','-pk').first()
+
+def grade_unchanged(resource, user, user_data, grade, lti_13):
+    """
+        Has the given grade, as returned by ``Resource.grade_user`` or ``Resource.grade_all_users``, already been successfully reported?
+
+        Only the values that are sent are compared: over LTI 1.3, the raw score, maximum score and completion status; over LTI 1.1, the scaled score.
+    """
+    if grade is None:
+        return False
+
+    attempt, completion_status, submitted_at = grade
+    if attempt is None:
+        return False
+
+    last_report = last_successful_report(resource, user)
+    if last_report is None:
+        return False
+
+    if lti_13:
+        return (last_report.raw_score, last_report.max_score, last_report.completion_status) == (attempt.raw_score, attempt.max_score, completion_status)
+    else:
+        return user_data is not None and user_data.last_reported_score == attempt.scaled_score
+
+def make_outcome_report(resource, user, user_data, report_process=None, force=False, lti_13_run=None, grade=None):
+    """
+        Report the outcome of a student on a particular resource, without saving the record of the report.
+        Returns a tuple ``(score_report, error)``, where ``score_report`` is an unsaved UserScoreReported object and ``error`` is a ``ReportOutcomeException``, or ``None`` if the report succeeded.
+
+        Unless ``force`` is ``True``, nothing is sent if the grade is the same as the last one successfully reported, and ``(None, None)`` is returned.
+        Nothing is sent either if the student has no graded attempt or no LTI launch data.
+        ``lti_13_run`` is an ``LTI_13_ReportRun`` to use when the resource is linked to over LTI 1.3; if it isn't given, a new one is made.
+        ``grade``, if given, is the student's grade from ``Resource.grade_all_users`` with ``include_submitted_at=False``; otherwise it's worked out by ``Resource.grade_user``.
+    """
     score_report = UserScoreReported(
         user=user,
         resource=resource,
         report_process=report_process
     )
 
+    consumer_pk = user_data.consumer_id if user_data is not None else None
+
     try:
-        if resource.lti_13_links.exists():
-            report_outcome_lti_13(resource, user_data, score_report=score_report)
-        elif resource.lti_11_links.exists():
-            report_outcome_lti_11(resource, user_data, score_report=score_report)
-    except requests.exceptions.ConnectionError as e:
-        conn_err = ReportOutcomeConnectionError(e)
-        score_report.error = str(conn_err)
-        raise conn_err from e
-    except requests.exceptions.Timeout as e:
-        timeout_err = ReportOutcomeTimeoutError(e)
-        score_report.error = str(timeout_err)
-        raise timeout_err from e
-    except Exception as e:
-        outcome_err = ReportOutcomeException(user_data,e)
-        score_report.error = str(e)
-        raise outcome_err from e
-    finally:
-        score_report.save()
+        try:
+            needs_submitted_at = grade is not None
+            if grade is None:
+                grade = resource.grade_user(user)
+
+            if user_data is None or grade is None or grade[0] is None:
+                logger.debug(f"Not reporting a score for {user} on {resource}: there's no graded attempt or LTI launch data for them.")
+                return None, None
+
+            lti_13 = lti_13_run is not None or resource.lti_13_links.exists()
+
+            if not force and grade_unchanged(resource, user, user_data, grade, lti_13):
+                return None, None
+
+            if needs_submitted_at:
+                # The submission time takes a few queries to work out, so it's only found once the grade is going to be sent.
+                attempt, completion_status, submitted_at = grade
+                grade = (attempt, completion_status, attempt.get_end_time())
+
+            check_consumer_circuit(consumer_pk)
+
+            if lti_13:
+                report_outcome_lti_13(resource, user_data, grade, score_report=score_report, run=lti_13_run)
+            elif resource.lti_11_links.exists():
+                report_outcome_lti_11(resource, user_data, grade, score_report=score_report)
+        except (ReportOutcomeCircuitOpen, ReportOutcomeServerError) as e:
+            score_report.error = str(e)
+            raise
+        except requests.exceptions.ConnectionError as e:
+            conn_err = ReportOutcomeConnectionError(e)
+            score_report.error = str(conn_err)
+            raise conn_err from e
+        except requests.exceptions.Timeout as e:
+            timeout_err = ReportOutcomeTimeoutError(e)
+            score_report.error = str(timeout_err)
+            raise timeout_err from e
+        except Exception as e:
+            if not isinstance(e, ReportOutcomeFailure):
+                logger.exception(f"Error reporting the score for {user} on {resource}")
+            outcome_err = ReportOutcomeException(user_data,e)
+            score_report.error = str(e)
+            raise outcome_err from e
+    except ReportOutcomeException as e:
+        if is_consumer_failure(e):
+            record_consumer_failure(consumer_pk)
+        return score_report, e
 
-    return score_report
+    if score_report.error is None:
+        record_consumer_success(consumer_pk)
+
+    return score_report, None
 
-def report_outcome_lti_13(resource, user_data, score_report):
-    tool_conf = DjangoDbToolConf()
+def report_outcome_lti_13(resource, user_data, grade, score_report, run=None):
+    if run is None:
+        run = LTI_13_ReportRun(resource)
 
     user = user_data.user
 
-    attempt, completion_status, submitted_at = resource.grade_user(user)
+    attempt, completion_status, submitted_at = grade
 
     time_offset = getattr(settings,'REPORT_SCORE_SUBTRACT_MINUTES',1) * timedelta(minutes=1)
 
@@ -185,16 +596,21 @@ def report_outcome_lti_13(resource, user_data, score_report):
 
     consumer = user_data.consumer
 
-    ags = resource.lti_13_contexts().first().get_ags()
+    ags = run.get_ags()
 
-    try:
-        lineitem = resource.get_lti_13_lineitem()
-    except LineItemDoesNotExist:
+    if run.lineitem is None:
+        # Nothing was sent, so this mustn't count as a successful report.
+        score_report.error = _('The line item for this resource does not exist.')
         return
 
-    ags.put_grade(grade, lineitem)
+    try:
+        ags.put_grade(grade, run.lineitem)
+    except LtiServiceException as e:
+        if e.response.status_code >= 500:
+            raise ReportOutcomeServerError(e.response.status_code, e.response.text) from e
+        raise
 
-def report_outcome_lti_11(resource,user_data, score_report):
+def report_outcome_lti_11(resource,user_data, grade, score_report):
 
     template = """<?xml version = "1.0" encoding = "UTF-8"?>
     <imsx_POXEnvelopeRequest xmlns = "http://www.imsglobal.org/services/ltiv1p1/xsd/imsoms_v1p0">
@@ -227,7 +643,7 @@ def report_outcome_lti_11(resource,user_data, score_report):
     if user.is_anonymous:
         raise ReportOutcomeException(None,'User is anonymous')
     message_identifier = uuid.uuid4().int & (1<<64)-1
-    attempt, completion_status, submitted_at = resource.grade_user(user)
+    attempt, completion_status, submitted_at = grade
     result = attempt.scaled_score
 
     score_report.attempt = attempt
@@ -247,6 +663,9 @@ def report_outcome_lti_11(resource,user_data, score_report):
                 timeout = getattr(settings,'REQUEST_TIMEOUT',60)
             )
 
+        if r.status_code >= 500:
+            raise ReportOutcomeServerError(r.status_code, r.text)
+
         namespaces = {'ims':'http://www.imsglobal.org/services/ltiv1p1/xsd/imsoms_v1p0'}
         try:
             xml = etree.fromstring(r.content)
@@ -263,3 +682,6 @@ def report_outcome_lti_11(resource,user_data, score_report):
         else:
             description = status.find('ims:imsx_description',namespaces=namespaces).text
             raise ReportOutcomeFailure(user_data,description)
+    else:
+        # Nothing was sent, so this mustn't count as a successful report.
+        score_report.error = _('The consumer did not give an outcome service for this student.')
@@ -1,6 +1,18 @@
+"""
+    HTTP sessions for requests made to other services, such as LTI consumers and the Numbas editor.
+
+    Each process has one session, which keeps a pool of open connections to each host it talks to, so consecutive requests to the same host reuse a connection instead of making a new TCP and TLS handshake each time.
+    The session doesn't store cookies, so it's safe to share between requests made on behalf of different users, and between threads.
+"""
+
 from . import version
 from django.conf import settings
+import functools
+from http.cookiejar import DefaultCookiePolicy
+import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 class Session(requests.Session):
     def send(self, request, **kwargs):
@@ -8,8 +20,58 @@ class Session(requests.Session):
             kwargs['timeout'] = (5,30)
         return super().send(request, **kwargs)
 
-def get_session():
+def make_session():
     REQUESTS_USER_AGENT = getattr(settings, 'REQUESTS_USER_AGENT', 'Numbas LTI provider')
     session = Session()
     session.headers['User-Agent'] = f'{REQUESTS_USER_AGENT} {version}'
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    # Only idempotent requests are retried, so an outcome report is never sent twice.
+    retry = Retry(
+        total = getattr(settings, 'REQUESTS_MAX_RETRIES', 2),
+        backoff_factor = 0.5,
+        status_forcelist = (502, 503, 504),
+        allowed_methods = Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status = False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections = getattr(settings, 'REQUESTS_POOL_CONNECTIONS', 20),
+        pool_maxsize = getattr(settings, 'REQUESTS_POOL_MAXSIZE', 10),
+        max_retries = retry,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
     return session
+
+@functools.cache
+def session_for_process(pid):
+    return make_session()
+
+def get_session():
+    """
+        The HTTP session for this process.
+        A new session is made in each process, so that connections aren't shared with forked processes.
+    """
+    return session_for_process(os.getpid())
+
+def connection_stats():
+    """
+        The number of requests made and connections opened for each host that this process's session has a connection pool for.
+
+        Returns a dictionary mapping hosts to dictionaries ``{'requests': int, 'connections': int}``.
+        Pools which have been closed to make room for others aren't counted.
+    """
+    stats = {}
+    for adapter in set(get_session().adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f'{pool.scheme}://{pool.host}:{pool.port}'
+            stats[host] = {
+                'requests': pool.num_requests,
+                'connections': pool.num_connections,
+            }
+    return stats
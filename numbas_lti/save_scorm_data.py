@@ -1,7 +1,10 @@
-from .models import ScormElement
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from .groups import group_for_attempt
+from .models import ScormElement, diff_at_ingest
 import datetime
-from django.db import transaction
-from django.db.utils import OperationalError
+from django.db import connection, transaction
+from django.db.utils import IntegrityError, OperationalError
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import logging
@@ -11,70 +14,247 @@ from . import tasks
 
 logger = logging.getLogger(__name__)
 
-def save_scorm_data(attempt,batches):
+# MySQL error codes for strings which can't be stored in the database's character set.
+ENCODING_ERROR_CODES = [1366, 1267]
+
+def element_time(element):
+    """
+        The time that an element received from the client was set.
+    """
+    if 'time_iso' in element:
+        return datetime.datetime.fromisoformat(re.sub(r'Z$','+00:00',element['time_iso']))
+    else:
+        # versions of the LTI provider before v3.4 returned the time as a timestamp without timezone info.
+        # In case there are still clients with that version of the SCORM API open, continue loading that.
+        return timezone.make_aware(datetime.datetime.fromtimestamp(element['time']))
+
+def element_identity(e):
+    """
+        The fields which uniquely identify a ScormElement.
+    """
+    return (e.attempt_id, e.key, e.time, e.counter)
+
+def is_encoding_error(error):
+    return len(error.args)==2 and error.args[0] in ENCODING_ERROR_CODES
+
+def scorm_elements_from_batches(attempt,batches):
+    """
+        Make unsaved ScormElement objects from the batches of elements sent by the client.
+
+        Elements set after the attempt was completed are ignored.
+        If an element appears more than once, only the first copy is kept.
+
+        Returns a list of the IDs of the batches that were read, and a list of pairs ``(ScormElement, element data)``.
+    """
     done = []
+    elements = []
+    seen = set()
+    for id,batch in batches.items():
+        for element in batch:
+            time = element_time(element)
+
+            if attempt.completion_status=='completed' and (attempt.end_time is None or time > attempt.end_time):
+                continue    # don't save new elements after the exam has been created
+
+            e = ScormElement(
+                attempt = attempt,
+                key = element['key'],
+                value = element['value'],
+                time = time,
+                counter = element.get('counter',0)
+            )
+            identity = element_identity(e)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            elements.append((e, element))
+        done.append(id)
+
+    return done, elements
+
+def elements_with_identities(elements):
+    """
+        A queryset containing the saved elements with the same identities as any of the given ScormElement objects, and possibly a few others.
+        It's filtered on each of the fields of the identity separately, so it can use the index for the uniqueness constraint.
+    """
+    return ScormElement.objects.filter(
+        attempt__in = set(e.attempt_id for e in elements),
+        key__in = set(e.key for e in elements),
+        time__in = set(e.time for e in elements),
+    )
+
+def bulk_insert_scorm_elements(elements):
+    """
+        Insert a list of ScormElement objects with a single query.
+
+        Where the database can return the primary keys of inserted rows, they're set on the objects.
+        If another process has saved any of the same elements in the meantime, or the database can't return primary keys, elements which already exist are skipped and the objects are left without primary keys.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        try:
+            with transaction.atomic():
+                ScormElement.objects.bulk_create(elements)
+            return
+        except IntegrityError:
+            for e in elements:
+                e.pk = None
+
+    with transaction.atomic():
+        ScormElement.objects.bulk_create(elements, ignore_conflicts=True)
+
+def insert_scorm_elements(elements):
+    """
+        Save a list of pairs ``(ScormElement, element data)``, skipping any elements which are already in the database.
+
+        The elements are inserted with a single query, relying on the uniqueness constraint on (attempt, key, time, counter) to ignore elements saved concurrently by another process.
+        If the database doesn't return the primary keys of the inserted elements, they're fetched with one more query.
+
+        Returns a list of the ScormElement objects that were created, and a list of the pairs for elements which couldn't be saved.
+    """
+    if not elements:
+        return [], []
+
+    existing = set(elements_with_identities([e for e,data in elements]).values_list('attempt','key','time','counter'))
+    to_insert = [(e,data) for e,data in elements if element_identity(e) not in existing]
+
+    if not to_insert:
+        return [], []
+
     unsaved_elements = []
-    new_elements = []
+    try:
+        bulk_insert_scorm_elements([e for e,data in to_insert])
+    except OperationalError as err:
+        if not is_encoding_error(err):
+            raise err
+
+        # Some of the values can't be stored. Save the elements one at a time, to find out which.
+        saved = []
+        for e,data in to_insert:
+            try:
+                bulk_insert_scorm_elements([e])
+                saved.append((e,data))
+            except OperationalError as err:
+                if not is_encoding_error(err):
+                    raise err
+                logger.exception(_("Error saving SCORM data for attempt {}:\n{}".format(e.attempt_id,err)))
+                unsaved_elements.append((e,data))
+        to_insert = saved
+
+    without_pk = [e for e,data in to_insert if e.pk is None]
+    if without_pk:
+        pks = {
+            element_identity(e): e.pk
+            for e in elements_with_identities(without_pk).only('pk','attempt','key','time','counter')
+        }
+        for e in without_pk:
+            pk = pks.get(element_identity(e))
+            if pk is None:
+                continue
+            e.pk = pk
+            e._state.adding = False
+            e._state.db = ScormElement.objects.db
+
+    new_elements = [e for e,data in to_insert if e.pk is not None]
+
+    return new_elements, unsaved_elements
+
+def save_scorm_data(attempt,batches):
+    """
+        Save batches of SCORM elements sent by the client for the given attempt.
+
+        Returns a list of the IDs of the batches that were processed, and a list of the data of elements which couldn't be saved.
+    """
+    return save_scorm_data_for_attempts([(attempt,batches)])[attempt.pk]
+
+def save_scorm_data_for_attempts(attempt_batches):
+    """
+        Save batches of SCORM elements for several attempts at once, with a single bulk insert.
+
+        ``attempt_batches`` is a list of pairs ``(attempt, batches)``.
+
+        Returns a dictionary mapping the primary key of each attempt to a pair: a list of the IDs of the batches that were processed, and a list of the data of elements which couldn't be saved.
+    """
+    attempts = {}
+    done = {}
+    elements = []
+    for attempt, batches in attempt_batches:
+        attempts[attempt.pk] = attempt
+        done[attempt.pk], attempt_elements = scorm_elements_from_batches(attempt,batches)
+        elements += attempt_elements
+
     with transaction.atomic():
-        needs_diff = False
-        for id,elements in batches.items():
-            for element in elements:
-
-                if 'time_iso' in element:
-                    time = datetime.datetime.fromisoformat(re.sub(r'Z$','+00:00',element['time_iso']))
-                else:
-                    # versions of the LTI provider before v3.4 returned the time as a timestamp without timezone info.
-                    # In case there are still clients with that version of the SCORM API open, continue loading that.
-                    time = timezone.make_aware(datetime.datetime.fromtimestamp(element['time']))
-
-                if attempt.completion_status=='completed' and (attempt.end_time is None or time > attempt.end_time):
-                    continue    # don't save new elements after the exam has been created
-
-                try:
-                    e, created = ScormElement.objects.get_or_create(
-                        attempt = attempt,
-                        key = element['key'],
-                        value = element['value'],
-                        time = time,
-                        counter = element.get('counter',0)
-                    )
-                    if created:
-                        new_elements.append(e)
-                except ScormElement.MultipleObjectsReturned:
-                    pass
-                except OperationalError as e:
-                    if len(e.args)==2:
-                        code, msg = e.args
-                        if code in [1366, 1267]:
-                            logger.exception(_("Error saving SCORM data for attempt {}:\n{}".format(attempt.pk,e)))
-                            unsaved_elements.append(element)
-                        else:
-                            raise e
-                if element['key'] == 'cmi.suspend_data':
-                    needs_diff = True
-            done.append(id)
-
-    if needs_diff:
-        attempt.diffed = False
-        attempt.save(update_fields=('diffed',))
-
-    update_question_score_info(attempt,new_elements)
-
-    return done,unsaved_elements
-
-re_question_score_element = re.compile(r'cmi.objectives.(\d+).(?:score.(?:raw|scaled|max)|completion_status)')
-re_exam_score_element = re.compile(r'cmi.score.(raw|scaled)')
-
-def update_question_score_info(attempt,elements):
-    question_scores_changed = set()
-    exam_score_changed = False
+        new_elements, unsaved_elements = insert_scorm_elements(elements)
+        new_by_attempt = {pk: [] for pk in attempts}
+        for e in new_elements:
+            new_by_attempt[e.attempt_id].append(e)
+        for pk, attempt in attempts.items():
+            attempt.update_current_elements(new_by_attempt[pk])
+
+    for pk, attempt in attempts.items():
+        # When suspend data is diffed as it's saved, the attempt_scorm_elements_saved task does it.
+        # Otherwise, mark the attempt so that the periodic diff_suspend_data task picks it up.
+        if not diff_at_ingest() and any(e.key == 'cmi.suspend_data' for e in new_by_attempt[pk]):
+            attempt.diffed = False
+            attempt.save(update_fields=('diffed',))
+
+        scorm_elements_saved(attempt,new_by_attempt[pk])
+
+    results = {pk: (done[pk], []) for pk in attempts}
+    for e, data in unsaved_elements:
+        results[e.attempt_id][1].append(data)
+
+    return results
+
+re_question_score_element = re.compile(r'^cmi\.objectives\.(\d+)\.(?:score\.(?:raw|scaled|max)|completion_status)$')
+re_exam_score_element = re.compile(r'^cmi\.score\.(raw|scaled|max)$')
+re_objective_id_element = re.compile(r'^cmi\.objectives\.(\d+)\.id$')
+re_question_id = re.compile(r'^q(\d+)')
+
+def describe_changes(elements):
+    """
+        Summarise the effect of a batch of new SCORM elements on their attempt.
+        The summary is passed to the ``tasks.attempt_scorm_elements_saved`` task.
+    """
+    changes = {
+        'score': False,
+        'completion_status': False,
+        'suspend_data': False,
+        'exam_score': False,
+        'question_scores': set(),
+        'num_questions': 0,
+    }
+
     for e in elements:
+        if e.key == 'cmi.score.scaled':
+            changes['score'] = True
+        elif e.key == 'cmi.completion_status':
+            changes['completion_status'] = True
+        elif e.key == 'cmi.suspend_data':
+            changes['suspend_data'] = True
+
         m = re_question_score_element.match(e.key)
         if m:
-            number = int(m.group(1))
-            question_scores_changed.add(number)
+            changes['question_scores'].add(int(m.group(1)))
         elif re_exam_score_element.match(e.key):
-            exam_score_changed = True
+            changes['exam_score'] = True
+        elif re_objective_id_element.match(e.key):
+            m = re_question_id.match(e.value)
+            if m:
+                changes['num_questions'] = max(changes['num_questions'], int(m.group(1))+1)
+
+    return changes
+
+def scorm_elements_saved(attempt,elements):
+    """
+        Act on a batch of new SCORM elements for an attempt, once they've been saved:
+        send them to anyone watching the attempt, and enqueue one task to update the data derived from them.
+    """
+    if not elements:
+        return
+
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(group_for_attempt(attempt), {'type': 'scorm.new.elements', 'elements': [e.as_json() for e in elements]})
 
-    if question_scores_changed or exam_score_changed:
-        tasks.attempt_update_score_info(attempt,question_scores_changed)
+    changes = describe_changes(elements)
+    if any(changes.values()):
+        tasks.attempt_scorm_elements_saved.schedule((attempt, changes), delay=0.1)
@@ -0,0 +1,341 @@
+"""
+    Compute the scores for attempts from their SCORM data, remarked parts and discounted parts.
+
+    An ``AttemptScorer`` loads everything it needs in a fixed number of queries, and then computes the scores for every question and part in memory.
+"""
+
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models import Q
+import re
+
+from .models import Attempt, AttemptCurrentElement, AttemptInteraction, AttemptObjective, AttemptQuestionScore, RemarkPart, DiscountPart
+
+# Apart from the interactions, which are read from the ``AttemptInteraction`` table, only the current values of elements with these keys are needed to compute scores.
+SCORING_KEYS = Q(key__startswith='cmi.score.') | Q(key__startswith='cmi.objectives.')
+
+re_part_path = re.compile(r'q(\d+)p(\d+)(?:g(\d+)|s(\d+))?')
+re_part_with_gaps = re.compile(r'^q\d+p\d+$')
+
+def load_current_values(attempts):
+    """
+        Load the current values of the elements needed to compute scores, for each of the given attempts.
+
+        Returns a dictionary mapping each attempt's primary key to a dictionary ``{key: (value, time, counter)}``.
+    """
+    for attempt in attempts:
+        attempt.ensure_indexes()
+
+    values = {attempt.pk: {} for attempt in attempts}
+    elements = (AttemptCurrentElement.objects
+        .filter(SCORING_KEYS, attempt__in=list(values.keys()))
+        .values_list('attempt', 'key', 'element__value', 'element__time', 'element__counter')
+    )
+    for attempt_pk, key, value, time, counter in elements:
+        values[attempt_pk][key] = (value, time, counter)
+
+    return values
+
+def load_part_index(attempts):
+    """
+        Load the index of interactions and objectives for each of the given attempts.
+
+        Returns a dictionary mapping each attempt's primary key to a tuple ``(interactions, objective_numbers)``,
+        where ``interactions`` maps part paths to ``AttemptInteraction`` objects, and ``objective_numbers`` is a set of objective numbers.
+        If more than one interaction has the same part path, the most recently set is used.
+    """
+    for attempt in attempts:
+        attempt.ensure_indexes()
+
+    index = {attempt.pk: ({}, set()) for attempt in attempts}
+
+    interactions = (AttemptInteraction.objects
+        .filter(attempt__in=list(index.keys()))
+        .exclude(part_path='')
+        .order_by('id_element__time', 'id_element__counter')
+        .only('attempt', 'number', 'part_path', 'weighting', 'result')
+    )
+    for interaction in interactions:
+        index[interaction.attempt_id][0][interaction.part_path] = interaction
+
+    for attempt_pk, number in AttemptObjective.objects.filter(attempt__in=list(index.keys())).values_list('attempt', 'number'):
+        index[attempt_pk][1].add(str(number))
+
+    return index
+
+class AttemptScorer:
+    """
+        Computes the scores of questions and parts in an attempt.
+
+        The data is loaded when the scorer is created, so create a new scorer after the attempt's data changes.
+        To score lots of attempts at once, use ``AttemptScorer.for_attempts``.
+    """
+
+    def __init__(self, attempt, current_values=None, remarked_parts=None, discounted_parts=None, part_index=None):
+        self.attempt = attempt
+
+        if part_index is None:
+            part_index = load_part_index([attempt])[attempt.pk]
+        if remarked_parts is None:
+            remarked_parts = list(attempt.remarked_parts.order_by('pk'))
+        if discounted_parts is None:
+            discounted_parts = list(attempt.resource.discounted_parts.order_by('pk'))
+
+        # The current values of elements are only loaded once a score is needed.
+        self._current_values = current_values
+        self.remarked_parts = remarked_parts
+        self.discounted_parts = discounted_parts
+
+        # The last remark for each part, and the first discount for each part.
+        self.remarks = {r.part: r for r in remarked_parts}
+        self.discounts = {}
+        for d in discounted_parts:
+            self.discounts.setdefault(d.part, d)
+
+        # The interaction for each part, and the numbers of the objectives.
+        self.interactions, self.objective_numbers = part_index
+        self.interaction_ids = {path: str(i.number) for path, i in self.interactions.items()}
+
+    @classmethod
+    def for_attempts(cls, attempts):
+        """
+            Make scorers for a list of attempts, loading the data for all of them at once.
+
+            Returns a dictionary mapping each attempt's primary key to its scorer.
+        """
+        attempts = list(attempts)
+        current_values = load_current_values(attempts)
+        part_index = load_part_index(attempts)
+
+        remarked_parts = defaultdict(list)
+        for r in RemarkPart.objects.filter(attempt__in=attempts).order_by('pk'):
+            remarked_parts[r.attempt_id].append(r)
+
+        resource_pks = set(a.resource_id for a in attempts)
+        discounted_parts = defaultdict(list)
+        for d in DiscountPart.objects.filter(resource__in=resource_pks).order_by('pk'):
+            discounted_parts[d.resource_id].append(d)
+
+        return {
+            a.pk: cls(
+                a,
+                current_values = current_values[a.pk],
+                remarked_parts = remarked_parts[a.pk],
+                discounted_parts = discounted_parts[a.resource_id],
+                part_index = part_index[a.pk]
+            )
+            for a in attempts
+        }
+
+    @property
+    def current_values(self):
+        if self._current_values is None:
+            self._current_values = load_current_values([self.attempt])[self.attempt.pk]
+        return self._current_values
+
+    def get_value(self, key, default=None):
+        try:
+            return self.current_values[key][0]
+        except KeyError:
+            if callable(default):
+                default = default()
+            return default
+
+    def has_remark_starting_with(self, prefix):
+        return any(part.startswith(prefix) for part in self.remarks)
+
+    def has_discount_starting_with(self, prefix):
+        return any(part.startswith(prefix) for part in self.discounts)
+
+    def part_discount(self, part):
+        return self.discounts.get(part)
+
+    def part_remark(self, part):
+        return self.remarks.get(part)
+
+    def part_paths(self):
+        """ Paths to all parts in this attempt. """
+        return set(self.interaction_ids.keys())
+
+    def part_hierarchy(self):
+        """
+            Returns an object
+                {
+                    question_num: {
+                        part_num: {
+                            gaps: [list of gap indices],
+                            steps: [list of step indices]
+                        }
+                    }
+                }
+        """
+        paths = sorted(self.part_paths(),key=lambda x:(len(x),x))
+        out = defaultdict(lambda: defaultdict(lambda: {'gaps':[],'steps':[]}))
+        for path in paths:
+            m = re_part_path.match(path)
+            p = out[m.group(1)][m.group(2)]
+            if m.group(3):
+                p['gaps'].append(m.group(3))
+            elif m.group(4):
+                p['steps'].append(m.group(4))
+
+        return out
+
+    def part_gaps(self, part):
+        if not re_part_with_gaps.match(part):
+            return []
+        return [g for g in self.part_paths() if g.startswith(part+'g')]
+
+    def part_interaction_id(self, part):
+        return self.interaction_ids.get(part)
+
+    def part_raw_score(self, part, include_remark=True):
+        if self.part_discount(part):
+            return self.part_max_score(part)
+
+        remark = self.part_remark(part)
+        if include_remark and remark is not None:
+            return remark.score
+
+        if (include_remark and self.has_remark_starting_with(part+'g')) or self.has_discount_starting_with(part+'g'):
+            return sum(self.part_raw_score(g,include_remark) for g in self.part_gaps(part))
+
+        interaction = self.interactions.get(part)
+        if interaction is None:
+            return 0
+
+        return interaction.result or 0.0
+
+    def part_max_score(self, part):
+        discount = self.part_discount(part)
+        if discount and discount.behaviour == 'remove':
+            return 0
+
+        if self.has_discount_starting_with(part+'g'):
+            return sum(self.part_max_score(g) for g in self.part_gaps(part))
+
+        interaction = self.interactions.get(part)
+        if interaction is None:
+            return 0
+
+        return interaction.weighting or 0.0
+
+    def question_score_info(self, n):
+        """
+            Returns a tuple ``(scaled_score, raw_score, max_score, completion_status)`` for question ``n``.
+        """
+        qid = 'q{}'.format(n)
+        if self.has_remark_starting_with(qid) or self.has_discount_starting_with(qid):
+            re_question_part = re.compile(r'^q{}p\d+$'.format(n))
+            total_raw = 0.0
+            total_max = 0.0
+            for part in self.part_paths():
+                if re_question_part.match(part):
+                    total_raw += self.part_raw_score(part)
+                    total_max += self.part_max_score(part)
+            raw_score = total_raw
+            scaled_score = total_raw/total_max if total_max>0 else 0.0
+            max_score = total_max
+        else:
+            raw_score = float(self.get_value('cmi.objectives.{}.score.raw'.format(n),0))
+            scaled_score = float(self.get_value('cmi.objectives.{}.score.scaled'.format(n),0))
+            max_score = float(self.get_value('cmi.objectives.{}.score.max'.format(n),0))
+
+        completion_status = self.get_value('cmi.objectives.{}.completion_status'.format(n),'not attempted')
+
+        return (scaled_score, raw_score, max_score, completion_status)
+
+    def question_raw_score(self, n):
+        return self.question_score_info(n)[1]
+
+    def question_max_score(self, n):
+        return self.question_score_info(n)[2]
+
+    def question_numbers(self):
+        return sorted(self.objective_numbers, key=int)
+
+    def raw_score(self):
+        if self.remarked_parts or self.discounted_parts:
+            return sum(self.question_raw_score(i) for i in range(self.attempt.resource.num_questions))
+
+        return float(self.get_value('cmi.score.raw',0))
+
+    def max_score(self):
+        if self.discounted_parts:
+            return sum(self.question_max_score(i) for i in range(self.attempt.resource.num_questions))
+
+        return float(self.get_value('cmi.score.max', lambda: sum(self.question_max_score(i) for i in range(self.attempt.resource.num_questions))))
+
+def rescore_attempts(attempts, chunk_size=200, progress=None):
+    """
+        Recompute the stored question scores and total scores of the given attempts.
+
+        The attempts are loaded a chunk at a time, and the scores for each chunk are computed in memory and written back in a few bulk queries.
+        ``progress``, if given, is called after each chunk with the number of attempts done so far and the total number of attempts.
+    """
+    pks = list(attempts.order_by('pk').values_list('pk', flat=True))
+    total = len(pks)
+
+    # MySQL upserts on any unique key, and doesn't let you name the fields.
+    if connection.features.supports_update_conflicts_with_target:
+        upsert_target = {'unique_fields': ['attempt', 'number']}
+    else:
+        upsert_target = {}
+
+    for i in range(0, total, chunk_size):
+        chunk = list(Attempt._base_manager.filter(pk__in=pks[i:i+chunk_size]).select_related('resource'))
+        scorers = AttemptScorer.for_attempts(chunk)
+
+        question_scores = []
+        changed_attempts = []
+        for attempt in chunk:
+            scorer = scorers[attempt.pk]
+
+            for n in range(attempt.resource.num_questions):
+                scaled_score, raw_score, max_score, completion_status = scorer.question_score_info(n)
+                question_scores.append(AttemptQuestionScore(attempt=attempt, number=n, scaled_score=scaled_score, raw_score=raw_score, max_score=max_score, completion_status=completion_status))
+
+            raw_score = scorer.raw_score()
+            max_score = scorer.max_score()
+            scaled_score = raw_score/max_score if max_score>0 else 0
+            if (attempt.cached_raw_score, attempt.cached_max_score, attempt.scaled_score) != (raw_score, max_score, scaled_score):
+                attempt.cached_raw_score = raw_score
+                attempt.cached_max_score = max_score
+                attempt.scaled_score = scaled_score
+                changed_attempts.append(attempt)
+
+        with transaction.atomic():
+            AttemptQuestionScore.objects.bulk_create(
+                question_scores,
+                update_conflicts = True,
+                update_fields = ['scaled_score', 'raw_score', 'max_score', 'completion_status'],
+                **upsert_target
+            )
+            Attempt._base_manager.bulk_update(changed_attempts, ['cached_raw_score', 'cached_max_score', 'scaled_score'])
+
+        if progress is not None:
+            progress(min(i+chunk_size, total), total)
+
+def store_total_scores(attempts, chunk_size=100, progress=None):
+    """
+        Compute and store the raw and maximum scores of the given attempts, with ``Attempt.update_stored_scores``.
+        Unlike ``rescore_attempts``, this doesn't change the attempts' scaled scores or question scores, so it can't change which attempt counts towards a student's grade.
+
+        ``progress``, if given, is called after each chunk with the number of attempts done so far and the total number of attempts.
+        Returns the number of attempts whose stored scores changed.
+    """
+    pks = list(attempts.order_by('pk').values_list('pk', flat=True))
+    total = len(pks)
+    num_changed = 0
+
+    for i in range(0, total, chunk_size):
+        chunk = list(Attempt._base_manager.filter(pk__in=pks[i:i+chunk_size]).select_related('resource'))
+        scorers = AttemptScorer.for_attempts(chunk)
+        for attempt in chunk:
+            if attempt.update_stored_scores(scorers[attempt.pk]):
+                num_changed += 1
+
+        if progress is not None:
+            progress(min(i+chunk_size, total), total)
+
+    return num_changed
@@ -0,0 +1,427 @@
+"""
+    An optional write-behind buffer for SCORM data sent by clients.
+
+    When the ``SCORM_DATA_BUFFER`` setting is set, batches of SCORM data are appended to a durable queue and acknowledged to the client straight away.
+    The ``flush_scorm_data_buffer`` management command reads the queue in order, and saves the batches for many attempts at once with ``save_scorm_data_for_attempts``.
+
+    Only one flusher can run for each buffer at a time, so the batches for each attempt are always saved in the order they were received.
+    Entries are only removed from the queue once they've been saved, so if the flusher stops part-way through, the entries it was working on are read again when it restarts.
+    Saving SCORM data is idempotent, so it doesn't matter if an entry is saved twice.
+If an entry can't be saved, it's moved to a dead-letter store so that it doesn't hold up the rest of the queue.
+"""
+
+from abc import ABC, abstractmethod
+from django.conf import settings
+from django.utils.module_loading import import_string
+import fcntl
+import functools
+import json
+import logging
+import os
+
+from .models import Attempt
+from .save_scorm_data import save_scorm_data, save_scorm_data_for_attempts
+
+logger = logging.getLogger(__name__)
+
+class FlusherAlreadyRunning(Exception):
+    pass
+
+@functools.cache
+def get_scorm_data_buffer():
+    """
+        The buffer configured by the ``SCORM_DATA_BUFFER`` setting, or ``None`` if SCORM data should be saved straight to the database.
+    """
+    config = getattr(settings, 'SCORM_DATA_BUFFER', None)
+    if not config:
+        return None
+
+    backend = import_string(config['BACKEND'])
+    return backend(config['LOCATION'], config.get('OPTIONS', {}))
+
+class ScormDataBuffer(ABC):
+    """
+        Base class for SCORM data buffer backends.
+
+        Each entry in the buffer is a dictionary ``{'attempt': attempt_pk, 'batches': {batch_id: [elements]}}``, identified by a string.
+    """
+
+    def __init__(self, location, options):
+        self.location = location
+        self.options = options
+
+    @abstractmethod
+    def append(self, attempt_pk, batches):
+        """
+            Durably add a batch to the end of the buffer.
+            Returns the ID of the new entry.
+        """
+
+    @abstractmethod
+    def read(self, count):
+        """
+            Read up to ``count`` entries that haven't been acknowledged, oldest first.
+            Returns a list of pairs ``(entry_id, entry)``.
+            If an entry can't be decoded, ``entry`` is ``None``.
+        """
+
+    @abstractmethod
+    def pending(self):
+        """
+            Iterate over all of the entries that haven't been acknowledged, oldest first, as pairs ``(entry_id, entry)``.
+            Unlike ``read``, this doesn't claim the entries, so it can be called while the flusher is running.
+        """
+
+    @abstractmethod
+    def ack(self, entry_ids):
+        """
+            Remove entries that have been saved to the database.
+            ``entry_ids`` is the list of IDs of entries returned by the last call to ``read``.
+        """
+
+    @abstractmethod
+    def dead_letter(self, entry_id, entry):
+        """
+            Durably store an entry that couldn't be saved, so that it can be inspected later.
+            The entry must still be acknowledged afterwards.
+        """
+
+    @abstractmethod
+    def flushed(self, entry_id):
+        """
+            Has the entry with the given ID been saved to the database?
+        """
+
+    @abstractmethod
+    def flusher_lock(self):
+        """
+            A context manager which is held by the flusher while it runs.
+            Raises ``FlusherAlreadyRunning`` if another flusher holds it.
+            The returned object has a ``refresh`` method, which the flusher calls regularly to show it's still running.
+        """
+
+    def save_pending_for_attempt(self, attempt, batches):
+        """
+            Save the given batches for an attempt, and any of its entries still in the buffer, straight to the database.
+
+            This is used when an attempt ends, so it can be finalised without waiting for the flusher.
+            The flusher will save the entries again later, which doesn't matter because saving is idempotent.
+
+            Returns the same as ``save_scorm_data``.
+        """
+        pending_batches = {}
+        for entry_id, entry in self.pending():
+            if entry is not None and entry['attempt'] == attempt.pk:
+                pending_batches.update(entry['batches'])
+        pending_batches.update(batches)
+        done, unsaved_elements = save_scorm_data(attempt, pending_batches)
+        return [batch_id for batch_id in done if batch_id in batches], unsaved_elements
+
+    def flush(self, count=1000):
+        """
+            Save up to ``count`` entries from the buffer to the database.
+
+            The batches for each attempt are merged, in the order they were received, and all of the elements are saved with one bulk insert.
+            If that fails, each attempt's batches are saved separately, and if an attempt's batches still can't be saved then each of its entries is saved on its own.
+            Entries that can't be saved are moved to the dead-letter store.
+
+            Returns the number of entries that were read.
+        """
+        entries = self.read(count)
+        if not entries:
+            return 0
+
+        attempt_entries = {}
+        for entry_id, entry in entries:
+            if entry is None:
+                logger.error(f"Couldn't decode SCORM data buffer entry {entry_id}")
+                self.dead_letter(entry_id, entry)
+                continue
+            attempt_entries.setdefault(entry['attempt'], []).append((entry_id, entry))
+
+        attempts = Attempt.objects.select_related('resource').in_bulk(attempt_entries.keys())
+        missing = set(attempt_entries.keys()) - set(attempts.keys())
+        if missing:
+            logger.warning(f"Discarding buffered SCORM data for attempts that don't exist: {', '.join(str(pk) for pk in missing)}")
+
+        try:
+            results = save_scorm_data_for_attempts([(attempt, merge_batches(attempt_entries[pk])) for pk, attempt in attempts.items()])
+        except Exception:
+            logger.exception(f"Couldn't save buffered SCORM data for {len(attempts)} attempts at once. Saving each attempt separately.")
+            results = {}
+            for pk, attempt in attempts.items():
+                results.update(self.flush_attempt(attempt, attempt_entries[pk]))
+
+        for pk, (done, unsaved_elements) in results.items():
+            if unsaved_elements:
+                logger.error(f"Couldn't save {len(unsaved_elements)} buffered SCORM elements for attempt {pk}: {json.dumps(unsaved_elements)}")
+
+        self.ack([entry_id for entry_id, entry in entries])
+
+        return len(entries)
+
+    def flush_attempt(self, attempt, entries):
+        """
+            Save the buffered entries for one attempt.
+            If they can't all be saved together, save each entry on its own, and move the ones that fail to the dead-letter store.
+        """
+        try:
+            return save_scorm_data_for_attempts([(attempt, merge_batches(entries))])
+        except Exception:
+            logger.exception(f"Couldn't save buffered SCORM data for attempt {attempt.pk}. Saving each entry separately.")
+
+        done, unsaved_elements = [], []
+        for entry_id, entry in entries:
+            try:
+                entry_done, entry_unsaved = save_scorm_data_for_attempts([(attempt, entry['batches'])])[attempt.pk]
+            except Exception:
+                logger.exception(f"Couldn't save SCORM data buffer entry {entry_id} for attempt {attempt.pk}: {json.dumps(entry)}")
+                self.dead_letter(entry_id, entry)
+                continue
+            done += entry_done
+            unsaved_elements += entry_unsaved
+        return {attempt.pk: (done, unsaved_elements)}
+
+def merge_batches(entries):
+    """
+        Merge the batches from a list of entries, in the order they were received.
+    """
+    batches = {}
+    for entry_id, entry in entries:
+        batches.update(entry['batches'])
+    return batches
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise FlusherAlreadyRunning(f"Another process holds the lock {self.path}")
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+    def refresh(self):
+        pass
+
+class AppendOnlyFileBuffer(ScormDataBuffer):
+    """
+        A buffer stored in an append-only file of JSON lines, in the directory given by ``LOCATION``.
+
+        This only works when all of the server processes and the flusher run on the same machine.
+
+        The position of the first entry which hasn't been saved is stored in a separate state file.
+        Once every entry has been saved, the file is truncated and its generation number is increased, so entry IDs have the form ``generation:offset``, where ``offset`` is the position of the end of the entry.
+    """
+
+    def __init__(self, location, options):
+        super().__init__(location, options)
+        os.makedirs(location, exist_ok=True)
+        self.log_path = os.path.join(location, 'scorm_data.jsonl')
+        self.state_path = os.path.join(location, 'scorm_data.state')
+        self.lock_path = os.path.join(location, 'flusher.lock')
+        self.dead_letter_path = os.path.join(location, 'dead_letter.jsonl')
+
+    def read_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'generation': 0, 'offset': 0}
+
+    def write_state(self, state):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def append(self, attempt_pk, batches):
+        line = json.dumps({'attempt': attempt_pk, 'batches': batches}).encode('utf-8') + b'\n'
+        with open(self.log_path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = self.read_state()
+                end = f.seek(0, os.SEEK_END)
+                if end > 0:
+                    # If a previous write was interrupted, end its line so that this entry can still be read.
+                    f.seek(end - 1)
+                    if f.read(1) != b'\n':
+                        line = b'\n' + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                end = f.tell()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return '{}:{}'.format(state['generation'], end)
+
+    def read(self, count):
+        entries = []
+        for entry in self.pending():
+            if len(entries) >= count:
+                break
+            entries.append(entry)
+        return entries
+
+    def pending(self):
+        state = self.read_state()
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(state['offset'])
+                while True:
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        # Either the end of the file, or an entry that's still being written.
+                        break
+                    entry_id = '{}:{}'.format(state['generation'], f.tell())
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        entry = None
+                    yield (entry_id, entry)
+        except FileNotFoundError:
+            pass
+
+    def ack(self, entry_ids):
+        if not entry_ids:
+            return
+        state = self.read_state()
+        offset = max(int(entry_id.split(':')[1]) for entry_id in entry_ids)
+        with open(self.log_path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if f.seek(0, os.SEEK_END) == offset:
+                    # Every entry has been saved, so start a new file.
+                    f.truncate(0)
+                    state = {'generation': state['generation'] + 1, 'offset': 0}
+                else:
+                    state = {'generation': state['generation'], 'offset': offset}
+                self.write_state(state)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def dead_letter(self, entry_id, entry):
+        line = json.dumps({'id': entry_id, 'entry': entry}).encode('utf-8') + b'\n'
+        with open(self.dead_letter_path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def flushed(self, entry_id):
+        generation, offset = (int(x) for x in entry_id.split(':'))
+        state = self.read_state()
+        return state['generation'] > generation or state['offset'] >= offset
+
+    def flusher_lock(self):
+        return FileLock(self.lock_path)
+
+class RedisLock:
+    def __init__(self, lock):
+        self.lock = lock
+
+    def __enter__(self):
+        if not self.lock.acquire(blocking=False):
+            raise FlusherAlreadyRunning(f"Another process holds the lock {self.lock.name}")
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+    def refresh(self):
+        self.lock.reacquire()
+
+class RedisStreamBuffer(ScormDataBuffer):
+    """
+        A buffer stored in a Redis stream, at the Redis server whose URL is given by ``LOCATION``.
+
+        The Redis server should be configured to write changes to disk with ``appendonly yes`` and ``appendfsync always`` or ``everysec``, depending on how much data you're prepared to lose if it crashes.
+
+        Options:
+
+        * ``STREAM`` - the name of the stream. Default ``numbas_lti:scorm_data``.
+        * ``DEAD_LETTER_STREAM`` - the name of the stream that entries which couldn't be saved are moved to. Default the name of the stream followed by ``:dead``.
+        * ``LOCK_TIMEOUT`` - the number of seconds after which a flusher that hasn't refreshed its lock is assumed to have died. Default 60.
+    """
+
+    group = 'flusher'
+    consumer = 'flusher'
+
+    def __init__(self, location, options):
+        super().__init__(location, options)
+        import redis
+        self.redis = redis
+        self.client = redis.Redis.from_url(location)
+        self.stream = options.get('STREAM', 'numbas_lti:scorm_data')
+        self.dead_letter_stream = options.get('DEAD_LETTER_STREAM', self.stream + ':dead')
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 60)
+
+    def append(self, attempt_pk, batches):
+        entry_id = self.client.xadd(self.stream, {'data': json.dumps({'attempt': attempt_pk, 'batches': batches})})
+        return entry_id.decode('utf-8')
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except self.redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise e
+
+    def read(self, count):
+        self.ensure_group()
+
+        # First, read any entries which were delivered to the flusher but not acknowledged, because it stopped before saving them.
+        for start in ('0', '>'):
+            response = self.client.xreadgroup(self.group, self.consumer, {self.stream: start}, count=count)
+            entries = []
+            for stream, messages in response:
+                for entry_id, fields in messages:
+                    entries.append((entry_id.decode('utf-8'), self.decode_entry(fields)))
+            if entries:
+                return entries
+
+        return []
+
+    def decode_entry(self, fields):
+        try:
+            return json.loads(fields[b'data'])
+        except (KeyError, TypeError, json.JSONDecodeError):
+            # Entries which were deleted while pending have no fields.
+            return None
+
+    def pending(self, chunk_size=1000):
+        start = '-'
+        while True:
+            messages = self.client.xrange(self.stream, start, '+', count=chunk_size)
+            for entry_id, fields in messages:
+                yield (entry_id.decode('utf-8'), self.decode_entry(fields))
+            if len(messages) < chunk_size:
+                return
+            start = '(' + messages[-1][0].decode('utf-8')
+
+    def ack(self, entry_ids):
+        if not entry_ids:
+            return
+        pipe = self.client.pipeline()
+        pipe.xack(self.stream, self.group, *entry_ids)
+        pipe.xdel(self.stream, *entry_ids)
+        pipe.execute()
+
+    def dead_letter(self, entry_id, entry):
+        self.client.xadd(self.dead_letter_stream, {'id': entry_id, 'data': json.dumps(entry)})
+
+    def flushed(self, entry_id):
+        return not self.client.xrange(self.stream, entry_id, entry_id)
+
+    def flusher_lock(self):
+        return RedisLock(self.client.lock(self.stream + ':flusher', timeout=self.lock_timeout))
@@ -1,5 +1,3 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from datetime import timedelta
 from django.dispatch import receiver
 from django.conf import settings
@@ -9,14 +7,13 @@ from huey.contrib.djhuey import HUEY
 import logging
 from lxml import etree
 import os
-import re
 import shutil
 from zipfile import ZipFile
 
 from . import tasks
-from .groups import group_for_resource, group_for_attempt
+from .groups import group_for_resource
 from .report_outcome import report_outcome
-from .models import Exam, ScormElement, Resource, Attempt, ExtractPackage, FileReport, LTI_13_Context, LTI_13_ResourceLink, AccessChange
+from .models import Exam, Resource, Attempt, ExtractPackage, FileReport, LTI_13_Context, LTI_13_ResourceLink, AccessChange
 
 
 logger = logging.getLogger(__name__)
@@ -127,19 +124,12 @@ def fetch_context_lineitems(sender, instance, created, **kwargs):
 
     tasks.fetch_lti_13_ags_lineitems(context)
 
-@receiver(models.signals.post_save,sender=ScormElement)
-def send_scorm_element_to_dashboard(sender,instance,created,**kwargs):
-    if not created:
-        return
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(group_for_attempt(instance.attempt), {'type': 'scorm.new.element','element':instance.as_json()})
-
 @receiver(models.signals.post_save,sender=Attempt)
 def send_score_on_attempt_creation(sender, instance, created, **kwargs):
     if not created:
         return
     if instance.resource.report_mark_time == 'immediately':
-        tasks.attempt_report_outcome.schedule((instance,), delay=0.1)
+        tasks.schedule_attempt_report_outcome(instance)
 
 @receiver(models.signals.post_save,sender=Attempt)
 def send_receipt_on_completion(sender,instance, **kwargs):
@@ -152,43 +142,6 @@ def send_receipt_on_completion(sender,instance, **kwargs):
             tasks.send_attempt_completion_receipt.schedule((attempt,), delay=0.1)
 
 
-@receiver(models.signals.post_save,sender=ScormElement)
-def scorm_set_score(sender,instance,created,**kwargs):
-    if instance.key!='cmi.score.scaled' or not created:
-        return
-
-    if not instance.newer_than(instance.attempt.scaled_score_element):
-        return
-
-    tasks.scorm_set_score.schedule((instance,), delay=0.1)
-    tasks.scorm_set_score.schedule((instance, True), delay=10)
-
-@receiver(models.signals.post_save,sender=ScormElement)
-def scorm_set_completion_status(sender,instance,created,**kwargs):
-    if instance.key!='cmi.completion_status' or not created:
-        return
-
-    if not instance.newer_than(instance.attempt.completion_status_element):
-        return
-
-    tasks.scorm_set_completion_status.schedule((instance,), delay=0.1)
-
-@receiver(models.signals.post_save,sender=ScormElement)
-def scorm_set_start_time(sender,instance,created,**kwargs):
-    if instance.key != 'cmi.suspend_data' or not created:
-        return
-
-    tasks.scorm_set_start_time.schedule((instance,), delay=0.1)
-
-@receiver(models.signals.post_save,sender=ScormElement)
-def scorm_set_num_questions(sender,instance,created,**kwargs):
-    """ Set the number of questions for this resource - can only work this out once the exam has been run! """
-    if not re.match(r'^cmi.objectives.([0-9]+).id$',instance.key) or not created:
-        return
-
-    number = int(re.match(r'q(\d+)',instance.value).group(1))+1
-    tasks.scorm_set_num_questions.schedule((instance.attempt.resource, number,), delay=0.1)
-
 @receiver(models.signals.pre_delete, sender=FileReport)
 def delete_file_report(sender,instance,**kwargs):
     instance.outfile.delete()
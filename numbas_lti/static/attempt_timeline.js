@@ -358,6 +358,11 @@ const app = createApp({
                     case 'scorm.new.element':
                         dm.add_element(data.element);
                         break;
+                    case 'scorm.new.elements':
+                        data.elements.forEach(function(element) {
+                            dm.add_element(element);
+                        });
+                        break;
                 }
             }
         },
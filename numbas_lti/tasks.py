@@ -2,7 +2,8 @@ import csv
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib import messages
-from django.db.models import Count
+from django.core.cache import cache
+from django.db.models import Count, Max, OuterRef, Subquery
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from functools import wraps
@@ -10,9 +11,11 @@ from huey import crontab
 from huey.contrib.djhuey import periodic_task, task, db_periodic_task, db_task
 import json
 import logging
-from numbas_lti.report_outcome import ReportOutcomeException, report_outcome, report_all_resource_scores
-from numbas_lti.models import Attempt, ScormElement, diff_scormelements, FileReport, EditorLink, Resource, AccessChange
+from numbas_lti.report_outcome import ReportOutcomeException, report_outcome, report_all_resource_scores, retry_pending_outcome_reports
+from numbas_lti.models import Attempt, ScormElement, diff_scormelements, diff_at_ingest, FileReport, EditorLink, Resource, AccessChange, LTIUserData, LTI_13_UserAlias, pick_source_id
 import re
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -30,17 +33,21 @@ def send_attempt_completion_receipt(attempt):
     attempt.send_completion_receipt()
 
 @db_task(priority=200)
-def resource_report_scores(resource, automatic=False):
+def resource_report_scores(resource, automatic=False, force=False):
     logger.debug(f"Report scores for resource {resource}")
     resource = Resource.objects.get(pk=resource.pk)
-    report_all_resource_scores(resource)
+    report_all_resource_scores(resource, force=force)
 
 @db_task(priority=200)
 def access_change_report_scores(access_change, resource):
     logger.debug(f"Report scores for users affected by access change {access_change}")
     access_change = AccessChange.objects.get(pk=access_change.pk)
     for user in access_change.affected_users():
-        report_outcome(access_change.resource, user)
+        try:
+            report_outcome(access_change.resource, user)
+        except ReportOutcomeException:
+            # The report has been added to the outbox, and will be sent again by send_pending_outcome_reports.
+            pass
 
 @db_task(priority=200)
 def attempt_report_outcome(attempt):
@@ -49,10 +56,68 @@ def attempt_report_outcome(attempt):
     try:
         report_outcome(attempt.resource, attempt.user)
     except ReportOutcomeException:
+        # The report has been added to the outbox, and will be sent again by send_pending_outcome_reports.
         pass
 
+def scheduled_report_key(resource, user):
+    return f'numbas_lti:report_outcome:scheduled:{resource.pk}:{user.pk}'
+
+def schedule_attempt_report_outcome(attempt):
+    """
+        Report the score of the student who made this attempt soon, collapsing bursts of requests for the same student and resource into one report.
+
+        The report is sent once there have been no more requests for ``REPORT_OUTCOME_QUIET_PERIOD`` seconds,
+        but no later than ``REPORT_OUTCOME_MAX_STALENESS`` seconds after the first request in the burst.
+        The schedule is kept in the default cache: if that isn't shared between processes, requests made in different processes are reported separately.
+    """
+    quiet_period = getattr(settings, 'REPORT_OUTCOME_QUIET_PERIOD', 5)
+    max_staleness = getattr(settings, 'REPORT_OUTCOME_MAX_STALENESS', 60)
+
+    resource = attempt.resource
+    user = attempt.user
+    key = scheduled_report_key(resource, user)
+
+    t = time.time()
+    scheduled = cache.get(key)
+    first_request = scheduled['first_request'] if scheduled is not None else t
+    token = uuid.uuid4().hex
+    cache.set(key, {'first_request': first_request, 'token': token}, max_staleness + quiet_period + 60)
+
+    delay = max(0.1, min(quiet_period, first_request + max_staleness - t))
+    coalesced_report_outcome.schedule((resource, user, token), delay=delay)
+
+@db_task(priority=200)
+def coalesced_report_outcome(resource, user, token):
+    key = scheduled_report_key(resource, user)
+    scheduled = cache.get(key)
+    if scheduled is not None and scheduled['token'] != token:
+        # There's been another request since this one, which will report the score instead.
+        return
+    cache.delete(key)
+
+    logger.debug(f"Report score for {user} on resource {resource}")
+    resource = Resource.objects.get(pk=resource.pk)
+    try:
+        report_outcome(resource, user)
+    except ReportOutcomeException:
+        # The report has been added to the outbox, and will be sent again by send_pending_outcome_reports.
+        pass
+
+@db_periodic_task(crontab(minute='*'),priority=200)
+def send_pending_outcome_reports():
+    """
+        Send again the outcome reports in the outbox whose next attempt is due.
+    """
+    num_tried = retry_pending_outcome_reports()
+    if num_tried:
+        logger.info(f"Tried again to send {num_tried} pending outcome reports")
+
 @db_periodic_task(crontab(minute='*'),priority=0)
 def diff_suspend_data():
+    """
+        Diff the suspend data of attempts that have new suspend data which hasn't been diffed yet.
+        When SCORM_DIFF_AT_INGEST is on, this only picks up attempts saved before it was turned on, or whose diffs failed.
+    """
     logger.debug("Diff suspend data")
     attempts = Attempt.objects.filter(diffed=False)
     MAX_TIME = 10
@@ -67,41 +132,32 @@ def diff_suspend_data():
                 break
     logger.debug(f"Diffed {num_diffed} attempts")
 
-@db_task(priority=10)
-def scorm_set_score(element, fetch=False):
-    attempt = Attempt.objects.get(pk=element.attempt.pk)
-
-    logger.debug(f"Set score for attempt {attempt}")
-
-    if fetch:
-        try:
-            element = attempt.scormelements.current('cmi.score.scaled')
-        except ScormElement.DoesNotExist:
-            return
-
+def set_score_from_element(attempt, element):
+    """
+        Set the attempt's scaled score from a ``cmi.score.scaled`` element.
+        Returns ``True`` if the score changed.
+    """
     try:
         score = float(element.value)
     except ValueError:
-        return
+        return False
 
     if element == attempt.scaled_score_element:
-        return
+        return False
 
     attempt.scaled_score_element = element
     attempt.scaled_score = score
     attempt.save(update_fields=['scaled_score', 'scaled_score_element'])
 
-    if attempt.resource.report_mark_time == 'immediately':
-        attempt_report_outcome.schedule((attempt,),delay=0.1)
-
-@db_task(priority=10)
-def scorm_set_completion_status(element):
-    attempt = element.attempt
-
-    logger.debug(f"Set completion status for attempt {attempt}")
+    return True
 
+def set_completion_status_from_element(attempt, element):
+    """
+        Set the attempt's completion status from a ``cmi.completion_status`` element.
+        Returns ``True`` if the completion status changed.
+    """
     if element.value == attempt.completion_status:
-        return
+        return False
     
     attempt.completion_status = element.value
     attempt.completion_status_element = element
@@ -111,15 +167,12 @@ def scorm_set_completion_status(element):
         update_fields.append('end_time')
     attempt.save(update_fields=update_fields)
 
-    if attempt.resource.report_mark_time in ('oncompletion', 'immediately') and attempt.completion_status=='completed':
-        attempt_report_outcome.schedule((attempt,),delay=0.1)
-
-@db_task(priority=9)
-def scorm_set_start_time(element):
-    attempt = element.attempt
-
-    logger.debug(f"Set start time for attempt {attempt}")
+    return True
 
+def set_start_time_from_element(attempt, element):
+    """
+        Set the attempt's start time from the time recorded in a ``cmi.suspend_data`` element.
+    """
     try:
         data = json.loads(element.value)
         if data['start'] is not None:
@@ -135,20 +188,95 @@ def scorm_set_start_time(element):
     attempt.start_time = start_time
     attempt.save(update_fields=['start_time'])
 
-@db_task(priority=9)
-def scorm_set_num_questions(resource,number):
-    logger.debug(f"Set num questions for resource {resource} to {number}")
-    if number>resource.num_questions:
-        resource.num_questions = number
+@db_task(priority=10)
+def scorm_set_score(element, fetch=False):
+    attempt = Attempt.objects.get(pk=element.attempt.pk)
+
+    logger.debug(f"Set score for attempt {attempt}")
+
+    if fetch:
+        try:
+            element = attempt.scormelements.current('cmi.score.scaled')
+        except ScormElement.DoesNotExist:
+            return
+
+    if set_score_from_element(attempt, element) and attempt.resource.report_mark_time == 'immediately':
+        schedule_attempt_report_outcome(attempt)
+
+@db_task(priority=10)
+def scorm_set_completion_status(element):
+    attempt = element.attempt
+
+    logger.debug(f"Set completion status for attempt {attempt}")
+
+    if set_completion_status_from_element(attempt, element):
+        if attempt.resource.report_mark_time in ('oncompletion', 'immediately') and attempt.completion_status=='completed':
+            schedule_attempt_report_outcome(attempt)
+
+@db_task(priority=10)
+def attempt_scorm_elements_saved(attempt, changes):
+    """
+        Update the data derived from an attempt's SCORM elements after a batch of new elements has been saved.
+        ``changes`` is a summary of the batch, produced by ``save_scorm_data.describe_changes``.
+
+        The current values of the relevant elements are read when the task runs, so it doesn't matter if tasks for consecutive batches run out of order.
+    """
+    attempt = Attempt.objects.get(pk=attempt.pk)
+    resource = attempt.resource
+
+    logger.debug(f"Update attempt {attempt} after new SCORM elements were saved")
+
+    if changes['num_questions'] > resource.num_questions:
+        resource.num_questions = changes['num_questions']
         resource.save(update_fields=['num_questions'])
 
+    if changes['question_scores'] or changes['exam_score']:
+        attempt_update_score_info.call_local(attempt, changes['question_scores'])
+
+    report = False
+
+    if changes['completion_status']:
+        try:
+            element = attempt.scormelements.current('cmi.completion_status')
+            if set_completion_status_from_element(attempt, element):
+                report = report or (resource.report_mark_time in ('oncompletion', 'immediately') and attempt.completion_status=='completed')
+        except ScormElement.DoesNotExist:
+            pass
+
+    if changes['score']:
+        try:
+            element = attempt.scormelements.current('cmi.score.scaled')
+            if set_score_from_element(attempt, element):
+                report = report or resource.report_mark_time == 'immediately'
+        except ScormElement.DoesNotExist:
+            pass
+
+    if changes['suspend_data']:
+        try:
+            set_start_time_from_element(attempt, attempt.scormelements.current('cmi.suspend_data'))
+        except ScormElement.DoesNotExist:
+            pass
+
+        if diff_at_ingest():
+            try:
+                diff_scormelements(attempt)
+            except Exception:
+                logger.exception(f"Error diffing suspend data for attempt {attempt}")
+                # Leave it for the diff_suspend_data task to try again.
+                Attempt.objects.filter(pk=attempt.pk).update(diffed=False)
+
+    if report:
+        schedule_attempt_report_outcome(attempt)
+
 @db_task(priority=20)
 def attempt_update_score_info(attempt,question_scores_changed):
-    for number in question_scores_changed:
-        attempt.update_question_score_info(number)
+    scorer = attempt.get_scorer()
+    attempt.update_question_scores(question_scores_changed, scorer)
+    attempt.update_stored_scores(scorer)
 
-    if attempt.max_score>0:
-        scaled_score = attempt.raw_score/attempt.max_score if attempt.max_score != 0 else 0
+    max_score = attempt.cached_max_score
+    if max_score>0:
+        scaled_score = attempt.cached_raw_score/max_score
     else:
         scaled_score = 0
     if scaled_score != attempt.scaled_score:
@@ -157,9 +285,14 @@ def attempt_update_score_info(attempt,question_scores_changed):
 
 @db_task(priority=15)
 def resource_update_score_info(resource):
-    changed_questions = list(range(resource.num_questions))
-    for attempt in resource.attempts.all():
-        attempt_update_score_info(attempt,changed_questions)
+    from numbas_lti.scoring import rescore_attempts
+
+    logger.info(f"Rescore attempts at resource {resource}")
+
+    def progress(done, total):
+        logger.info(f"Rescored {done}/{total} attempts at resource {resource}")
+
+    rescore_attempts(resource.attempts.all(), progress=progress)
 
 def report_task(writer):
     """ 
@@ -203,24 +336,49 @@ def csv_report_task(row_iterator):
 
 @csv_report_task
 def resource_scores_csv_report(fr):
+    """
+        Each student's grade on the resource.
+        The rows come from one query, read a chunk at a time, so the number of queries and the memory used don't grow with the number of students.
+    """
+    from numbas_lti.scoring import store_total_scores
+
     logger.debug(f"Create scores CSV report {fr}")
     resource = fr.resource
 
     headers = [_(x) for x in ['First name','Last name','Email','Username','Percentage','Raw score', 'Max score']]
     yield headers
 
-    for student in resource.students().all():
-        user_data = resource.user_data(student)
-        username = '' if user_data is None else user_data.get_source_id()
-        attempt, completion_status, submitted_at = resource.grade_user(student)
-        scaled_score = attempt.scaled_score
-        student_attempts = resource.attempts.filter(user=student)
-        max_score = max(a.max_score for a in student_attempts) if student_attempts.exists() else 0
+    # Attempts started before total scores were stored need them computed once.
+    # Only the stored totals are filled in: making a report shouldn't change anyone's grade.
+    store_total_scores(resource.attempts.filter(cached_max_score__isnull=True))
+
+    user_data = LTIUserData.objects.filter(resource=resource, user=OuterRef('pk')).order_by('-pk')
+    graded_attempts = resource.gradeable_attempts().filter(user=OuterRef('pk')).order_by(*resource.grading_order())
+    max_scores = Attempt.objects.filter(resource=resource, user=OuterRef('pk')).order_by().values('user').annotate(max_score=Max('cached_max_score')).values('max_score')
+
+    lti_13_aliases = LTI_13_UserAlias.objects.filter(user=OuterRef('pk'), consumer=OuterRef('lti_consumer')).exclude(lis_person_sourcedid__isnull=True).exclude(lis_person_sourcedid='').order_by('-pk')
+
+    students = (resource.students()
+        .annotate(
+            lti_consumer = Subquery(user_data.values('consumer')[:1]),
+            lti_11_sourcedid = Subquery(user_data.values('lti_11__lis_person_sourcedid')[:1]),
+            consumer_user_id = Subquery(user_data.values('consumer_user_id')[:1]),
+            grade_scaled_score = Subquery(graded_attempts.values('scaled_score')[:1]),
+            max_score = Subquery(max_scores),
+        )
+        .annotate(lti_13_sourcedid = Subquery(lti_13_aliases.values('lis_person_sourcedid')[:1]))
+        .values_list('pk', 'first_name', 'last_name', 'email', 'lti_11_sourcedid', 'lti_13_sourcedid', 'consumer_user_id', 'grade_scaled_score', 'max_score')
+    )
+
+    for pk, first_name, last_name, email, lti_11_sourcedid, lti_13_sourcedid, consumer_user_id, scaled_score, max_score in students.iterator(chunk_size=1000):
+        username = pick_source_id(lti_11_sourcedid, lti_13_sourcedid, consumer_user_id) or ''
+        scaled_score = scaled_score or 0
+        max_score = max_score or 0
         raw_score = scaled_score * max_score    # This might introduce a rounding error
         yield (
-            student.first_name,
-            student.last_name,
-            student.email,
+            first_name,
+            last_name,
+            email,
             username,
             scaled_score*100,
             raw_score,
@@ -238,6 +396,7 @@ def resource_attempts_csv_report(fr):
     for attempt in resource.attempts.all():
         user_data = resource.user_data(attempt.user)
         username = '' if user_data is None else user_data.get_source_id()
+        scorer = attempt.get_scorer()
         row = [
             attempt.user.first_name,
             attempt.user.last_name,
@@ -249,7 +408,7 @@ def resource_attempts_csv_report(fr):
             attempt.completion_status,
             attempt.raw_score,
             attempt.scaled_score*100,
-        ]+[attempt.question_raw_score(n) for n in range(num_questions)]
+        ]+[scorer.question_raw_score(n) for n in range(num_questions)]
         yield row
 
 @report_task
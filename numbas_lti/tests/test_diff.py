@@ -1,5 +1,76 @@
+from diff_match_patch import diff_match_patch
+import random
 from unittest import TestCase
-from numbas_lti.diff import make_diff, apply_diff
+from numbas_lti.diff import make_diff, apply_diff, full_value_diff, escape, unescape
+
+def legacy_make_diff(a, b):
+    """
+        The original implementation of ``make_diff``, with no time or size budget.
+    """
+    dmp = diff_match_patch()
+
+    i = 0
+    j = 0
+    diffs = dmp.diff_main(a, b)
+    output = []
+    for n, (op, s) in enumerate(diffs):
+        l = len(s)
+        if op == diff_match_patch.DIFF_EQUAL:
+            i += l
+            j += l
+        elif op == diff_match_patch.DIFF_DELETE:
+            output.append(f'd{i:x},{i+l:x}')
+            i += l
+        elif op == diff_match_patch.DIFF_INSERT:
+            es = escape(s)
+            if n>0 and diffs[n-1][0] == diff_match_patch.DIFF_DELETE:
+                output.pop()
+                output.append(f'r{i-len(diffs[n-1][1]):x},{i:x},{es}')
+            else:
+                output.append(f'i{i:x},{es}')
+            j += l
+    return '\n'.join(output)
+
+def legacy_apply_diff(d,a):
+    """
+        The original implementation of ``apply_diff``, which rebuilds the whole string for every operation.
+    """
+    ops = d.split('\n')
+    o = 0
+    for op in ops:
+        if not op:
+            continue
+        if op[0]=='d':
+            i1,i2 = [int(x,16) for x in op[1:].split(',')]
+            a = a[:o+i1]+a[i2+o:]
+            o -= (i2-i1)
+        elif op[0]=='i':
+            bits = op[1:].split(',')
+            i = int(bits[0],16)
+            s = unescape(','.join(bits[1:]))
+            a = a[:i+o]+s+a[i+o:]
+            o += len(s)
+        elif op[0]=='r':
+            bits = op[1:].split(',')
+            i1 = int(bits[0],16)
+            i2 = int(bits[1],16)
+            s = unescape(','.join(bits[2:]))
+            a = a[:i1+o]+s+a[i2+o:]
+            o += len(s)-(i2-i1)
+    return a
+
+def random_edits(rng, a, alphabet, num_edits):
+    b = list(a)
+    for j in range(num_edits):
+        k = rng.randrange(len(b)) if b else 0
+        action = rng.choice('dir') if b else 'i'
+        if action == 'd':
+            del b[k]
+        elif action == 'i':
+            b.insert(k, rng.choice(alphabet))
+        else:
+            b[k] = rng.choice(alphabet)
+    return ''.join(b)
 
 class DiffTest(TestCase):
 
@@ -49,3 +120,66 @@ class DiffTest(TestCase):
             'a\\b\\c',
             '\\a\\B\\c\\d'
         )
+
+    def test_comma_in_inserted_text(self):
+        self.generic_test_diff_restores(
+            'a,b',
+            'a,,x,y,b,'
+        )
+
+    def test_many_changes(self):
+        rng = random.Random(1)
+        alphabet = 'abc,\\\n'
+        a = ''.join(rng.choice(alphabet) for i in range(2000))
+        for i in range(20):
+            b = random_edits(rng, a, alphabet, 50)
+            self.generic_test_diff_restores(a, b)
+            a = b
+
+    def test_max_length_falls_back_to_full_value(self):
+        a = 'the quick brown fox'
+        b = 'the quick brown dog'
+        diff = make_diff(a, b, max_length=10)
+        self.assertEqual(diff, full_value_diff(a, b))
+        self.assertEqual(apply_diff(diff, a), b)
+
+    def test_full_value_when_shorter(self):
+        a = 'abcdefgh'
+        b = 'hgfedcba'
+        diff = make_diff(a, b)
+        self.assertLessEqual(len(diff), len(full_value_diff(a, b)))
+        self.assertEqual(apply_diff(diff, a), b)
+
+    def test_no_change(self):
+        self.assertEqual(make_diff('same', 'same'), '')
+        self.assertEqual(apply_diff('', 'same'), 'same')
+
+    def test_same_as_legacy_make_diff(self):
+        """
+            ``make_diff`` gives the same diff as the implementation it replaced, unless that diff would be at least as long as replacing the whole string.
+        """
+        rng = random.Random(2)
+        alphabet = 'abc,\\\n'
+        for i in range(500):
+            a = ''.join(rng.choice(alphabet) for j in range(rng.randrange(0, 200)))
+            b = random_edits(rng, a, alphabet, rng.randrange(0, 100))
+            with self.subTest(a=a, b=b):
+                diff = make_diff(a, b)
+                legacy_diff = legacy_make_diff(a, b)
+                if diff != legacy_diff:
+                    self.assertEqual(diff, full_value_diff(a, b))
+                    self.assertGreaterEqual(len(legacy_diff), len(diff))
+
+    def test_same_as_legacy_apply_diff(self):
+        """
+            ``apply_diff`` gives the same result as the implementation it replaced, on diffs made by either version of ``make_diff``.
+        """
+        rng = random.Random(3)
+        alphabet = 'abc,\\\n'
+        for i in range(500):
+            a = ''.join(rng.choice(alphabet) for j in range(rng.randrange(0, 200)))
+            b = random_edits(rng, a, alphabet, rng.randrange(0, 100))
+            for diff in (make_diff(a, b), legacy_make_diff(a, b)):
+                with self.subTest(a=a, b=b, diff=diff):
+                    self.assertEqual(apply_diff(diff, a), b)
+                    self.assertEqual(legacy_apply_diff(diff, a), b)
@@ -0,0 +1,135 @@
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from numbas_lti.models import Resource, Attempt, ScormElement, ScormElementDiff, diff_scormelements, rebuild_scormelement_diffs, resolve_diffed_scormelements
+
+def suspend_data(n):
+    """
+        A value of ``cmi.suspend_data`` which changes a little bit each time ``n`` increases.
+    """
+    return '{"answers": [' + ', '.join(str(i*i) for i in range(n)) + ']}'
+
+class DiffChainTest(TestCase):
+    """
+        Tests for the chains of diffs that suspend data is stored as.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='student')
+        self.resource = Resource.objects.create(report_mark_time='manually')
+        self.attempt = Attempt.objects.create(resource=self.resource, user=self.user)
+        self.start = timezone.now()
+        self.values = {}
+
+    def add_elements(self, numbers):
+        """
+            Save an element with the value ``suspend_data(n)`` for each ``n`` in ``numbers``, ``n`` seconds after the start of the test.
+        """
+        for n in numbers:
+            e = ScormElement.objects.create(attempt=self.attempt, key='cmi.suspend_data', value=suspend_data(n), time=self.start + timedelta(seconds=n))
+            self.values[e.pk] = e.value
+
+    def elements(self):
+        return list(self.attempt.scormelements.filter(key='cmi.suspend_data').select_related('diff'))
+
+    def full_values(self):
+        """
+            The times, in seconds after the start, of the elements whose full values are stored.
+        """
+        return [round((e.time - self.start).total_seconds()) for e in self.elements() if not hasattr(e, 'diff')]
+
+    def chain_lengths(self):
+        return {round((d.element.time - self.start).total_seconds()): d.chain_length for d in ScormElementDiff.objects.filter(element__attempt=self.attempt).select_related('element')}
+
+    def assertValuesRestored(self):
+        for e in resolve_diffed_scormelements(self.elements()):
+            self.assertEqual(e.value, self.values[e.pk])
+
+    @override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=3, SCORM_DIFF_CHECKPOINT_BYTES=1000000)
+    def test_version_checkpoints(self):
+        self.add_elements(range(10))
+        diff_scormelements(self.attempt)
+
+        self.assertEqual(self.full_values(), [9, 5, 1])
+        self.assertEqual(self.chain_lengths(), {8: 1, 7: 2, 6: 3, 4: 1, 3: 2, 2: 3, 0: 1})
+        self.assertValuesRestored()
+
+    @override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=1000, SCORM_DIFF_CHECKPOINT_BYTES=100)
+    def test_byte_checkpoints(self):
+        self.add_elements(range(20))
+        diff_scormelements(self.attempt)
+
+        diffs = ScormElementDiff.objects.filter(element__attempt=self.attempt)
+        self.assertGreater(len(self.full_values()), 1)
+        self.assertTrue(all(d.chain_size <= 100 for d in diffs))
+        for d in diffs:
+            if d.chain_length == 1:
+                self.assertEqual(d.chain_size, len(d.element.value.encode('utf-8')))
+        self.assertValuesRestored()
+
+    @override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=3, SCORM_DIFF_CHECKPOINT_BYTES=1000000)
+    def test_relink_head(self):
+        """
+            When new elements are diffed, the previous head becomes a diff, and the lengths of the chains leading to it grow.
+            Once a chain would be too long, the old head is kept as a checkpoint.
+        """
+        self.add_elements([0, 1])
+        diff_scormelements(self.attempt)
+        self.assertEqual(self.full_values(), [1])
+        self.assertEqual(self.chain_lengths(), {0: 1})
+
+        self.add_elements([2, 3])
+        diff_scormelements(self.attempt)
+        self.assertEqual(self.full_values(), [3])
+        self.assertEqual(self.chain_lengths(), {2: 1, 1: 2, 0: 3})
+        head = self.attempt.scormelements.get(time=self.start + timedelta(seconds=1))
+        self.assertEqual(head.diff.diff_of.time, self.start + timedelta(seconds=2))
+
+        self.add_elements([4])
+        diff_scormelements(self.attempt)
+        self.assertEqual(self.full_values(), [4, 3])
+        self.assertEqual(self.chain_lengths(), {2: 1, 1: 2, 0: 3})
+        self.assertValuesRestored()
+
+    @override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=2, SCORM_DIFF_CHECKPOINT_BYTES=1000000)
+    def test_scorm_cmi_at_time(self):
+        self.add_elements(range(8))
+        diff_scormelements(self.attempt)
+        self.assertGreater(len(self.full_values()), 1)
+
+        for n in range(8):
+            cmi = self.attempt.scorm_cmi(at_time=self.start + timedelta(seconds=n))
+            self.assertEqual(cmi['cmi.suspend_data']['value'], suspend_data(n))
+
+    def test_rebuild(self):
+        self.add_elements(range(10))
+        with override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=1000):
+            diff_scormelements(self.attempt)
+        self.assertEqual(self.full_values(), [9])
+
+        with override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=2):
+            rebuild_scormelement_diffs(self.attempt)
+        self.assertEqual(self.full_values(), [9, 6, 3, 0])
+        self.assertEqual(self.chain_lengths(), {8: 1, 7: 2, 5: 1, 4: 2, 2: 1, 1: 2})
+        self.assertValuesRestored()
+
+        with override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=1000):
+            rebuild_scormelement_diffs(self.attempt)
+        self.assertEqual(self.full_values(), [9])
+        self.assertValuesRestored()
+
+    @override_settings(SCORM_DIFF_CHECKPOINT_VERSIONS=1000, SCORM_DIFF_CHECKPOINT_BYTES=1000000)
+    def test_out_of_order_arrival(self):
+        """
+            An element which arrives after newer elements have been diffed is diffed too, so there's still only one full value.
+        """
+        self.add_elements([0, 2, 4])
+        diff_scormelements(self.attempt)
+        self.assertEqual(self.full_values(), [4])
+
+        self.add_elements([3, 5, 1])
+        diff_scormelements(self.attempt)
+        self.assertEqual(self.full_values(), [5])
+        self.assertEqual(self.chain_lengths(), {4: 1, 3: 2, 2: 3, 1: 4, 0: 5})
+        self.assertValuesRestored()
@@ -0,0 +1,240 @@
+from collections import OrderedDict
+import random
+import re
+from unittest import TestCase
+from numbas_lti.examparser.examparser import ExamParser, ParseError, printdata, is_number, is_int
+
+class LegacyExamParser(ExamParser):
+    """
+        The original implementation of ``ExamParser``, which scans the source one character at a time.
+        The current implementation should give the same output on every input.
+    """
+
+    #scan past comments
+    def lstripcomments(self):
+        os=self.source[self.cursor:]
+        s = os.lstrip()
+        s=s.lstrip()    #get rid of leading whitespace
+
+        while s[:2]=='//':
+            s=s[s.find('\n')+1:].lstrip()
+        self.cursor += len(os)-len(s)
+
+    def stripspace(self):
+        os = self.source[self.cursor:]
+        s=os.lstrip(' \t\r\x0b\x0c')
+        self.cursor += len(os)-len(s)
+
+    def getthing(self):
+        self.lstripcomments()
+
+        f=self.source[self.cursor]
+
+        if f=='{':    #object
+            self.cursor+=1
+            self.lstripcomments()
+
+            obj = OrderedDict()
+            while self.cursor<len(self.source) and self.source[self.cursor]!='}':
+                i=self.cursor
+                namere = re.compile(r'^[\w_]*\'*$')
+                while i<len(self.source) and self.source[i]!=':':
+                    name = self.source[self.cursor:i+1].strip()
+                    if(not namere.match(name)):
+                        raise ParseError(self,"Invalid name '%s' for an object property" % name,"check for mismatched brackets")
+                    i+=1
+                if i==len(self.source):
+                    raise ParseError(self,"Expected a colon")
+
+                name = self.source[self.cursor:i].rstrip().lower()
+                self.cursor = i+1
+                thing = self.getthing()
+                obj[name] = thing
+
+                self.stripspace()
+
+                if self.source[self.cursor]=='\n':
+                    self.cursor +=1
+                    self.lstripcomments()
+
+                elif self.source[self.cursor:self.cursor+2]=='//':
+                    self.lstripcomments()
+                else:
+                    self.lstripcomments()
+                    if self.source[self.cursor]==',' or self.source[self.cursor]=='\n':
+                        self.cursor+=1
+                        self.lstripcomments()
+                    elif self.source[self.cursor]=='}':
+                        break
+                    else:
+                        raise ParseError(self,'Expected either } or , in object definition')
+            if self.cursor == len(self.source):
+                raise ParseError(self,'Expected a } to close an object')
+
+            self.cursor +=1
+            return obj
+
+        elif f=='[':    #array
+            self.cursor += 1
+            self.lstripcomments()
+
+            arr=[]
+            while self.cursor<len(self.source) and self.source[self.cursor]!=']':
+                thing = self.getthing()
+                arr.append(thing)
+
+                self.stripspace()
+
+                if self.source[self.cursor]=='\n':
+                    self.cursor+=1
+                    self.lstripcomments()
+                elif self.source[self.cursor:self.cursor+2]=='//':
+                    self.lstripcomments()
+                else:
+                    self.lstripcomments()
+                    if self.source[self.cursor]==',':
+                        self.cursor +=1
+                    elif self.source[self.cursor]==']':
+                        break
+                    else:
+                        raise ParseError(self,"Expected either , or ] in array definition")
+            if self.cursor == len(self.source):
+                raise ParseError(self,'Expected a ] to end an array')
+            self.cursor +=1
+            return arr
+
+        elif f=='"':    #string literal - double quotes
+            if self.source[self.cursor:self.cursor+3]=='"""':    #triple-quoted  string
+                i=self.cursor+3
+                while i<len(self.source)-2 and self.source[i:i+3]!='"""':
+                    i+=1
+                while i<len(self.source)-3 and self.source[i+3]=='"':    #grab extra double-quotes which are part of the string. e.g. """"hi"""" parses as the string "hi", with double-quotes included
+                    i+=1
+                if i==len(self.source)-2:
+                    raise ParseError(self,'Expected """ to end string literal')
+                string = self.source[self.cursor+3:i]
+                self.cursor = i+3
+            else:
+                i=self.cursor+1
+                while i<len(self.source) and self.source[i]!='"':
+                    i+=1
+                if i==len(self.source):
+                    raise ParseError(self,'Expected " to end string literal')
+                string = self.source[self.cursor+1:i]
+                self.cursor = i+1
+            return string
+        elif f=="'":    #string literal - single quotes
+            if self.source[self.cursor:self.cursor+3]=="'''":    #triple-quoted  string
+                i=self.cursor+3
+                while i<len(self.source)-2 and self.source[i:i+3]!="'''":
+                    i+=1
+                while i<len(self.source)-3 and self.source[i+3]=="'":    #grab extra quotes which are part of the string. e.g. ''''hi'''' parses as the string "hi", with quotes included
+                    i+=1
+                if i==len(self.source)-2:
+                    raise ParseError(self,"Expected ''' to end string literal")
+                string = self.source[self.cursor+3:i]
+                self.cursor = i+3
+            else:
+                i=self.cursor+1
+                while i<len(self.source) and self.source[i]!="'":
+                    i+=1
+                if i==len(self.source):
+                    raise ParseError(self,"Expected ' to end string literal")
+                string = self.source[self.cursor+1:i]
+                self.cursor = i+1
+            return string
+        else:    #undelimited literal
+            i=self.cursor
+            while i<len(self.source) and self.source[i] not in ']}\n,:' and self.source[i:i+2]!='//':
+                i+=1
+            
+            v=self.source[self.cursor:i].strip()
+            l=v.lower()
+            if is_number(v):
+                if is_int(v):
+                    v=int(v)
+                else:
+                    v=float(v)
+            elif l=='true':
+                v=True
+            elif l=='false':
+                v=False
+
+            self.cursor = i
+            return v
+
+def parse(parser_class, source):
+    try:
+        return parser_class().parse(source)
+    except (ParseError, IndexError) as e:
+        return e.__class__, str(e)
+
+class ExamParserTest(TestCase):
+
+    def parse(self, source):
+        return ExamParser().parse(source)
+
+    def test_object(self):
+        data = self.parse('''
+        //comment
+        {             //comment!
+            a: """ "hi"    //comment
+        said the man"""    //comment
+            b: howdy, c: there    //comment
+            d: "sailor,man"    //comment asd
+
+            e: geoff        //comment
+            f: [eggs , beans,{a:hi}]
+        }
+        ''')
+        self.assertEqual(data, OrderedDict([
+            ('a', ' "hi"    //comment\n        said the man'),
+            ('b', 'howdy'),
+            ('c', 'there'),
+            ('d', 'sailor,man'),
+            ('e', 'geoff'),
+            ('f', ['eggs', 'beans', OrderedDict([('a', 'hi')])]),
+        ]))
+
+    def test_literals(self):
+        data = self.parse('{a: 1, b: 2.5, c: true, D: False, e: infinity, f: a/b //comment\n}')
+        self.assertEqual(data, {'a': 1, 'b': 2.5, 'c': True, 'd': False, 'e': 'infinity', 'f': 'a/b'})
+
+    def test_strings(self):
+        data = self.parse("""[ 'single', "double", '''triple 'single' ''', \"\"\"\"\"quoted\"\"\"\"\", '' ]""")
+        self.assertEqual(data, ['single', 'double', "triple 'single' ", '""quoted""', ''])
+
+    def test_comment_at_end(self):
+        with self.assertRaisesRegex(ParseError, 'Expected a } to close an object'):
+            self.parse('{a: 1 // the end')
+
+    def test_invalid_name(self):
+        with self.assertRaisesRegex(ParseError, "Invalid name 'a b'"):
+            self.parse('{a b: 1}')
+
+    def test_unmatched_brackets(self):
+        with self.assertRaisesRegex(ParseError, "Didn't parse all input"):
+            self.parse('{a: 1}}')
+
+    def test_round_trip(self):
+        data = OrderedDict([
+            ('name', 'An exam: with punctuation, "quotes" and // slashes'),
+            ('questions', [OrderedDict([('parts', [1, 2.5, True, 'text'])]), OrderedDict()]),
+            ('blank', ' '),
+        ])
+        self.assertEqual(self.parse(printdata(data)), data)
+
+    def test_same_as_legacy_parser(self):
+        """
+            The parser gives the same output, or the same error, as the implementation it replaced, on random sources made of fragments of exam source.
+            Every comment ends with a line break, because the original implementation never finishes on a comment at the end of the input.
+        """
+        fragments = [
+            '{', '}', '[', ']', ',', ':', '\n', ' ', '\t', '\r\n', '\x0c', '// comment\n', 'a/b', 'a', 'name', "name'", 'a b', '_x',
+            '1', '-2.5', '1e3', 'true', 'False', 'infinity', '"', '"string"', '"""', '""""', "'", "'string'", "'''", "''''", 'é', '\u00a0', '\x1c',
+        ]
+        rng = random.Random(0)
+        for i in range(5000):
+            source = ''.join(rng.choice(fragments) for j in range(rng.randrange(1, 30)))
+            with self.subTest(source=source):
+                self.assertEqual(parse(ExamParser, source), parse(LegacyExamParser, source))
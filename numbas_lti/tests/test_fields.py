@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from numbas_lti.fields import compress_value, decompress_value, COMPRESSED_PREFIX, RAW_PREFIX
+from numbas_lti.models import Resource, Attempt, ScormElement
+
+class CompressValueTest(SimpleTestCase):
+
+    def assertRoundTrip(self, value, threshold=100):
+        stored = compress_value(value, threshold)
+        self.assertEqual(decompress_value(stored), value)
+        return stored
+
+    def test_none(self):
+        self.assertIsNone(compress_value(None, 100))
+        self.assertIsNone(decompress_value(None))
+
+    def test_empty(self):
+        self.assertEqual(self.assertRoundTrip(''), '')
+        self.assertEqual(self.assertRoundTrip('', threshold=0), '')
+
+    def test_below_threshold(self):
+        value = 'a' * 99
+        self.assertEqual(self.assertRoundTrip(value), value)
+
+    def test_at_threshold(self):
+        stored = self.assertRoundTrip('a' * 100)
+        self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+
+    def test_above_threshold(self):
+        stored = self.assertRoundTrip('a' * 101)
+        self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+
+    def test_no_threshold(self):
+        value = 'a' * 10000
+        self.assertEqual(self.assertRoundTrip(value, threshold=None), value)
+
+    def test_incompressible(self):
+        """
+            A value which would be longer when compressed is stored as it is.
+        """
+        value = ''.join(chr(33 + (i * 7919) % 94) for i in range(101))
+        self.assertEqual(self.assertRoundTrip(value), value)
+
+    def test_unicode(self):
+        stored = self.assertRoundTrip('∑ é 😀 ' * 50)
+        self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+
+    def test_looks_compressed(self):
+        for prefix in (COMPRESSED_PREFIX, RAW_PREFIX):
+            for value in (prefix, prefix + 'abc', prefix + RAW_PREFIX + 'abc'):
+                with self.subTest(value=value):
+                    stored = self.assertRoundTrip(value)
+                    self.assertTrue(stored.startswith(RAW_PREFIX))
+
+    def test_long_value_looks_compressed(self):
+        stored = self.assertRoundTrip(COMPRESSED_PREFIX + 'a' * 200)
+        self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+
+@override_settings(SCORM_ELEMENT_COMPRESSION_THRESHOLD=100)
+class CompressedTextFieldTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='student')
+        resource = Resource.objects.create(report_mark_time='manually')
+        self.attempt = Attempt.objects.create(resource=resource, user=user)
+
+    def stored_value(self, element):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT value FROM {ScormElement._meta.db_table} WHERE id = %s', [element.pk])
+            return cursor.fetchone()[0]
+
+    def set_stored_value(self, element, value):
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {ScormElement._meta.db_table} SET value = %s WHERE id = %s', [value, element.pk])
+
+    def test_round_trip(self):
+        for value in ('', 'short', 'a' * 1000, RAW_PREFIX + 'abc', COMPRESSED_PREFIX + 'abc'):
+            with self.subTest(value=value):
+                e = ScormElement.objects.create(attempt=self.attempt, key='cmi.suspend_data', value=value, time=timezone.now())
+                self.assertEqual(ScormElement.objects.get(pk=e.pk).value, value)
+
+    def test_compressed_in_database(self):
+        e = ScormElement.objects.create(attempt=self.attempt, key='cmi.suspend_data', value='a' * 1000, time=timezone.now())
+        self.assertTrue(self.stored_value(e).startswith(COMPRESSED_PREFIX))
+
+    def test_legacy_uncompressed_rows(self):
+        """
+            Rows saved before values were compressed are loaded as they are.
+        """
+        e = ScormElement.objects.create(attempt=self.attempt, key='cmi.suspend_data', value='', time=timezone.now())
+        for value in ('', 'short', 'b' * 1000):
+            with self.subTest(value=value):
+                self.set_stored_value(e, value)
+                self.assertEqual(ScormElement.objects.get(pk=e.pk).value, value)
@@ -0,0 +1,78 @@
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from numbas_lti.models import Resource, Exam, Attempt, LTIUserData
+
+class GradingTest(TestCase):
+    """
+        Tests that ``Resource.grade_all_users`` picks the same attempt for each student as ``Resource.grade_user``.
+    """
+
+    def setUp(self):
+        Exam.objects.bulk_create([Exam(title='An exam', package='exams/exam.zip')])
+        self.resource = Resource.objects.create(exam=Exam.objects.get(), report_mark_time='manually')
+
+        start = timezone.now() - timedelta(days=1)
+
+        # For each student, a list of attempts given as (scaled_score, completion_status, minutes after the start).
+        students = {
+            'one_attempt': [(0.5, 'completed', 0)],
+            'highest_is_not_last': [(0.9, 'completed', 0), (0.2, 'completed', 10)],
+            'tied_scores': [(0.7, 'completed', 0), (0.7, 'completed', 10), (0.3, 'completed', 20)],
+            'tied_start_times': [(0.1, 'completed', 5), (0.6, 'completed', 5)],
+            'incomplete_is_highest': [(0.4, 'completed', 0), (1, 'incomplete', 10)],
+            'only_incomplete': [(0.8, 'incomplete', 0)],
+        }
+
+        self.students = []
+        for username, attempts in students.items():
+            user = User.objects.create(username=username, first_name=username)
+            self.students.append(user)
+            LTIUserData.objects.create(user=user, resource=self.resource)
+            for scaled_score, completion_status, minutes in attempts:
+                attempt = Attempt.objects.create(resource=self.resource, user=user, scaled_score=scaled_score, completion_status=completion_status)
+                Attempt.objects.filter(pk=attempt.pk).update(start_time=start + timedelta(minutes=minutes))
+
+    def set_grading(self, grading_method, include_incomplete_attempts):
+        Resource.objects.filter(pk=self.resource.pk).update(grading_method=grading_method, include_incomplete_attempts=include_incomplete_attempts)
+        self.resource.refresh_from_db()
+
+    def test_grade_all_users_matches_grade_user(self):
+        for grading_method in ('highest', 'last'):
+            for include_incomplete_attempts in (True, False):
+                with self.subTest(grading_method=grading_method, include_incomplete_attempts=include_incomplete_attempts):
+                    self.set_grading(grading_method, include_incomplete_attempts)
+                    # The submission time of an attempt with no end time is the current time, so it's left out.
+                    grades = self.resource.grade_all_users(include_submitted_at=False)
+                    for user in self.students:
+                        expected = self.resource.grade_user(user)
+                        if expected is None:
+                            self.assertNotIn(user.pk, grades)
+                        else:
+                            attempt, completion_status, submitted_at = grades[user.pk]
+                            self.assertIsNone(submitted_at)
+                            self.assertEqual((attempt.pk, completion_status), (expected[0].pk, expected[1]))
+
+    def test_ties_broken_by_newest_attempt(self):
+        self.set_grading('highest', True)
+        user = User.objects.get(username='tied_scores')
+        newest = user.attempts.filter(scaled_score=0.7).order_by('-pk').first()
+        self.assertEqual(self.resource.grade_user(user)[0], newest)
+        self.assertEqual(self.resource.grade_all_users(include_submitted_at=False)[user.pk][0], newest)
+
+    def test_student_progress_view(self):
+        admin = User.objects.create(username='admin', is_superuser=True, is_staff=True)
+        self.client.force_login(admin)
+
+        for grading_method in ('highest', 'last'):
+            with self.subTest(grading_method=grading_method):
+                self.set_grading(grading_method, True)
+                response = self.client.get(reverse('student_progress', args=(self.resource.pk,)))
+                self.assertEqual(response.status_code, 200)
+
+                scores = {data['pk']: data['score'] for data in response.context['student_summary']}
+                for user in self.students:
+                    attempt, completion_status, submitted_at = self.resource.grade_user(user)
+                    self.assertEqual(scores[user.pk], attempt.scaled_score)
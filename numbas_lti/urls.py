@@ -72,6 +72,8 @@ urlpatterns = [
     path('resource/<int:pk>/restore_exam', views.resource.RestoreExamView.as_view(), name='restore_exam'),
     path('resource/<int:pk>/use_current_version', views.resource.AttemptsUseCurrentVersionView.as_view(), name='use_current_version'),
     path('resource/<int:pk>/report_scores', views.resource.ReportAllScoresView.as_view(), name='report_scores'),
+    path('resource/<int:pk>/report_scores/resend', views.resource.ReportAllScoresView.as_view(force=True), name='resend_scores'),
+    path('resource/<int:pk>/pending_reports', views.resource.PendingOutcomeReportsView.as_view(), name='pending_outcome_reports'),
     path('resource/<int:pk>/scores.csv', views.resource.ScoresCSV.as_view(), name='scores_csv'),
     path('resource/<int:pk>/attempts.csv', views.resource.AttemptsCSV.as_view(), name='attempts_csv'),
     path('resource/<int:pk>/attempts.json', views.resource.JSONDumpView.as_view(), name='resource_json_dump'),
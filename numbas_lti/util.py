@@ -107,3 +107,12 @@ def time_from_iso(time: str) -> datetime:
     if time.endswith('Z'):
         time = time[:-1] + '+00:00'
     return datetime.fromisoformat(time)
+
+def parse_float(s):
+    """
+        Parse a string as a float, or return ``None`` if it isn't a number.
+    """
+    try:
+        return float(s)
+    except (TypeError, ValueError):
+        return None
@@ -19,6 +19,7 @@ from numbas_lti import tasks
 from numbas_lti.forms import RemarkPartScoreForm
 from numbas_lti.models import Resource, AccessToken, Exam, Attempt, ScormElement, RemarkPart, AttemptLaunch, resolve_diffed_scormelements, RemarkedScormElement
 from numbas_lti.save_scorm_data import save_scorm_data
+from numbas_lti.scorm_buffer import get_scorm_data_buffer
 from numbas_lti.util import transform_part_hierarchy, add_query_param, iso_time
 import re
 
@@ -33,6 +34,7 @@ class RemarkPartsView(MustHaveExamMixin,ResourceManagementViewMixin,MustBeInstru
 
     def get_parts(self):
         attempt = self.get_object()
+        scorer = attempt.get_scorer()
 
         def row(qnum,q,p,g,parent,has_gaps,path,pletter,**kwargs):
 
@@ -46,13 +48,13 @@ class RemarkPartsView(MustHaveExamMixin,ResourceManagementViewMixin,MustBeInstru
             if parent is not None and parent['discount'] is not None:
                 discount = parent['discount']
             else:
-                discount = attempt.part_discount(path)
+                discount = scorer.part_discount(path)
 
             if p is not None:
                 out.update({
-                    'score': attempt.part_raw_score(path),
-                    'original_score': attempt.part_raw_score(path,include_remark=False),
-                    'max_score': attempt.part_max_score(path),
+                    'score': scorer.part_raw_score(path),
+                    'original_score': scorer.part_raw_score(path,include_remark=False),
+                    'max_score': scorer.part_max_score(path),
                     'discount': discount,
                     'remark': remark,
                     'parent_remarked': parent is not None and parent['remark'] is not None,
@@ -62,7 +64,7 @@ class RemarkPartsView(MustHaveExamMixin,ResourceManagementViewMixin,MustBeInstru
 
             return out
 
-        parts = transform_part_hierarchy(attempt.part_hierarchy(), row)
+        parts = transform_part_hierarchy(scorer.part_hierarchy(), row)
 
         return parts
 
@@ -425,9 +427,19 @@ def scorm_data_fallback(request,pk,*args,**kwargs):
     except Attempt.DoesNotExist:
         raise http.Http404(_("There is no attempt with the ID {}.").format(pk))
     data = json.loads(request.body.decode())
-    batches = data.get('batches',[])
-    done, unsaved_elements = save_scorm_data(attempt,batches)
+    batches = data.get('batches',{})
     complete = data.get('complete',False)
+    buffer = get_scorm_data_buffer()
+    if buffer is not None and complete:
+        # The attempt can only be finalised once all of its data has been saved, so save it now rather than waiting for the flusher.
+        done, unsaved_elements = buffer.save_pending_for_attempt(attempt, batches)
+        attempt.refresh_from_db()
+    elif buffer is not None:
+        if batches:
+            buffer.append(attempt.pk, batches)
+        done, unsaved_elements = list(batches.keys()), []
+    else:
+        done, unsaved_elements = save_scorm_data(attempt,batches)
     response = {
         'received_batches':done,
         'unsaved_elements':unsaved_elements, 
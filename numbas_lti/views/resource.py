@@ -7,13 +7,15 @@ from numbas_lti.models import \
         ReportProcess, DiscountPart, EditorLink, COMPLETION_STATUSES, \
         LTIUserData, ScormElement, RemarkedScormElement, AccessChange, \
         DISCOUNT_BEHAVIOURS, LTIContext, LineItemDoesNotExist, \
-        ExamAnalysis
+        ExamAnalysis, AttemptInteraction
+from numbas_lti.scoring import AttemptScorer
 from numbas_lti.util import transform_part_hierarchy
 from django import http
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.core import signing
+from django.core.exceptions import PermissionDenied
 from django.db.models import Q,Count
 from django.db import transaction
 from django.http import JsonResponse
@@ -33,7 +35,6 @@ from collections import defaultdict
 import csv
 import datetime
 import json
-import itertools
 
 class CreateExamView(HelpLinkMixin, MustBeInstructorMixin, generic.edit.CreateView):
     model = Exam
@@ -235,6 +236,9 @@ class DashboardView(HelpLinkMixin, MustHaveExamMixin,ResourceManagementViewMixin
         if last_report_process and (not last_report_process.dismissed):
             context['last_report_process'] = last_report_process
 
+        context['num_pending_reports'] = resource.pending_outcome_reports.count()
+        context['num_dead_reports'] = resource.pending_outcome_reports.filter(dead=True).count()
+
         return context
 
 class CreateLineitemView(HelpLinkMixin,MustHaveExamMixin,ResourceManagementViewMixin,MustBeInstructorMixin,generic.edit.UpdateView):
@@ -290,8 +294,10 @@ class StudentProgressView(HelpLinkMixin,MustHaveExamMixin,ResourceManagementView
                 'access_tokens': 0,
             }
 
+        grades = resource.grade_all_users(include_submitted_at=False)
+
         def summarise_student(student):
-            attempt, completion_status, submitted_at = resource.grade_user(student)
+            attempt, completion_status, submitted_at = grades.get(student.pk, (None, 'not attempted', None))
             score = attempt.scaled_score if attempt else 0
             lti_data = student.lti_data.filter(resource=resource).last()
 
@@ -299,8 +305,8 @@ class StudentProgressView(HelpLinkMixin,MustHaveExamMixin,ResourceManagementView
 
             if ags_grades is not None:
                 subs = student.lti_13_aliases.all().values_list('sub', flat=True)
-                grades = [g for g in ags_grades if g['userId'] in subs]
-                grade = grades[0] if grades else None
+                user_ags_grades = [g for g in ags_grades if g['userId'] in subs]
+                grade = user_ags_grades[0] if user_ags_grades else None
                 if grade:
                     resultScore = grade.get('resultScore', 0)
                     resultMaximum = grade.get('resultMaximum', 0)
@@ -482,10 +488,14 @@ class ReportAllScoresView(MustHaveExamMixin,MustBeInstructorMixin,ResourceManage
     management_tab = 'dashboard'
     template_name = 'numbas_lti/management/report_all_scores.html'
     context_object_name = 'resource'
+    force = False
 
     def get(self,*args,**kwargs):
         resource = self.get_object()
-        resource.task_report_scores()
+        # Only administrators can send every student's score again, even if it hasn't changed since it was last reported.
+        if self.force and not self.request.user.is_superuser:
+            raise PermissionDenied(_("Only administrators can send unchanged scores again."))
+        resource.task_report_scores(force=self.force)
         return super(ReportAllScoresView,self).get(*args,**kwargs)
 
 @lti_role_or_superuser_required(INSTRUCTOR_ROLES)
@@ -506,6 +516,26 @@ def remove_access_token(request,resource_id,user_id):
 
     return redirect(reverse_with_lti(request, 'resource_dashboard',args=(resource.pk,)))
 
+class PendingOutcomeReportsView(MustHaveExamMixin,ResourceManagementViewMixin,MustBeInstructorMixin,generic.detail.DetailView):
+    """
+        The reports of students' scores which couldn't be sent to the consumer and are waiting to be sent again, including those which have been given up on.
+    """
+    model = Resource
+    management_tab = 'dashboard'
+    template_name = 'numbas_lti/management/pending_outcome_reports.html'
+    context_object_name = 'resource'
+
+    def get_context_data(self,*args,**kwargs):
+        context = super().get_context_data(*args,**kwargs)
+        context['pending_reports'] = self.object.pending_outcome_reports.select_related('user').order_by('-dead','next_attempt_time')
+        return context
+
+    def post(self,request,*args,**kwargs):
+        resource = self.get_object()
+        resource.pending_outcome_reports.update(dead=False, num_attempts=0, next_attempt_time=timezone.now())
+        messages.add_message(request,messages.SUCCESS,_('The pending reports will be sent again in the next minute.'))
+        return redirect(self.reverse_with_lti('pending_outcome_reports',args=(resource.pk,)))
+
 class DismissReportProcessView(MustBeInstructorMixin,generic.detail.DetailView):
     model = ReportProcess
 
@@ -637,17 +667,27 @@ class AnalysisView(HelpLinkMixin, MustHaveExamMixin, ResourceManagementViewMixin
 
         attempts = list(resource.attempts.prefetch_related('cached_question_scores'))
 
-        interactions = ScormElement.objects.filter(attempt__resource=resource, key__regex=r'^cmi\.interactions\.\d+\.(learner_response|id|weighting|result|correct_responses.*)$').order_by('attempt__id').values('attempt__id','key','value')
-
-        interactions_dict = {}
-        for pk, elements in itertools.groupby(interactions, key=lambda x: x['attempt__id']):
-            aints = defaultdict(dict)
-            for e in elements:
-                bits = e['key'].split('.')
-                n = bits[2]
-                key = bits[3]
-                aints[n][key] = e['value']
-            interactions_dict[pk] = {v['id']: [v.get(key,'') for key in ('weighting', 'result', 'learner_response', 'correct_responses')] for v in aints.values() if v.get('id')}
+        for a in attempts:
+            a.ensure_indexes()
+
+        interactions = (AttemptInteraction.objects
+            .filter(attempt__in=attempts)
+            .exclude(part_path='')
+            .order_by('attempt', 'number')
+            .values_list('attempt', 'part_path', 'weighting', 'result', 'learner_response', 'correct_responses')
+        )
+
+        def str_or_empty(x):
+            return '' if x is None else str(x)
+
+        interactions_dict = defaultdict(dict)
+        for pk, part_path, weighting, result, learner_response, correct_responses in interactions:
+            interactions_dict[pk][part_path] = [
+                str_or_empty(weighting),
+                str_or_empty(result),
+                learner_response,
+                correct_responses[0] if correct_responses else '',
+            ]
 
         def attempt_context(a):
             try:
@@ -783,10 +823,12 @@ class RemarkGetAttemptDataView(MustHaveExamMixin,ResourceManagementViewMixin,Mus
             pks = [int(x) for x in pks.split(',')]
         else:
             pks = []
-        attempts = self.resource.attempts.filter(pk__in=pks)
+        attempts = list(self.resource.attempts.filter(pk__in=pks))
+        scorers = AttemptScorer.for_attempts(attempts)
 
         cmis = []
         for a in attempts:
+            scorer = scorers[a.pk]
             cmi = a.scorm_cmi(include_remarked_elements=False)
 
             dynamic_cmi = {
@@ -806,8 +848,8 @@ class RemarkGetAttemptDataView(MustHaveExamMixin,ResourceManagementViewMixin,Mus
 
             cmis.append({
                 'pk': a.pk, 
-                'raw_score': a.raw_score,
-                'max_score': a.max_score,
+                'raw_score': scorer.raw_score(),
+                'max_score': scorer.max_score(),
                 'cmi': cmi,
                 'remarked_elements': remarked_elements,
             })
@@ -838,7 +880,8 @@ class RemarkSaveChangedDataView(MustHaveExamMixin, ResourceManagementViewMixin,
                         new_elements.append(e)
                         RemarkedScormElement.objects.create(element=e,user=request.user)
 
-                    save_scorm_data.update_question_score_info(attempt, new_elements)
+                    attempt.update_current_elements(new_elements)
+                    save_scorm_data.scorm_elements_saved(attempt, new_elements)
                     saved.append(ad['pk'])
             response = {'success': True, 'saved': saved}
             if len(saved)<len(data['attempts']):